@@ -1,7 +1,7 @@
 import tkinter as tk
 from tkinter import ttk
-import csv
-import os
+from las_journal import EditJournal
+from las_storage import append_csv_row, read_csv_rows
 
 # Initialize Tkinter window
 root = tk.Tk()
@@ -10,26 +10,26 @@ root.title("Lot and Sample Management")
 # Initialize data storage (CSV filenames)
 lot_csv = 'lots.csv'
 sample_csv = 'samples.csv'
+samples_journal = EditJournal(sample_csv + '.journal')  # Edited notes, keyed by (sample name, lot name)
 
-# Function to save data to CSV
-def save_to_csv(filename, data):
-    with open(filename, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(data)
-
-# Function to load data from CSV
-def load_from_csv(filename):
-    if not os.path.exists(filename):
-        return []
-    
-    with open(filename, mode='r') as file:
-        reader = csv.reader(file)
-        return [row for row in reader]
+# Functions to save/load data to/from CSV
+save_to_csv = append_csv_row
+load_from_csv = read_csv_rows
 
 # Initialize lot and sample data from CSV files
 lots = load_from_csv(lot_csv)
 samples = load_from_csv(sample_csv)
 
+# Replay notes edited since the journal was last compacted into samples.csv
+sample_key = lambda sample: (sample[1], sample[3]) if len(sample) > 3 else None
+def apply_sample_edit(sample, fields):
+    sample[2] = fields['notes']
+
+edits = samples_journal.latest_edits()
+for sample in samples:
+    if sample_key(sample) in edits:
+        apply_sample_edit(sample, edits[sample_key(sample)])
+
 # Function to add lot
 def add_lot():
     lot_id = lot_id_entry.get()
@@ -48,7 +48,8 @@ def add_sample():
     sample_name = sample_name_entry.get()
     sample_desc = sample_desc_entry.get()
     associated_lot = associated_lot_dropdown.get()
-    save_to_csv(sample_csv, [sample_id, sample_name, sample_desc, associated_lot])
+    with samples_journal.lock:
+        save_to_csv(sample_csv, [sample_id, sample_name, sample_desc, associated_lot])
     samples.append([sample_id, sample_name, sample_desc, associated_lot])
     sample_id_entry.delete(0, 'end')
     sample_name_entry.delete(0, 'end')
@@ -80,12 +81,17 @@ def load_notes():
 def save_edited_notes():
     selected_lot = lot_dropdown.get()
     selected_sample = sample_dropdown.get()
+    notes = notes_text.get(1.0, 'end').strip()
+    edited = False
     for sample in samples:
         if sample[1] == selected_sample and sample[3] == selected_lot:
-            sample[2] = notes_text.get(1.0, 'end').strip()
-            with open(sample_csv, 'w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerows(samples)
+            sample[2] = notes
+            edited = True
+    if edited:
+        # Append the edit to the journal rather than rewriting samples.csv
+        samples_journal.append([selected_sample, selected_lot], {'notes': notes})
+        if samples_journal.should_compact():
+            samples_journal.compact_in_background(sample_csv, sample_key, apply_sample_edit)
 
 # Add Lot section
 add_lot_frame = ttk.LabelFrame(root, text="Add Lot")
@@ -1,23 +1,14 @@
 from datetime import datetime
 import tkinter as tk
 from tkinter import ttk, messagebox
-import random
-import csv
 
-CSV_FILE = 'lots_and_samples.csv'
-FIELDNAMES = ['datetime', 'Lot', 'Serial', 'FullCode', 'Name', 'Notes', 'Active']  # Added 'Active'
-
-try:
-    with open(CSV_FILE, 'x', newline='') as f:
-        csv.DictWriter(f, fieldnames=FIELDNAMES).writeheader()
-        csv.DictWriter(f, fieldnames=FIELDNAMES).writerow({'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
-except FileExistsError:
-    pass
-
-generate_code = lambda length: ''.join([str(random.randint(0, 9)) for _ in range(length)])
+from las_archive import ArchiveStore, archive_path
+from las_codes import CODES_FILE, CodeAllocator
+from las_storage import open_storage
 
 class LotSampleApp:
     def __init__(self, root):
+        self.storage = open_storage()
         self.root, self.lots, self.samples = root, [], []
         [setattr(self, attr, tk.StringVar()) for attr in ['lot_name', 'sample_name', 'selected_lot', 'selected_sample']]
         self.sample_active = tk.BooleanVar(value=False)
@@ -119,17 +110,14 @@ class LotSampleApp:
             messagebox.showinfo("Not Found", "No sample found with the provided code.")
 
     def add_lot(self):
-        lot_code = generate_code(8)
+        lot_code = self.codes.lot_code()
         lot = {
             'Lot': lot_code,
             'Name': self.lot_name.get(),
             # Other fields remain empty for a lot entry
         }
 
-        with open(CSV_FILE, 'a', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
-            
-            writer.writerow(lot)
+        self.storage.add_lot(lot)
 
         self.lots.append(lot)
         self.update_lot_dropdown()
@@ -144,24 +132,18 @@ class LotSampleApp:
 
 
     def return_lot_name(self, lot_id):
-        with open(CSV_FILE, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row['Lot'] == lot_id and not row['Serial']:
-                    return row['Name']
-        return None
+        return self.storage.lot_name(lot_id)
 
     def load_data(self):
         self.samples = []
         self.lots = []
-        with open(CSV_FILE, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row['Lot'] and not row['Serial']:  # It's a lot
-                    self.lots.append(row)
-                if row['Serial']:  # It's a sample
-                    row['Active'] = row['Active'] == 'True'  # Convert string to boolean
-                    self.samples.append(row)
+        for row in self.storage.rows():
+            if row['Lot'] and not row['Serial']:  # It's a lot
+                self.lots.append(row)
+            if row['Serial']:  # It's a sample
+                row['Active'] = row['Active'] == 'True'  # Convert string to boolean
+                self.samples.append(row)
+        self.codes = CodeAllocator(self.lots, self.samples, CODES_FILE, ArchiveStore(archive_path(self.storage)))
         self.update_lot_dropdown()
         self.load_selected_sample()
 
@@ -176,7 +158,11 @@ class LotSampleApp:
             messagebox.showerror("Error", "Selected lot does not exist.")
             return  # This should never happen if the UI is consistent with the data
 
-        sample_code = generate_code(4)  # Assuming generate_code is a function that generates a random 4-digit code
+        try:
+            sample_code = self.codes.serial(lot_code)  # A 4-digit serial not yet used in this lot
+        except ValueError as error:
+            messagebox.showerror("Error", f"Cannot add a sample to this lot: {error}")
+            return
         full_code = lot_code + sample_code  # The full 12-digit code consists of the lot and sample codes
 
         sample = {
@@ -188,11 +174,8 @@ class LotSampleApp:
             'Notes': '',
             'Active': 'False',  # By default, a new sample is not active
         }
-        # Saving the sample to the CSV file
-        with open(CSV_FILE, 'a', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
-            
-            writer.writerow(sample)
+        # Saving the sample to the data file
+        self.storage.add_sample(sample)
 
         # Provide the full code for the user (could be used for QR code generation or other identification methods)
         self.generated_code_display.config(state="normal")  # Enable writing to the widget
@@ -317,19 +300,9 @@ class LotSampleApp:
             if selected_sample:
                 selected_sample['Active'] = 'True' if self.sample_active.get() else 'False'
             
-            # Now, save the updated data back to the CSV file
+            # Now, persist just this sample's changes
             if sample_updated:
-                with open(CSV_FILE, 'w', newline='') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
-                    writer.writeheader()  # Write the headers first
-                    # Write the lots
-                    for lot in self.lots:
-                        
-                        writer.writerow(lot)
-                    # Write the samples
-                    for sample in self.samples:
-                        
-                        writer.writerow(sample)
+                self.storage.update_sample(selected_sample['FullCode'], {'Notes': selected_sample['Notes'], 'Active': selected_sample['Active']})
 
 # Run the application
 root = tk.Tk()
@@ -1,24 +1,43 @@
-from datetime import datetime
+import itertools
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
-import random
-import csv
-
-CSV_FILE = 'lots_and_samples.csv'
-FIELDNAMES = ['datetime', 'Lot', 'Serial', 'FullCode', 'Name', 'Notes', 'Active']  # Added 'Active'
-
-try:
-    with open(CSV_FILE, 'x', newline='') as f:
-        csv.DictWriter(f, fieldnames=FIELDNAMES).writeheader()
-        csv.DictWriter(f, fieldnames=FIELDNAMES).writerow({'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
-except FileExistsError:
-    pass
-
-generate_code = lambda length: ''.join([str(random.randint(0, 9)) for _ in range(length)])
+from tkinter import ttk, messagebox, filedialog
+
+from las_archive import ArchiveStore, archive_path, find_unloaded
+from las_codes import CODES_FILE, CodeAllocator
+from las_core import bulk_load, is_active, merge_updates, new_lot, new_sample
+from las_import import plan_import, read_import_file
+from las_index import LotSampleIndex
+from las_labels import print_labels
+from las_metrics import DUMP_PATH, DUMP_SECONDS, ENABLED as METRICS_ENABLED, metrics, wrap, wrap_storage
+from las_picker import PrefixIndex, SearchablePicker
+from las_records import Sample
+from las_scan import UNKNOWN, ScanSession
+from las_search import TextIndex
+from las_storage import open_storage
+from las_worker import StorageWorker
+
+SAMPLE_CHUNK = 10_000  # Samples parsed per worker job while streaming; small enough to index within a frame
+SCAN_LOG_LINES = 200  # Most recent scans listed in the check-in window
+LAG_PROBE_MS = 100  # With LAS_METRICS set, how often to measure how late the Tk event loop runs a timer
+
+# Lookups are timed too when LAS_METRICS is set; without it these calls change nothing
+wrap(LotSampleIndex, ['sample_by_code', 'sample_in_lot', 'lot_code', 'lot_name', 'samples_in_lot'])
+wrap(TextIndex, ['search'])
 
 class LotSampleApp:
     def __init__(self, root):
         self.root, self.lots, self.samples = root, [], []
+        self.index = LotSampleIndex()
+        self.lot_name_index = PrefixIndex()  # Shared by both lot pickers
+        self.text_index = TextIndex()  # Words in sample Names and Notes, keyed by FullCode
+        self.codes = CodeAllocator()
+        self.storage = open_storage()  # SQLite once lots_and_samples.csv has been migrated, the CSV otherwise
+        self.worker = StorageWorker(root, on_error=lambda error: messagebox.showerror("Error", str(error)))  # All storage I/O runs here
+        self.writes_submitted = 0  # Lets a load that raced with our own writes notice it is stale
+        self.loading, self.load_generation, self.after_load = False, 0, []  # Sample streaming state
+        self.load_started = 0.0
+        self.instrument()
         [setattr(self, attr, tk.StringVar()) for attr in ['lot_name', 'sample_name', 'selected_lot', 'selected_sample']]
         self.sample_active = tk.BooleanVar(value=False)
 
@@ -27,9 +46,59 @@ class LotSampleApp:
         self.setup_ui()
         self.load_data()
         self.adjust_window_size()
-    @property
-    def lot_names(self):
-        return [lot['Name'] for lot in self.lots]
+        if METRICS_ENABLED:
+            self.root.after(LAG_PROBE_MS, self.probe_lag, time.perf_counter() + LAG_PROBE_MS / 1000)
+            if DUMP_PATH:
+                self.root.after(DUMP_SECONDS * 1000, self.dump_metrics)
+
+    def instrument(self):
+        # Time storage calls and the UI handlers behind them (only with LAS_METRICS set; see las_metrics)
+        wrap_storage(self.storage)
+        wrap(self, ['lots_loaded', 'samples_loaded', 'updates_loaded', 'update_lot_dropdown', 'update_sample_dropdown',
+                    'load_selected_sample', 'save_notes', 'resolve_code', 'find_text', 'import_rows'])
+
+    def probe_lag(self, due):
+        # How late a timer fires is how long the event loop was busy (handlers, redrawing) instead of responsive
+        now = time.perf_counter()
+        metrics.record('Tk.event_loop_lag', max(0.0, now - due))
+        self.root.after(LAG_PROBE_MS, self.probe_lag, now + LAG_PROBE_MS / 1000)
+
+    def dump_metrics(self):
+        self.worker.submit(metrics.dump, DUMP_PATH)
+        self.root.after(DUMP_SECONDS * 1000, self.dump_metrics)
+
+    def open_metrics_panel(self):
+        window = tk.Toplevel(self.root)
+        window.title("Performance")
+        columns = ('calls', 'rows', 'mean', 'p50', 'p95', 'max')
+        table = ttk.Treeview(window, columns=columns, height=20)
+        table.heading('#0', text="Operation")
+        table.column('#0', width=260)
+        for column, title in zip(columns, ("Calls", "Rows", "Mean ms", "p50 ms", "p95 ms", "Max ms")):
+            table.heading(column, text=title)
+            table.column(column, width=80, anchor="e")
+        table.grid(row=0, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
+        ttk.Button(window, text="Reset", command=metrics.reset).grid(row=1, column=1, padx=5, pady=5)
+        ttk.Button(window, text="Save...", command=lambda: self.save_metrics(window)).grid(row=1, column=2, padx=5, pady=5)
+        window.grid_rowconfigure(0, weight=1)
+        window.grid_columnconfigure(0, weight=1)
+
+        def refresh():
+            if not window.winfo_exists():
+                return
+            table.delete(*table.get_children())
+            for name, stat in metrics.snapshot().items():
+                table.insert('', tk.END, text=name, values=(stat['calls'], stat['rows'], f"{stat['mean_ms']:.2f}",
+                                                            f"{stat['p50_ms']:.2f}", f"{stat['p95_ms']:.2f}", f"{stat['max_ms']:.2f}"))
+            window.after(1000, refresh)
+
+        refresh()
+
+    def save_metrics(self, window):
+        path = filedialog.asksaveasfilename(parent=window, title="Save metrics", defaultextension=".json",
+                                            filetypes=[("JSON", "*.json"), ("CSV", "*.csv")])
+        if path:
+            self.worker.submit(metrics.dump, path)
 
     def adjust_window_size(self):
         self.root.update_idletasks()
@@ -55,8 +124,9 @@ class LotSampleApp:
         add_sample_frame.grid(row=1, column=0, padx=10, pady=10, sticky="ew")
 
         ttk.Label(add_sample_frame, text="Select Lot:").grid(row=0, column=0, padx=5, pady=5)
-        self.lot_combobox = ttk.Combobox(add_sample_frame, values=self.lot_names, textvariable=self.selected_lot, width=60)  # change width to 60
-        self.lot_combobox.grid(row=0, column=1, padx=5, pady=5)
+        self.lot_picker = SearchablePicker(add_sample_frame, self.selected_lot, height=4, width=60)  # Type to filter lots
+        self.lot_picker.grid(row=0, column=1, padx=5, pady=5)
+        ttk.Button(add_sample_frame, text="Print Lot Labels...", command=self.print_lot_labels).grid(row=0, column=2, padx=5, pady=5)
 
         ttk.Label(add_sample_frame, text="Sample Name:").grid(row=1, column=0, padx=5, pady=5)
         ttk.Entry(add_sample_frame, textvariable=self.sample_name, width=60).grid(row=1, column=1, padx=5, pady=5)  # Setting width to 60 (assuming the original width was 20)
@@ -66,24 +136,36 @@ class LotSampleApp:
         ttk.Label(add_sample_frame, text="Generated Code:").grid(row=2, column=0, padx=5, pady=5)
         self.generated_code_display = ttk.Entry(add_sample_frame, state="readonly", width=60)  # Display bar for the generated code
         self.generated_code_display.grid(row=2, column=1, padx=5, pady=5)
+        ttk.Button(add_sample_frame, text="Bulk Import...", command=self.bulk_import).grid(row=2, column=2, padx=5, pady=5)
 
         # Browse Lots and Samples section
         browse_frame = ttk.LabelFrame(self.root, text="Browse Lots and Samples")
         browse_frame.grid(row=2, column=0, padx=10, pady=10, sticky="ew")
 
         ttk.Label(browse_frame, text="Select Lot:").grid(row=0, column=0, padx=5, pady=5)
-        self.browse_lot_combobox = ttk.Combobox(browse_frame, textvariable=self.selected_lot, state="readonly", postcommand=self.update_sample_dropdown, width=60)  # change width to 60
-        self.browse_lot_combobox.grid(row=0, column=1, padx=5, pady=5)
-
-        # Bind the event to the combobox
-        self.browse_lot_combobox.bind("<<ComboboxSelected>>", lambda e: self.update_sample_dropdown())
+        # Picking a lot refreshes the sample picker
+        self.browse_lot_picker = SearchablePicker(browse_frame, self.selected_lot, on_select=lambda name: self.update_sample_dropdown(), width=60)
+        self.browse_lot_picker.grid(row=0, column=1, padx=5, pady=5)
 
         ttk.Label(browse_frame, text="Select Sample:").grid(row=1, column=0, padx=5, pady=5)
-        self.browse_sample_combobox = ttk.Combobox(browse_frame, textvariable=self.selected_sample, state="readonly", width=60)
-        self.browse_sample_combobox.grid(row=1, column=1, padx=5, pady=5)
+        self.browse_sample_picker = SearchablePicker(browse_frame, self.selected_sample, width=60)
+        self.browse_sample_picker.grid(row=1, column=1, padx=5, pady=5)
 
         ttk.Button(browse_frame, text="Load", command=self.load_selected_sample).grid(row=1, column=2, padx=5, pady=5)
 
+        # Full-text search over sample Names and Notes
+        ttk.Label(browse_frame, text="Find Text:").grid(row=2, column=0, padx=5, pady=5, sticky="n")
+        find_frame = ttk.Frame(browse_frame)
+        find_frame.grid(row=2, column=1, padx=5, pady=5, sticky="ew")
+        self.find_entry = ttk.Entry(find_frame, width=60)
+        self.find_entry.grid(row=0, column=0, sticky="ew")
+        self.find_entry.bind('<KeyRelease>', lambda e: self.find_text())
+        self.find_results = ttk.Treeview(find_frame, columns=('name', 'code'), show='headings', height=5, selectmode='browse')
+        self.find_results.heading('name', text="Sample")
+        self.find_results.heading('code', text="FullCode")
+        self.find_results.grid(row=1, column=0, sticky="ew")
+        self.find_results.bind('<<TreeviewSelect>>', lambda e: self.open_find_result())
+
         # Search bar in Browse section
         ttk.Label(browse_frame, text="Enter Code:").grid(row=3, column=0, padx=5, pady=5)
         self.search_entry = ttk.Entry(browse_frame)  # Text entry for the search term
@@ -98,6 +180,10 @@ class LotSampleApp:
         ttk.Checkbutton(browse_frame, text="Active", variable=self.sample_active).grid(row=5, column=0, padx=5, pady=5, sticky="w")
 
         ttk.Button(browse_frame, text="Save Notes", command=self.save_notes).grid(row=5, column=1, padx=5, pady=5, sticky="ew")
+        ttk.Button(browse_frame, text="Scan Check-in...", command=self.start_scan_session).grid(row=5, column=2, padx=5, pady=5)
+        ttk.Button(browse_frame, text="Notes History...", command=self.open_notes_history).grid(row=6, column=1, padx=5, pady=5, sticky="ew")
+        if METRICS_ENABLED:
+            ttk.Button(browse_frame, text="Performance...", command=self.open_metrics_panel).grid(row=6, column=2, padx=5, pady=5)
 
     def search_notes(self):
         search_code = self.search_entry.get().strip()
@@ -108,7 +194,7 @@ class LotSampleApp:
             return
 
         # Find the sample that matches the entered code
-        corresponding_sample = next((sample for sample in self.samples if sample['FullCode'] == search_code), None)
+        corresponding_sample = self.index.sample_by_code(search_code)
 
         if corresponding_sample:
             # If a matching sample is found, display its notes
@@ -119,87 +205,175 @@ class LotSampleApp:
             messagebox.showinfo("Not Found", "No sample found with the provided code.")
 
     def add_lot(self):
-        lot_name = self.lot_name.get().strip()
-        if not lot_name:
-            messagebox.showerror("Error", "Lot name cannot be empty.")
+        try:
+            lot = new_lot(self.lot_name.get(), self.codes)
+        except ValueError as error:
+            messagebox.showerror("Error", str(error))
             return
 
-        lot_code = generate_code(8)
-        lot = {
-            'Lot': lot_code,
-            'Name': lot_name,
-            # Other fields remain empty for a lot entry
-        }
-
-        with open(CSV_FILE, 'a', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
-            writer.writerow(lot)
+        self.submit_write(self.storage.add_lot, dict(lot))
 
         self.lots.append(lot)
-        self.update_lot_dropdown()
+        self.index.add_lot(lot)
+        self.update_lot_dropdown([lot])
         self.lot_name.set('') # Clear the input field
 
     def find_lot_name_by_lot_number(self, lot_number):
-        for lot in self.lots:
-            if lot['Lot'] == lot_number:
-                return lot['Name']
-        return None
+        return self.index.lot_name(lot_number)
 
 
     def return_lot_name(self, lot_id):
-        with open(CSV_FILE, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row['Lot'] == lot_id and not row['Serial']:
-                    return row['Name']
-        return None
-
-    def load_data(self):
-        self.samples = []
-        self.lots = []
-        with open(CSV_FILE, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row['Lot'] and not row['Serial']:  # It's a lot
-                    self.lots.append(row)
-                if row['Serial']:  # It's a sample
-                    row['Active'] = row['Active'] == 'True'  # Convert string to boolean
-                    self.samples.append(row)
-        self.update_lot_dropdown()
-        self.load_selected_sample()
+        return self.index.lot_name(lot_id)
 
+    def submit_write(self, func, *args, callback=None):
+        self.writes_submitted += 1
+        self.worker.submit(func, *args, callback=callback)
 
-    def update_lot_dropdown(self):
-        self.lot_combobox['values'] = [lot['Name'] for lot in self.lots]
-        self.browse_lot_combobox['values'] = [lot['Name'] for lot in self.lots]
+    def refresh_data(self, then=None):
+        # Only re-read the data when another writer changed it since we last loaded or wrote it;
+        # the check itself runs on the worker so a slow disk never blocks the window
+        self.worker.submit(self.storage.changed, callback=lambda changed: self.update_data(then) if changed else self.when_loaded(then))
 
-    def add_sample(self):
-        sample_name = self.sample_name.get().strip()
-        if not sample_name:
-            messagebox.showerror("Error", "Sample name cannot be empty.")
+    def update_data(self, then=None):
+        # Read only what other writers appended or edited since our last read, where the storage can tell
+        if self.loading:
+            self.load_data(then)
+            return
+        writes_submitted, generation = self.writes_submitted, self.load_generation
+        self.worker.submit(self.storage.updates, callback=lambda updates: self.updates_loaded(updates, writes_submitted, generation, then))
+
+    def updates_loaded(self, updates, writes_submitted, generation, then):
+        if generation != self.load_generation:
+            self.when_loaded(then)  # A full load started meanwhile
+            return
+        if updates is None:
+            self.load_data(then)  # Rewritten rather than appended to
+            return
+        new_rows, edits = updates
+        raced = writes_submitted != self.writes_submitted
+        # If one of our writes was queued behind this read, its edits may be older than memory; read them again
+        new_lots, new_samples, edited = merge_updates(self.index, new_rows, {} if raced else edits)
+        self.lots.extend(new_lots)
+        self.samples.extend(new_samples)
+        for lot in new_lots:
+            self.codes.add_lot(lot['Lot'])
+        for sample in new_samples:
+            self.codes.add_sample(sample['Lot'], sample['Serial'])
+            self.text_index.add(sample['FullCode'], sample['Name'], sample['Notes'])
+        for sample in edited:
+            self.text_index.update(sample['FullCode'], sample['Name'], sample['Notes'])
+        if new_lots:
+            self.update_lot_dropdown(new_lots)
+        if raced:
+            self.update_data(then)
+        elif then:
+            then()
+
+    def when_loaded(self, then):
+        if self.loading:
+            self.after_load.append(then)
+        elif then:
+            then()
+
+    def load_data(self, then=None):
+        # Fast start: lots first so the window is usable at once, then samples streamed in chunks
+        self.loading = True
+        self.load_generation += 1
+        self.load_started = time.perf_counter()
+        if then:
+            self.after_load.append(then)
+        writes_submitted, generation = self.writes_submitted, self.load_generation
+        self.worker.submit(self.storage.lots, callback=lambda lots: self.lots_loaded(lots, writes_submitted, generation),
+                           on_error=self.load_failed)
+
+    def lots_loaded(self, lots, writes_submitted, generation):
+        if generation != self.load_generation:
+            return  # Superseded by a newer load
+        if writes_submitted != self.writes_submitted:
+            # A write was queued behind this read, so the result misses it; read again
+            self.load_data()
             return
+        self.lots, self.samples = lots, []
+        self.index, self.codes = LotSampleIndex(lots), CodeAllocator(lots, cursors_path=CODES_FILE, archive=ArchiveStore(archive_path(self.storage)))
+        self.update_lot_dropdown()
+        stream = self.sample_rows()
+        self.text_index = TextIndex()  # Filled by the worker; searched only once loading is done
+        self.worker.submit(self.read_samples, stream, self.text_index, callback=lambda chunk: self.samples_loaded(chunk, stream, generation),
+                           on_error=self.load_failed)
+
+    def sample_rows(self):
+        # A generator, so not even row_values() runs until the worker reads the first chunk; a generator
+        # expression would call it right here on the Tk thread (an SQLite query, for one)
+        for values in self.storage.row_values():
+            if values[2]:  # Serial set: a sample
+                yield values
+
+    def read_samples(self, stream, text_index):
+        # Runs on the worker thread: parse and text-index the next chunk of samples without touching Tk
+        chunk = []
+        with bulk_load():
+            for values in itertools.islice(stream, SAMPLE_CHUNK):
+                sample = Sample.from_values(values)  # Slots instead of a per-row dict; Active becomes a bool
+                text_index.add(sample.FullCode, sample.Name, sample.Notes)
+                chunk.append(sample)
+        return chunk
+
+    def samples_loaded(self, chunk, stream, generation):
+        if generation != self.load_generation:
+            stream.close()
+            return
+        self.samples.extend(chunk)
+        for sample in chunk:
+            self.index.add_sample(sample)
+            self.codes.add_sample(sample['Lot'], sample['Serial'])
+        if len(chunk) == SAMPLE_CHUNK:
+            self.worker.submit(self.read_samples, stream, self.text_index, callback=lambda chunk: self.samples_loaded(chunk, stream, generation),
+                           on_error=self.load_failed)
+            return
+        self.loading = False
+        if METRICS_ENABLED:
+            metrics.record('LaS3.load_data', time.perf_counter() - self.load_started, len(self.samples))
+        self.load_selected_sample()
+        after_load, self.after_load = self.after_load, []
+        for then in after_load:
+            then()
+
+    def load_failed(self, error):
+        # A failed load must not leave the window waiting for it: what was loaded so far stays usable
+        if self.loading:
+            self.loading = False
+            self.load_generation += 1  # Results still queued from this load are dropped
+            self.after_load = []
+        messagebox.showerror("Error", f"Loading the data failed: {error}")
+
+    def update_lot_dropdown(self, new_lots=None):
+        # Build the name index once for both pickers; new lots are inserted instead of rebuilding
+        if new_lots is None:
+            self.lot_name_index = PrefixIndex(lot['Name'] for lot in self.lots)
+        else:
+            for lot in new_lots:
+                self.lot_name_index.add(lot['Name'])
+        self.lot_picker.set_index(self.lot_name_index)
+        self.browse_lot_picker.set_index(self.lot_name_index)
 
-        lot_code = next((lot['Lot'] for lot in self.lots if lot['Name'] == self.selected_lot.get()), None)
+    def add_sample(self):
+        lot_code = self.index.lot_code(self.selected_lot.get())
         if lot_code is None:
             messagebox.showerror("Error", "Selected lot does not exist.")
             return # This should never happen if the UI is consistent with the data
+        if self.loading:
+            messagebox.showinfo("Loading", "Samples are still loading; please try again in a moment.")
+            return
+
+        try:
+            sample = new_sample(lot_code, self.sample_name.get(), self.codes)
+        except ValueError as error:
+            messagebox.showerror("Error", str(error))
+            return
+        full_code = sample['FullCode']
 
-        sample_code = generate_code(4) # Assuming generate_code is a function that generates a random 4-digit code
-        full_code = lot_code + sample_code # The full 12-digit code consists of the lot and sample codes
-
-        sample = {
-            'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'Lot': lot_code,
-            'Serial': sample_code,
-            'FullCode': full_code,
-            'Name': sample_name,
-            'Notes': '',
-            'Active': 'False', # By default, a new sample is not active
-        }
-        # Saving the sample to the CSV file
-        with open(CSV_FILE, 'a', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
-            writer.writerow(sample)
+        # Saving the sample to the data file
+        self.submit_write(self.storage.add_sample, dict(sample))
 
         # Provide the full code for the user (could be used for QR code generation or other identification methods)
         self.generated_code_display.config(state="normal") # Enable writing to the widget
@@ -208,38 +382,144 @@ class LotSampleApp:
         self.generated_code_display.config(state="readonly") # Prevent user modification
 
         self.samples.append(sample) # Add the new sample to the internal list
+        self.index.add_sample(sample)
+        self.text_index.add(full_code, sample['Name'], '')
         self.selected_lot.set('') # Clear the selected lot
         self.sample_name.set('') # Clear the input for the sample name
+        self.lot_picker.filter()  # Both lot pickers show the cleared lot, so list every lot again
+        self.browse_lot_picker.filter()
 
         # Optionally, you could also update the sample dropdown in the 'Browse Lots and Samples' section
         self.update_sample_dropdown() # Refresh samples dropdown based on the current lot
 
 
+    def bulk_import(self):
+        path = filedialog.askopenfilename(title="Bulk import samples", filetypes=[("CSV or JSON", "*.csv *.json *.jsonl"), ("All files", "*")])
+        if not path:
+            return
+        start = time.perf_counter()
+        self.worker.submit(read_import_file, path, callback=lambda rows: self.import_rows(rows, start))
+
+    def import_rows(self, rows, start):
+        if self.loading:
+            self.when_loaded(lambda: self.import_rows(rows, start))  # Codes can only be allocated once every sample is known
+            return
+        try:
+            new_lots, new_samples = plan_import(rows, self.lots, self.codes)
+        except ValueError as error:
+            problems = str(error).splitlines()
+            more = f"\n... and {len(problems) - 20} more" if len(problems) > 20 else ""
+            messagebox.showerror("Import failed", "Nothing was written:\n" + "\n".join(problems[:20]) + more)
+            return
+
+        def written(_):
+            elapsed = time.perf_counter() - start
+            count = len(new_lots) + len(new_samples)
+            messagebox.showinfo("Import complete", f"Imported {len(new_lots)} lots and {len(new_samples)} samples "
+                                                   f"in {elapsed:.2f} s ({count / elapsed:.0f} rows/sec).")
+
+        # One buffered write for the whole batch, then a single refresh of the in-memory data and dropdowns
+        self.submit_write(self.storage.add_rows, new_lots + new_samples, callback=written)
+        new_samples = [Sample.from_row(sample) for sample in new_samples]
+        self.lots.extend(new_lots)
+        self.samples.extend(new_samples)
+        for lot in new_lots:
+            self.index.add_lot(lot)
+        for sample in new_samples:
+            self.index.add_sample(sample)
+            self.text_index.add(sample.FullCode, sample.Name, sample.Notes)
+        self.update_lot_dropdown(new_lots)
+        self.update_sample_dropdown()
+
+    def print_lot_labels(self):
+        lot = self.index.lot_by_name(self.selected_lot.get())
+        if not lot:
+            messagebox.showerror("Error", "Select the lot to print labels for.")
+            return
+        if self.loading:
+            messagebox.showinfo("Loading", "Samples are still loading; please try again in a moment.")
+            return
+        labels = [(sample['FullCode'], sample['Name']) for sample in self.index.samples_in_lot(lot['Lot'])]
+        if not labels:
+            messagebox.showinfo("Print Labels", f"Lot {lot['Name']} has no samples.")
+            return
+        directory = filedialog.askdirectory(title="Folder for the label sheets")
+        if not directory:
+            return
+
+        def printed(result):
+            paths, elapsed = result
+            messagebox.showinfo("Labels ready", f"Wrote {len(labels)} labels on {len(paths)} sheets to {directory} "
+                                                f"in {elapsed:.1f} s. Open the .svg files in a browser to print them.")
+
+        self.worker.submit(print_labels, self.storage, labels, directory, callback=printed)
+
+    def show_unloaded(self, found):
+        if found is None:
+            messagebox.showerror("Error", "No data found for the provided FullCode.")
+            return
+        sample, where = found
+        lot_name = self.return_lot_name(sample['Lot']) or sample['Lot']
+        if where == 'shard':
+            state = "is in an archived shard; unarchive it (las_shards.py unarchive) to edit the sample here"
+        else:
+            state = "is archived and can no longer be edited"
+        messagebox.showinfo("Archived Sample", f"{sample['FullCode']} ({sample['Name']}, lot {lot_name}) {state}."
+                                               f"\n\nCreated: {sample['datetime']}\n"
+                                               f"Active: {sample['Active']}\nNotes:\n{sample['Notes']}")
+
+    def find_text(self):
+        query = self.find_entry.get()
+        if self.loading:
+            return  # The text index is still being built; results appear on the next keystroke after loading
+        self.find_results.delete(*self.find_results.get_children())
+        for full_code in self.text_index.search(query):
+            sample = self.index.sample_by_code(full_code)
+            if sample:
+                self.find_results.insert('', 'end', iid=full_code, values=(sample['Name'], full_code))
+
+    def open_find_result(self):
+        selection = self.find_results.selection()
+        sample = self.index.sample_by_code(selection[0]) if selection else None
+        if not sample:
+            return
+        # Put the code in the search bar so Save Notes targets exactly this sample
+        self.search_entry.delete(0, tk.END)
+        self.search_entry.insert(0, sample['FullCode'])
+        self.selected_lot.set(self.return_lot_name(sample['Lot']))
+        self.update_sample_dropdown()
+        self.browse_sample_picker.set(sample['Name'])
+        self.load_selected_sample()
+
     def search_code(self):
         code = self.search_entry.get().strip()
-        
+        # Pick up rows other instances appended (without re-reading an unchanged file), then resolve from memory
+        self.refresh_data(lambda: self.resolve_code(code))
+
+    def resolve_code(self, code):
         if ',' not in code:
             # Direct FullCode search
-            matched_sample = next((sample for sample in self.samples if sample['FullCode'] == code), None)
+            matched_sample = self.index.sample_by_code(code)
             if matched_sample:
                 self.selected_lot.set(self.return_lot_name(matched_sample['Lot']))
                 self.selected_sample.set(matched_sample['Name'])
-                self.sample_active.set(matched_sample['Active'] == 'True')
-                self.load_data()
+                self.load_selected_sample()
                 return
             else:
-                messagebox.showerror("Error", "No data found for the provided FullCode.")
+                # Not loaded: it may be in an archived shard (see las_shards) or archived (see las_archive)
+                self.worker.submit(find_unloaded, self.storage, ArchiveStore(archive_path(self.storage)), code,
+                                   callback=self.show_unloaded)
                 return
         
         # Extract lot_code from the entered FullCode
         lot_code_from_fullcode = code[:8]  # Assuming the first 8 characters represent the lot_code
         # Search for an entry with this lot_code and without a 4-digit sample ID
-        original_lot_entry = next((lot for lot in self.lots if lot['Lot'] == lot_code_from_fullcode and (not lot.get('Serial') or len(lot.get('Serial').strip()) != 4)), None)
+        original_lot_entry = self.index.lot_by_code(lot_code_from_fullcode)
         # If such an entry is found, set the dropdown to the Name attribute of this entry
         if original_lot_entry:
-            self.browse_lot_combobox.set(original_lot_entry['Name'])
+            self.browse_lot_picker.set(original_lot_entry['Name'])
         else:
-            self.browse_lot_combobox.set("")
+            self.browse_lot_picker.set("")
         split_code = code.split(',')
         if len(split_code) < 7:
             messagebox.showerror("Error", "Please check the format of the provided code.")
@@ -248,8 +528,9 @@ class LotSampleApp:
         lot_code, sample_code = split_code[1], split_code[2]
         
         # Search for the lot and sample based on the provided codes
-        lot_name = next((lot['Name'] for lot in self.lots if lot['Lot'] == lot_code), None)
-        sample_name = next((sample['Name'] for sample in self.samples if sample['Serial'] == sample_code), None)
+        lot_name = self.index.lot_name(lot_code)
+        matched_sample = self.index.sample_by_code(lot_code + sample_code)
+        sample_name = matched_sample['Name'] if matched_sample else None
         
         if lot_name and sample_name:
             # Update the dropdowns
@@ -260,36 +541,36 @@ class LotSampleApp:
             self.sample_active.set(split_code[6].strip() == 'True')
             
             # Automatically press the "load" button
-            self.load_data()
+            self.load_selected_sample()
         else:
             messagebox.showerror("Error", "No data found for the provided code.")
 
     def update_sample_dropdown(self):
         selected_lot_name = self.selected_lot.get()
-        selected_lot = next((lot for lot in self.lots if lot['Name'] == selected_lot_name), None)
+        selected_lot = self.index.lot_by_name(selected_lot_name)
 
         if not selected_lot:
-            self.browse_sample_combobox['values'] = []  # Clear the dropdown if no lot is selected
+            self.browse_sample_picker.set_index(PrefixIndex())  # Clear the picker if no lot is selected
             return
 
         # Filter samples based on the selected lot
-        related_samples = [sample for sample in self.samples if sample['Lot'] == selected_lot['Lot']]
-        self.browse_sample_combobox['values'] = [sample['Name'] for sample in related_samples]
+        related_samples = self.index.samples_in_lot(selected_lot['Lot'])
+        self.browse_sample_picker.set_index(PrefixIndex(sample['Name'] for sample in related_samples))
 
         # If there are related samples, set the first one as the default selected value
         if related_samples:
-            self.browse_sample_combobox.set(related_samples[0]['Name'])
+            self.browse_sample_picker.set(related_samples[0]['Name'])
         else:
-            self.browse_sample_combobox.set('')  # Clear the selection if no related samples
+            self.browse_sample_picker.set('')  # Clear the selection if no related samples
 
     def load_selected_sample(self):
-        lot_code = next((lot['Lot'] for lot in self.lots if lot['Name'] == self.selected_lot.get()), None)
+        lot_code = self.index.lot_code(self.selected_lot.get())
         sample_name = self.selected_sample.get()
 
         if not lot_code or not sample_name:
             return  # Proper error handling/message should be here
 
-        selected_sample = next((sample for sample in self.samples if sample['Name'] == sample_name and sample['Lot'] == lot_code), None)
+        selected_sample = self.index.sample_in_lot(lot_code, sample_name)
 
         if selected_sample:
             self.notes_text.delete(1.0, tk.END)
@@ -297,48 +578,173 @@ class LotSampleApp:
             self.sample_active.set(selected_sample['Active'] == 'True')  # Update the Checkbutton's state based on the sample's 'Active' status
             self.sample_active.set(selected_sample['Active'])
 
+    def current_sample(self):
+        # The sample the Notes box is for: the one whose code is in the search bar, else the one picked by lot and name
+        search_code = self.search_entry.get().strip()
+        if len(search_code) == 12:
+            return self.index.sample_by_code(search_code)
+        return self.index.sample_in_lot(self.index.lot_code(self.selected_lot.get()), self.selected_sample.get())
+
     def save_notes(self):
             new_notes = self.notes_text.get(1.0, tk.END).strip()
-            search_code = self.search_entry.get().strip()
-            selected_sample = None
-
-            # Create a flag to track if any sample is updated
-            sample_updated = False
-
-            # Check if a 12-digit code is entered in the search bar
-            if len(search_code) == 12:
-                # Find the sample that matches the entered code
-                selected_sample = next((sample for sample in self.samples if sample['FullCode'] == search_code), None)
-                if selected_sample:
-                    selected_sample['Notes'] = new_notes  # Update the notes in memory
-                    sample_updated = True
-            else:
-                lot_code = next((lot['Lot'] for lot in self.lots if lot['Name'] == self.selected_lot.get()), None)
-                sample_name = self.selected_sample.get()
-                selected_sample = next((sample for sample in self.samples if sample['Name'] == sample_name and sample['Lot'] == lot_code), None)
-                if selected_sample:
-                    selected_sample['Notes'] = new_notes  # Update the notes in memory
-                    sample_updated = True
-
-            # Update the active status in memory based on the Checkbutton's state
-            if selected_sample:
-                selected_sample['Active'] = 'True' if self.sample_active.get() else 'False'
-            
-            # Now, save the updated data back to the CSV file
-            if sample_updated:
-                with open(CSV_FILE, 'w', newline='') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
-                    writer.writeheader()  # Write the headers first
-                    # Write the lots
-                    for lot in self.lots:
-                        
-                        writer.writerow(lot)
-                    # Write the samples
-                    for sample in self.samples:
-                        
-                        writer.writerow(sample)
+            selected_sample = self.current_sample()
+            if not selected_sample:
+                return
+
+            # The values this edit starts from, so the storage can merge an edit another instance saved meanwhile
+            expected = {'Notes': selected_sample['Notes'], 'Active': 'True' if is_active(selected_sample) else 'False'}
+            # Update the notes and active status in memory based on the Checkbutton's state
+            # (the index holds the same dicts, so in-place edits need no re-indexing)
+            selected_sample['Notes'] = new_notes
+            selected_sample['Active'] = 'True' if self.sample_active.get() else 'False'
+            fields = {'Notes': selected_sample['Notes'], 'Active': selected_sample['Active']}
+
+            # Now, persist just this sample's changes (a journal record for CSV, an UPDATE for SQLite)
+            self.submit_write(self.storage.update_sample, selected_sample['FullCode'], fields, expected,
+                              callback=lambda stored: self.notes_saved(selected_sample, fields, stored))
+
+    def notes_saved(self, sample, fields, stored):
+        if stored != fields:
+            # Another instance edited this sample since we loaded it; show the merged result
+            for field, value in stored.items():
+                sample[field] = value
+            if self.shown(sample):
+                self.notes_text.delete(1.0, tk.END)
+                self.notes_text.insert(tk.END, sample['Notes'])
+                self.sample_active.set(is_active(sample))
+            messagebox.showinfo("Merged", "This sample was also edited in another window; both edits have been kept.")
+        # Re-index just this sample's words (after loading, while the worker no longer writes to the index)
+        self.when_loaded(lambda: self.text_index.update(sample['FullCode'], sample['Name'], sample['Notes']))
+
+    def open_notes_history(self):
+        sample = self.current_sample()
+        if not sample:
+            messagebox.showerror("Error", "Select a sample or enter its code first.")
+            return
+        code = sample['FullCode']
+        window = tk.Toplevel(self.root)
+        window.title(f"Notes History - {sample['Name']} ({code})")
+        versions = tk.Listbox(window, height=12, width=28, exportselection=False)  # Newest first
+        versions.grid(row=0, column=0, padx=5, pady=5, sticky="ns")
+        text = tk.Text(window, width=60, height=12, state="disabled")
+        text.grid(row=0, column=1, padx=5, pady=5, sticky="nsew")
+        restore = ttk.Button(window, text="Copy to Notes", state="disabled")
+        restore.grid(row=1, column=1, padx=5, pady=5, sticky="e")
+        window.grid_rowconfigure(0, weight=1)
+        window.grid_columnconfigure(1, weight=1)
+        history = self.storage.history
+
+        def show(notes):
+            if not window.winfo_exists():
+                return
+            text.configure(state="normal")
+            text.delete(1.0, tk.END)
+            text.insert(tk.END, notes)
+            text.configure(state="disabled")
+            restore.configure(state="normal", command=lambda: self.restore_notes(sample, notes, window))
+
+        def listed(entries):
+            if not window.winfo_exists():
+                return
+            if not entries:
+                versions.insert(tk.END, "No saved versions yet")
+                return
+            for version, saved_at in reversed(entries):
+                when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(saved_at)) if saved_at else "before history"
+                versions.insert(tk.END, f"v{version + 1}  {when}")
+
+            def selected(event):
+                if versions.curselection():
+                    self.worker.submit(history.notes, code, len(entries) - 1 - versions.curselection()[0], callback=show)
+
+            versions.bind('<<ListboxSelect>>', selected)
+            versions.selection_set(0)
+            versions.event_generate('<<ListboxSelect>>')
+
+        # Versions are read on the worker, one seek each, so a long history never blocks the window
+        self.worker.submit(history.versions, code, callback=listed)
+
+    def restore_notes(self, sample, notes, window):
+        # Only fills in the Notes box; saving it is up to the user, and becomes a new version
+        if not self.shown(sample):
+            messagebox.showerror("Error", "That sample is no longer the one shown.", parent=window)
+            return
+        self.notes_text.delete(1.0, tk.END)
+        self.notes_text.insert(tk.END, notes)
+
+    def shown(self, sample):
+        # True if the Notes/Active widgets currently show this sample
+        return (self.index.sample_by_code(self.search_entry.get().strip()) is sample or
+                self.index.sample_in_lot(self.index.lot_code(self.selected_lot.get()), self.selected_sample.get()) is sample)
+
+    def start_scan_session(self):
+        if self.loading:
+            messagebox.showinfo("Loading", "Samples are still loading; please try again in a moment.")
+            return
+        self.refresh_data(self.open_scan_window)  # Pick up samples other instances added, so their labels resolve
+
+    def open_scan_window(self):
+        # Scans are resolved in memory as they arrive; the whole session is saved in one write when finished
+        session = ScanSession(self.index)
+        window = tk.Toplevel(self.root)
+        window.title("Scan Check-in")
+        ttk.Label(window, text="Scan codes:").grid(row=0, column=0, padx=5, pady=5)
+        entry = ttk.Entry(window, width=30)
+        entry.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        tally = ttk.Label(window, text=session.summary())
+        tally.grid(row=1, column=0, columnspan=2, padx=5, pady=5, sticky="w")
+        log = tk.Listbox(window, height=12, width=60)  # Newest first
+        log.grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        buttons = ttk.Frame(window)
+        buttons.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="e")
+        ttk.Button(buttons, text="Cancel", command=lambda: self.cancel_scan_session(session, window)).grid(row=0, column=0, padx=5)
+        ttk.Button(buttons, text="Finish and Save", command=lambda: self.finish_scan_session(session, window)).grid(row=0, column=1, padx=5)
+        window.grid_rowconfigure(2, weight=1)
+        window.grid_columnconfigure(1, weight=1)
+        window.protocol("WM_DELETE_WINDOW", lambda: self.cancel_scan_session(session, window))
+
+        def scanned(event):
+            code = entry.get().strip()
+            entry.delete(0, tk.END)
+            result = session.scan(code)
+            if result is None:
+                return
+            log.insert(0, f"{code}: {result}")
+            if result == UNKNOWN:
+                log.itemconfig(0, foreground='red')
+            if log.size() > SCAN_LOG_LINES:
+                log.delete(tk.END)
+            tally.config(text=session.summary())
+
+        entry.bind('<Return>', scanned)  # Scanners type the code followed by Enter
+        entry.focus_set()
+
+    def cancel_scan_session(self, session, window):
+        if session.pending and not messagebox.askyesno("Discard scans", f"Discard {len(session.pending)} check-ins without saving?", parent=window):
+            return
+        window.destroy()
+
+    def finish_scan_session(self, session, window):
+        window.destroy()
+        if not session.pending:
+            return
+        checked_in = list(session.pending.values())
+        summary = session.summary()
+
+        def saved(_):
+            # Memory follows only once the edits are on disk; a failed write leaves the samples inactive
+            session.saved()
+            if any(self.shown(sample) for sample in checked_in):
+                self.sample_active.set(True)
+            messagebox.showinfo("Check-in saved", summary)
+
+        self.submit_write(self.storage.update_samples, session.edits(), callback=saved)
 
 # Run the application
-root = tk.Tk()
-app = LotSampleApp(root)
-root.mainloop()
+if __name__ == '__main__':
+    root = tk.Tk()
+    app = LotSampleApp(root)
+    root.mainloop()
+    app.worker.close()  # Finish queued writes before exiting
+    if DUMP_PATH:
+        metrics.dump(DUMP_PATH)
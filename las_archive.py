@@ -0,0 +1,366 @@
+"""Move old inactive samples out of the hot data into a compressed archive.
+
+Every sample stays in the data file forever, so loading, searching and
+compacting edits all grow with the whole history. ``archive_samples`` moves
+the samples that are inactive and were created before a cutoff (the
+``datetime`` column; samples without one are kept) into ``<data
+file>.archive``, in one pass over the data:
+
+* the archive is a series of zlib-compressed blocks of BLOCK_ROWS CSV rows
+  (FIELDNAMES order), each preceded by its compressed length
+* ``<data file>.archive.idx`` holds one fixed-size (FullCode, block offset)
+  entry per archived sample, sorted by FullCode, so ``ArchiveStore.find``
+  is a binary search over the memory-mapped index plus one block to
+  inflate; nothing is loaded up front
+
+The data file (each shard, for las_shards) is rewritten without the
+archived samples, with journaled edits folded in, while its lock is held;
+an SQLite database deletes them in the same transaction that read them. Lot
+rows stay. Other app instances see a rewritten file and reload, now without
+the archived samples. Archived samples are read-only: an edit made from a
+window that still showed one is not applied.
+
+This is not ``las_shards.py archive``, which only hides whole shards from
+loading and leaves them editable.
+
+Serial numbers of archived samples are never handed out again: before the
+data changes, each lot's cursor in CODES_FILE is moved past the samples the
+lot had (see las_codes), and allocators given the archive (``CodeAllocator(...,
+archive=ArchiveStore(...))``) count its serials of a lot as used. The
+second matters for serials from before the permutation allocator, which sit
+at arbitrary positions rather than below the cursor.
+
+Run with::
+
+    python las_archive.py run [--older-than 365d] [--data FILE]
+    python las_archive.py find 123456780001
+"""
+import argparse
+import bisect
+import csv
+import io
+import mmap
+import os
+import struct
+import sys
+import zlib
+from collections import Counter
+
+from las_codes import CODES_FILE, LOT_DIGITS, claim_positions
+from las_lock import FileLock
+from las_query import open_data, parse_time
+from las_shards import ShardedStorage
+from las_storage import FIELDNAMES, CsvStorage, SqliteStorage, file_signature
+
+ARCHIVE_AFTER = '365d'  # Default age past which inactive samples are archived
+BLOCK_ROWS = 1000
+BLOCK = struct.Struct('<I')  # Compressed length, before each block
+ENTRY = struct.Struct('<16sQ')  # FullCode (NUL-padded), offset of its block in the archive
+COMPRESSION = 6
+
+
+def archive_path(storage):
+    return storage.path + '.archive'
+
+
+class IndexEntries:
+    # The sorted .idx file as a read-only sequence of FullCodes, for bisect
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // ENTRY.size
+
+    def __getitem__(self, position):
+        return ENTRY.unpack_from(self.data, position * ENTRY.size)[0]
+
+
+class ArchiveStore:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.lock = FileLock(path + '.lock')  # Held while archiving, by any process
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.index_path) // ENTRY.size
+        except FileNotFoundError:
+            return 0
+
+    def append_blocks(self, rows):
+        """Append row_values() rows as compressed blocks; return the sorted (FullCode key, offset) entries."""
+        entries = []
+        with open(self.path, 'ab') as f:
+            block = []
+            for values in rows:
+                block.append(values)
+                if len(block) == BLOCK_ROWS:
+                    entries.extend(self.write_block(f, block))
+                    block = []
+            if block:
+                entries.extend(self.write_block(f, block))
+            f.flush()
+            os.fsync(f.fileno())
+        entries.sort()
+        return entries
+
+    def write_block(self, f, block):
+        offset = f.tell()
+        text = io.StringIO()
+        csv.writer(text).writerows(block)
+        data = zlib.compress(text.getvalue().encode('utf-8'), COMPRESSION)
+        f.write(BLOCK.pack(len(data)) + data)
+        return [(key(values[3]), offset) for values in block]
+
+    def merge_index(self, entries):
+        # Merge new sorted entries into the sorted index; a code archived again points at its newer copy
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        new = iter(entries)
+        pending = next(new, None)
+        with open(tmp_path, 'wb') as out:
+            for old_key, old_offset in self.entries():
+                while pending is not None and pending[0] < old_key:
+                    out.write(ENTRY.pack(*pending))
+                    pending = next(new, None)
+                if pending is not None and pending[0] == old_key:
+                    continue
+                out.write(ENTRY.pack(old_key, old_offset))
+            while pending is not None:
+                out.write(ENTRY.pack(*pending))
+                pending = next(new, None)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    def entries(self):
+        try:
+            f = open(self.index_path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            while True:
+                chunk = f.read(ENTRY.size * 4096)
+                if not chunk:
+                    return
+                yield from ENTRY.iter_unpack(chunk)
+
+    def add(self, rows):
+        """Archive row_values() sample rows; return how many."""
+        with self.lock:
+            entries = self.append_blocks(rows)
+            if entries:
+                self.merge_index(entries)
+        return len(entries)
+
+    def find(self, full_code):
+        """The archived sample with this FullCode as a FIELDNAMES dict, or None."""
+        try:
+            f = open(self.index_path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            if not os.fstat(f.fileno()).st_size:
+                return None
+            try:
+                wanted = key(full_code)
+            except ValueError:  # Too long or not ASCII: never archived
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                codes = IndexEntries(data)
+                position = bisect.bisect_left(codes, wanted)
+                if position == len(codes) or codes[position] != wanted:
+                    return None
+                _, offset = ENTRY.unpack_from(data, position * ENTRY.size)
+        with open(self.path, 'rb') as archive:
+            archive.seek(offset)
+            length, = BLOCK.unpack(archive.read(BLOCK.size))
+            text = zlib.decompress(archive.read(length)).decode('utf-8')
+        for values in csv.reader(io.StringIO(text)):
+            if values[3] == full_code:
+                return dict(zip(FIELDNAMES, values))
+        return None
+
+    def serials(self, lot_code):
+        """Serials of the archived samples of one lot, read from the index alone."""
+        try:
+            f = open(self.index_path, 'rb')
+        except FileNotFoundError:
+            return []
+        with f:
+            if not os.fstat(f.fileno()).st_size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                codes = IndexEntries(data)
+                prefix = lot_code.encode('ascii')
+                found = []
+                # Keys sort by FullCode, so a lot's samples are one run starting at its code
+                for position in range(bisect.bisect_left(codes, prefix.ljust(16, b'\0')), len(codes)):
+                    code = codes[position]
+                    if not code.startswith(prefix):
+                        break
+                    found.append(code[len(prefix):].rstrip(b'\0').decode('ascii'))
+        return found
+
+    def close(self):
+        self.lock.close()
+
+
+def find_unloaded(storage, archive, full_code):
+    """A sample the apps leave out of loading, as (row, where), or None.
+
+    `where` is 'shard' for a sample in an archived shard of a ShardedStorage
+    (editable again once the shard is unarchived) and 'archive' for one in
+    `archive`, an ArchiveStore.
+    """
+    if isinstance(storage, ShardedStorage):
+        name = storage.shard_of(full_code[:LOT_DIGITS])
+        if name is not None and name in storage.manifest['archived']:
+            row = storage.sample(full_code)
+            if row:
+                return row, 'shard'
+    row = archive.find(full_code)
+    return (row, 'archive') if row else None
+
+
+def key(full_code):
+    encoded = full_code.encode('ascii')
+    if len(encoded) > 16:
+        raise ValueError(f"FullCode {full_code!r} is too long to archive.")
+    return encoded.ljust(16, b'\0')
+
+
+def is_archivable(values, cutoff):
+    # An inactive sample created before the cutoff
+    return bool(values[2]) and values[6] not in (True, 'True') and bool(values[0]) and values[0] < cutoff
+
+
+def reserve_archived_serials(lot_counts, cursors_path):
+    # Keep each lot's allocation cursor past every serial it had, archived ones included
+    for lot_code, count in lot_counts.items():
+        claim_positions(cursors_path, lot_code, count, 0)
+
+
+def archive_csv(storage, archive, cutoff, cursors_path):
+    """Move archivable samples of a CsvStorage into `archive`; return how many."""
+    with storage.lock:  # Nobody appends or journals an edit until the rewrite is in place
+        if not storage.journal.compaction_lock.acquire(blocking=False):
+            raise ValueError(f"{storage.path} is being compacted; try again in a moment.")
+        try:
+            if storage.journal.compacting():
+                raise ValueError(f"{storage.path} is being compacted; try again in a moment.")
+            tmp_path = f'{storage.path}.{os.getpid()}.tmp'
+            lot_counts, archived_lots = Counter(), set()
+
+            def hot_rows(out):
+                writer = csv.writer(out)
+                writer.writerow(FIELDNAMES)
+                for values in storage.row_values(streaming=True):  # With the journal's edits applied
+                    if values[2]:
+                        lot_counts[values[1]] += 1
+                    if is_archivable(values, cutoff):
+                        archived_lots.add(values[1])
+                        yield values
+                    else:
+                        writer.writerow(values)
+
+            with open(tmp_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as out:
+                count = archive.add(hot_rows(out))
+                out.flush()
+                os.fsync(out.fileno())
+            if not count:
+                os.remove(tmp_path)
+                return 0
+            reserve_archived_serials({lot: lot_counts[lot] for lot in archived_lots}, cursors_path)
+            os.replace(tmp_path, storage.path)
+            for path in (storage.journal.path, storage.journal.compacting_path):  # Their edits are in the new file
+                if os.path.exists(path):
+                    os.remove(path)
+            storage.journal.records = 0
+            storage.header = FIELDNAMES
+            storage.read_state = None  # Our own last read no longer matches the file: reload in full
+            storage.stale = True
+            storage.signature = file_signature(storage.path)
+            return count
+        finally:
+            storage.journal.compaction_lock.release()
+
+
+def archive_sqlite(storage, archive, cutoff, cursors_path):
+    where = "WHERE Serial != '' AND Active != 'True' AND datetime != '' AND datetime < ?"
+    connection = storage.connection
+    with connection:
+        connection.execute('BEGIN IMMEDIATE')  # Keeps other writers out from reading to deleting
+        lot_counts = dict(connection.execute(
+            f"SELECT Lot, COUNT(*) FROM lots_and_samples WHERE Serial != '' AND Lot IN "
+            f"(SELECT DISTINCT Lot FROM lots_and_samples {where}) GROUP BY Lot", (cutoff,)))
+        cursor = connection.cursor()
+        cursor.row_factory = None
+        count = archive.add(cursor.execute(f'SELECT {", ".join(FIELDNAMES)} FROM lots_and_samples {where} ORDER BY id', (cutoff,)))
+        reserve_archived_serials(lot_counts, cursors_path)
+        connection.execute(f'DELETE FROM lots_and_samples {where}', (cutoff,))
+    return count
+
+
+def archive_samples(storage, cutoff, cursors_path=CODES_FILE):
+    """Move inactive samples created before `cutoff` (a datetime string) to the archive; return how many."""
+    archive = ArchiveStore(archive_path(storage))
+    try:
+        if isinstance(storage, SqliteStorage):
+            return archive_sqlite(storage, archive, cutoff, cursors_path)
+        if isinstance(storage, ShardedStorage):
+            total = 0
+            for name in storage.shard_names(archived=True):
+                shard = storage.shard(name)
+                total += archive_csv(shard, archive, cutoff, cursors_path)
+                storage.release(shard)
+            return total
+        if isinstance(storage, CsvStorage):
+            return archive_csv(storage, archive, cutoff, cursors_path)
+        raise ValueError(f"Cannot archive from {type(storage).__name__}.")
+    finally:
+        archive.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old inactive samples, and look them up")
+    parser.add_argument('--data', metavar='FILE', help="data file or shard directory (default: the one the apps use)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="move inactive samples older than --older-than to the archive")
+    run_parser.add_argument('--older-than', default=ARCHIVE_AFTER, metavar='AGE',
+                            help=f"created before this date/time, or e.g. 52w, 90d ago (default: {ARCHIVE_AFTER})")
+    find_parser = commands.add_parser('find', help="print archived samples by FullCode, as CSV")
+    find_parser.add_argument('codes', nargs='+', metavar='FULLCODE')
+    args = parser.parse_args(argv)
+
+    try:
+        storage = open_data(args.data)
+    except FileNotFoundError as error:
+        parser.exit(1, f"{error}\n")
+    archive = ArchiveStore(archive_path(storage))
+    try:
+        if args.command == 'run':
+            try:
+                cutoff = parse_time(args.older_than)
+                count = archive_samples(storage, cutoff)
+            except ValueError as error:
+                parser.exit(1, f"{error}\n")
+            print(f"Archived {count} samples created before {cutoff}; {len(archive)} in {archive.path} "
+                  f"({os.path.getsize(archive.path) / 1e6:.1f} MB)" if count else f"No inactive samples created before {cutoff}.")
+            return
+        writer = csv.DictWriter(sys.stdout, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        missing = []
+        for code in args.codes:
+            row = archive.find(code)
+            if row:
+                writer.writerow(row)
+            else:
+                missing.append(code)
+        if missing:
+            parser.exit(1, f"Not archived: {', '.join(missing)}\n")
+    finally:
+        archive.close()
+        storage.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""Pure-Python Code 128 and QR Code encoders for sample labels.
+
+Both return plain module data for las_labels to draw: ``code128`` the widths
+of alternating bars and spaces, ``qr_matrix`` rows of booleans (True = dark).
+No imaging library or network access is needed.
+
+Code 128 uses code set C (two digits per symbol) for digit strings of even
+length, such as the 12-digit FullCode, and code set B otherwise.
+
+The QR encoder covers what labels need: numeric or byte mode, error
+correction level M, versions 1 to 3 (up to 44 data codewords, e.g. 80 digits
+or 42 bytes) - all single-block versions, so no interleaving is involved.
+When the ``qrcode`` package is installed it is used instead, for any length.
+"""
+import re
+
+try:
+    import qrcode
+except ImportError:  # The encoder below is used
+    qrcode = None
+
+# Bar/space widths of Code 128 symbol values 0-106 (103-105 are Start A/B/C, 106 is Stop)
+CODE128_PATTERNS = (
+    '212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 221312 231212 112232 122132 122231 '
+    '113222 123122 123221 223211 221132 221231 213212 223112 312131 311222 321122 321221 312212 322112 322211 '
+    '212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 231113 231311 112133 112331 132131 '
+    '113123 113321 133121 313121 211331 231131 213113 213311 213131 311123 311321 331121 312113 312311 332111 '
+    '314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 112412 122114 122411 142112 142211 '
+    '241211 221114 413111 241112 134111 111242 121142 121241 114212 124112 124211 411212 421112 421211 212141 '
+    '214121 412121 111143 111341 131141 114113 114311 411113 411311 113141 114131 311141 411131 211412 211214 '
+    '211232 2331112'
+).split()
+START_B, START_C, STOP = 104, 105, 106
+
+
+def code128(text):
+    """Bar/space widths (in modules, starting with a bar) of `text` as Code 128, without quiet zones."""
+    if text.isdigit() and len(text) % 2 == 0:
+        values = [START_C] + [int(text[i:i + 2]) for i in range(0, len(text), 2)]
+    else:
+        if any(not 32 <= ord(char) < 127 for char in text):
+            raise ValueError(f"Code 128 set B cannot encode {text!r}")
+        values = [START_B] + [ord(char) - 32 for char in text]
+    values.append(sum(value * max(1, position) for position, value in enumerate(values)) % 103)  # Check symbol
+    values.append(STOP)
+    return [int(width) for value in values for width in CODE128_PATTERNS[value]]
+
+
+# QR Code, error correction level M, versions 1-3: (data codewords, error correction codewords)
+QR_CAPACITY = {1: (16, 10), 2: (28, 16), 3: (44, 26)}
+QR_ALIGNMENT = {1: None, 2: 18, 3: 22}  # Centre of the single alignment pattern
+FORMAT_LEVEL_M = 0  # Error correction level bits in the format information
+NUMERIC = re.compile(r'[0-9]*')
+
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+_value = 1
+for _power in range(255):
+    GF_EXP[_power] = _value
+    GF_LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11D
+for _power in range(255, 512):
+    GF_EXP[_power] = GF_EXP[_power - 255]
+
+
+def rs_generator(degree):
+    polynomial = [1]
+    for power in range(degree):
+        polynomial = [a ^ (GF_EXP[GF_LOG[b] + power] if b else 0) for a, b in zip(polynomial + [0], [0] + polynomial)]
+    return polynomial
+
+
+def rs_remainder(data, degree):
+    """Reed-Solomon error correction codewords for `data`."""
+    generator = rs_generator(degree)
+    remainder = list(data) + [0] * degree
+    for position in range(len(data)):
+        factor = remainder[position]
+        if factor:
+            for offset, coefficient in enumerate(generator):
+                if coefficient:
+                    remainder[position + offset] ^= GF_EXP[GF_LOG[coefficient] + GF_LOG[factor]]
+    return remainder[len(data):]
+
+
+def qr_codewords(text):
+    """(version, data codewords + error correction codewords) for `text` at level M."""
+    data = text.encode('utf-8')
+    bits = []
+
+    def put(value, length):
+        bits.extend((value >> shift) & 1 for shift in range(length - 1, -1, -1))
+
+    if NUMERIC.fullmatch(text):
+        put(0b0001, 4)
+        put(len(text), 10)
+        for start in range(0, len(text), 3):
+            group = text[start:start + 3]
+            put(int(group), {3: 10, 2: 7, 1: 4}[len(group)])
+    else:
+        put(0b0100, 4)
+        put(len(data), 8)
+        for byte in data:
+            put(byte, 8)
+    version = next((version for version, (capacity, _) in QR_CAPACITY.items() if len(bits) <= capacity * 8), None)
+    if version is None:
+        raise ValueError(f"{text!r} is too long for a version 1-3 QR code; install the qrcode package")
+    capacity, ec_length = QR_CAPACITY[version]
+    bits.extend([0] * min(4, capacity * 8 - len(bits)))  # Terminator
+    bits.extend([0] * (-len(bits) % 8))
+    codewords = [int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    codewords += [0xEC, 0x11] * ((capacity - len(codewords)) // 2) + [0xEC] * ((capacity - len(codewords)) % 2)
+    return version, codewords + rs_remainder(codewords, ec_length)
+
+
+MASKS = (
+    lambda row, col: (row + col) % 2 == 0,
+    lambda row, col: row % 2 == 0,
+    lambda row, col: col % 3 == 0,
+    lambda row, col: (row + col) % 3 == 0,
+    lambda row, col: (row // 2 + col // 3) % 2 == 0,
+    lambda row, col: (row * col) % 2 + (row * col) % 3 == 0,
+    lambda row, col: ((row * col) % 2 + (row * col) % 3) % 2 == 0,
+    lambda row, col: ((row + col) % 2 + (row * col) % 3) % 2 == 0,
+)
+FINDER_LIKE = ('10111010000', '00001011101')  # Neither overlaps itself, so str.count finds them all
+LONG_RUN = re.compile('0{5,}|1{5,}')
+
+
+def function_modules(version):
+    """(modules, reserved): the fixed patterns, and which modules they occupy."""
+    size = 17 + 4 * version
+    modules = [[False] * size for _ in range(size)]
+    reserved = [[False] * size for _ in range(size)]
+
+    def put(row, col, dark):
+        modules[row][col] = dark
+        reserved[row][col] = True
+
+    for top, left in ((0, 0), (0, size - 7), (size - 7, 0)):
+        for row in range(-1, 8):
+            for col in range(-1, 8):
+                if 0 <= top + row < size and 0 <= left + col < size:
+                    ring = max(abs(row - 3), abs(col - 3))  # 0-1 centre, 2 light, 3 dark border, 4 separator
+                    put(top + row, left + col, ring != 2 and ring != 4)
+    for position in range(8, size - 8):
+        put(6, position, position % 2 == 0)
+        put(position, 6, position % 2 == 0)
+    centre = QR_ALIGNMENT[version]
+    if centre:
+        for row in range(-2, 3):
+            for col in range(-2, 3):
+                put(centre + row, centre + col, max(abs(row), abs(col)) != 1)
+    for position in range(9):  # Format information, written once the mask is chosen
+        reserved[8][position] = reserved[position][8] = True
+    for position in range(8):
+        reserved[8][size - 1 - position] = reserved[size - 1 - position][8] = True
+    put(size - 8, 8, True)  # The dark module
+    return modules, reserved
+
+
+def place_format(modules, mask):
+    size = len(modules)
+    data = FORMAT_LEVEL_M << 3 | mask
+    remainder = data
+    for _ in range(10):
+        remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+    bits = (data << 10 | remainder) ^ 0x5412
+    bit = [(bits >> position) & 1 == 1 for position in range(15)]
+    for position in range(6):
+        modules[position][8] = bit[position]
+    modules[7][8], modules[8][8], modules[8][7] = bit[6], bit[7], bit[8]
+    for position in range(9, 15):
+        modules[8][14 - position] = bit[position]
+    for position in range(8):
+        modules[8][size - 1 - position] = bit[position]
+    for position in range(8, 15):
+        modules[size - 15 + position][8] = bit[position]
+    modules[size - 8][8] = True
+
+
+def data_positions(reserved):
+    # (row, col) of each data bit, in placement order: two-column strips from the right, alternately upwards and downwards
+    size = len(reserved)
+    positions, right = [], size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5  # Skip the vertical timing pattern
+        upward = (right + 1) & 2 == 0
+        for step in range(size):
+            row = size - 1 - step if upward else step
+            positions.extend((row, col) for col in (right, right - 1) if not reserved[row][col])
+        right -= 2
+    return positions
+
+
+def packed(modules):
+    # Rows as integers, the leftmost module in the highest bit
+    return [int(''.join('1' if dark else '0' for dark in row), 2) for row in modules]
+
+
+LAYOUTS = {}
+
+
+def layout(version):
+    """Per version, built once: data bit positions as (row, bit) and, per mask, the packed fixed patterns and mask."""
+    found = LAYOUTS.get(version)
+    if found is None:
+        modules, reserved = function_modules(version)
+        size = len(modules)
+        positions = [(row, size - 1 - col) for row, col in data_positions(reserved)]
+        masks = []
+        for mask, applies in enumerate(MASKS):
+            fixed = [row[:] for row in modules]
+            place_format(fixed, mask)
+            flips = [[not reserved[row][col] and applies(row, col) for col in range(size)] for row in range(size)]
+            masks.append((packed(fixed), packed(flips)))
+        found = LAYOUTS[version] = size, positions, masks
+    return found
+
+
+def penalty(rows, size):
+    """The QR mask penalty of packed rows: runs, 2x2 blocks, finder-like patterns and dark/light balance."""
+    lines = [format(row, f'0{size}b') for row in rows]
+    text = ' '.join(lines + [''.join(column) for column in zip(*lines)])  # Every row and column, kept apart
+    runs = LONG_RUN.findall(text)
+    score = sum(map(len, runs)) - 2 * len(runs) + 40 * sum(map(text.count, FINDER_LIKE))
+    pairs = (1 << (size - 1)) - 1
+    for upper, lower in zip(rows, rows[1:]):
+        same = ~(upper ^ lower)  # Same colour as the module below
+        score += 3 * bin(same & (same >> 1) & ~(upper ^ (upper >> 1)) & pairs).count('1')
+    dark = text.count('1') // 2  # Each module is in one row and one column
+    return score + 10 * (abs(dark * 20 - size * size * 10) // (size * size))
+
+
+def qr_matrix(text):
+    """Rows of booleans (True = dark) of `text` as a QR code at error correction level M, without the quiet zone."""
+    if qrcode is not None:
+        code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=0)
+        code.add_data(text)
+        code.make(fit=True)
+        return [[bool(dark) for dark in row] for row in code.modules]
+    version, codewords = qr_codewords(text)
+    size, positions, masks = layout(version)
+    data = [0] * size
+    bits = int.from_bytes(bytes(codewords), 'big')
+    count = len(codewords) * 8
+    for index, (row, bit) in enumerate(positions[:count]):  # Remainder bits after the codewords stay light
+        if bits >> (count - 1 - index) & 1:
+            data[row] |= 1 << bit
+    best = None
+    for fixed, flips in masks:
+        rows = [a | (b ^ c) for a, b, c in zip(fixed, data, flips)]
+        score = penalty(rows, size)
+        if best is None or score < best[0]:
+            best = score, rows
+    return [[dark == '1' for dark in format(row, f'0{size}b')] for row in best[1]]
@@ -0,0 +1,580 @@
+"""Headless benchmarks for the LaS3 data paths.
+
+Run with ``python las_bench.py [number_of_samples ...] [--json results.json]``.
+Nothing here touches Tk, so it runs without a display. Every benchmark prints
+a summary line and returns its measurements; ``--json`` writes them all, with
+the Python version and git commit, for comparing runs between versions.
+
+``python las_bench.py 100000 --generate lots_and_samples.csv`` writes a
+synthetic data file of that size instead, to try the apps against.
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from las_archive import ArchiveStore, archive_path, archive_samples
+from las_codes import CODES_FILE
+from las_columns import export_columns, load_columns, per_lot
+from las_core import LotSampleStore, split_rows
+from las_history import NotesHistory
+from las_index import LotSampleIndex
+from las_labels import SymbolCache, write_sheets
+from las_picker import PrefixIndex
+from las_records import Sample
+from las_scan import ScanSession
+from las_server import LotSampleServer
+from las_shards import ShardedStorage, split
+from las_storage import CSV_FILE, FIELDNAMES, CsvStorage
+from las_upgrade import upgrade
+
+
+def synthetic_rows(n_samples, samples_per_lot=100, seed=0):
+    """Return (lots, samples) rows shaped like the ones LaS3.load_data builds."""
+    rng = random.Random(seed)
+    lots, samples = [], []
+    n_lots = max(1, n_samples // samples_per_lot)
+    for lot_number in range(n_lots):
+        lot_code = f"{lot_number:08d}"
+        lots.append({'datetime': '', 'Lot': lot_code, 'Serial': '', 'FullCode': '', 'Name': f"Lot {lot_number}", 'Notes': '', 'Active': ''})
+    for sample_number in range(n_samples):
+        lot = lots[sample_number % n_lots]
+        serial = f"{sample_number // n_lots:04d}"
+        samples.append({
+            'datetime': '2024-01-01 00:00:00',
+            'Lot': lot['Lot'],
+            'Serial': serial,
+            'FullCode': lot['Lot'] + serial,
+            'Name': f"Sample {sample_number}",
+            'Notes': '',
+            'Active': rng.random() < 0.5,
+        })
+    return lots, samples
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_operations(n_samples, repeat=200):
+    """Time the operations behind the LaS3 window, on a synthetic data file, without the window."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, CSV_FILE)
+        lots, samples = synthetic_rows(n_samples)
+        write_csv(path, lots + samples)
+        storage = CsvStorage(path)
+        store = LotSampleStore(storage, os.path.join(directory, CODES_FILE))
+        results = {'load_s': timed(store.load, 1)}  # Parse, index and allocator; writes the startup cache
+        results['load_cached_s'] = timed(store.load, 1)
+        rng = random.Random(3)
+        probes = [rng.choice(samples)['FullCode'] for _ in range(repeat)]
+        lot_code = lots[0]['Lot']
+
+        def add_lot():
+            storage.add_lot(dict(store.create_lot(f"Bench lot {len(store.lots)}")))
+
+        def add_sample():
+            storage.add_sample(store.create_sample(lot_code, f"Bench sample {len(store.samples)}"))
+
+        def search():
+            for code in probes:
+                store.index.sample_by_code(code)
+
+        def save_notes():
+            code = rng.choice(probes)
+            sample, fields, expected = store.edit_sample(code, notes=f"{store.index.sample_by_code(code)['Notes']} x")
+            store.saved(sample, storage.update_sample(code, fields, expected))
+
+        def dropdowns():
+            # What update_lot_dropdown and update_sample_dropdown build for the pickers
+            PrefixIndex(lot['Name'] for lot in store.lots)
+            PrefixIndex(sample['Name'] for sample in store.index.samples_in_lot(lot_code))
+
+        results['add_lot_s'] = timed(add_lot, repeat)
+        results['add_sample_s'] = timed(add_sample, repeat)
+        results['search_by_code_s'] = timed(search, 1) / repeat
+        results['save_notes_s'] = timed(save_notes, repeat)
+        results['dropdowns_s'] = timed(dropdowns, 10)
+        if storage.journal.compactor:
+            storage.journal.compactor.join()
+        storage.close()
+    print(f"{n_samples} samples: load {results['load_s'] * 1e3:.0f} ms ({results['load_cached_s'] * 1e3:.0f} ms cached), "
+          f"add lot {results['add_lot_s'] * 1e3:.2f} ms, add sample {results['add_sample_s'] * 1e3:.2f} ms, "
+          f"search by code {results['search_by_code_s'] * 1e6:.2f} us, save notes {results['save_notes_s'] * 1e3:.2f} ms, "
+          f"dropdowns {results['dropdowns_s'] * 1e3:.1f} ms")
+    return results
+
+
+def bench_index(n_samples, lookups=200):
+    lots, samples = synthetic_rows(n_samples)
+    rng = random.Random(1)
+    probes = [rng.choice(samples) for _ in range(lookups)]
+
+    def scan_lookups():
+        for probe in probes:
+            next((sample for sample in samples if sample['FullCode'] == probe['FullCode']), None)
+            next((lot['Name'] for lot in lots if lot['Lot'] == probe['Lot']), None)
+            next((sample for sample in samples if sample['Name'] == probe['Name'] and sample['Lot'] == probe['Lot']), None)
+
+    build_start = time.perf_counter()
+    index = LotSampleIndex(lots, samples)
+    build = time.perf_counter() - build_start
+
+    def index_lookups():
+        for probe in probes:
+            index.sample_by_code(probe['FullCode'])
+            index.lot_name(probe['Lot'])
+            index.sample_in_lot(probe['Lot'], probe['Name'])
+
+    scan = timed(scan_lookups, 1) / lookups
+    indexed = timed(index_lookups, 10) / lookups
+    print(f"{n_samples} samples: index build {build * 1e3:.1f} ms, "
+          f"scan lookup {scan * 1e6:.1f} us, indexed lookup {indexed * 1e6:.2f} us "
+          f"({scan / indexed:.0f}x)")
+    return {'build_s': build, 'scan_lookup_s': scan, 'indexed_lookup_s': indexed}
+
+
+def retained_bytes(build):
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def bench_memory(n_samples):
+    _, samples = synthetic_rows(n_samples)
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=FIELDNAMES)
+    writer.writeheader()
+    writer.writerows(samples)
+    del samples
+
+    def parse(make):
+        return [make(row) for row in csv.DictReader(io.StringIO(text.getvalue()))]
+
+    as_dicts = retained_bytes(lambda: parse(dict)) / n_samples
+    as_records = retained_bytes(lambda: parse(Sample.from_row)) / n_samples
+    print(f"{n_samples} samples: {as_dicts:.0f} bytes/sample as dicts, {as_records:.0f} bytes/sample as Sample records")
+    return {'dict_bytes_per_sample': as_dicts, 'record_bytes_per_sample': as_records}
+
+
+async def http_request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = int(next(line for line in head.decode().split('\r\n') if line.lower().startswith('content-length:')).split(':')[1])
+    return int(head.split()[1]), json.loads(await reader.readexactly(length))
+
+
+async def server_round(n_samples, clients, requests_per_client):
+    with tempfile.TemporaryDirectory() as directory:
+        storage = CsvStorage(os.path.join(directory, 'lots_and_samples.csv'))
+        lots, samples = synthetic_rows(n_samples)
+        storage.add_rows(lots + [dict(sample, Active=str(sample['Active'])) for sample in samples])
+        server = LotSampleServer(storage, os.path.join(directory, CODES_FILE))
+        started = asyncio.get_running_loop().create_future()
+        serving = asyncio.create_task(server.serve('127.0.0.1', 0, started.set_result))
+        port = (await started).sockets[0].getsockname()[1]
+
+        async def client(number):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            rng = random.Random(number)
+            for request in range(requests_per_client):
+                kind = request % 4
+                if kind == 0:
+                    status, _ = await http_request(reader, writer, 'POST', '/samples', {'lot': rng.choice(lots)['Lot'], 'name': f"Client {number} #{request}"})
+                elif kind == 1:
+                    status, _ = await http_request(reader, writer, 'PATCH', f"/samples/{rng.choice(samples)['FullCode']}", {'notes': f"note {request}"})
+                else:
+                    status, _ = await http_request(reader, writer, 'GET', f"/samples/{rng.choice(samples)['FullCode']}")
+                assert status in (200, 201), status
+            writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(number) for number in range(clients)))
+        elapsed = time.perf_counter() - start
+        serving.cancel()
+        storage.close()
+        return clients * requests_per_client / elapsed
+
+
+def bench_server(n_samples, clients=8, requests_per_client=200):
+    rate = asyncio.run(server_round(n_samples, clients, requests_per_client))
+    print(f"{n_samples} samples: HTTP server {rate:.0f} requests/sec "
+          f"({clients} keep-alive clients, half reads, a quarter each creates and note edits)")
+    return {'requests_per_s': rate}
+
+
+def write_csv(path, rows, header=True):
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        if header:
+            writer.writeheader()
+        writer.writerows(dict(row, Active=str(row['Active'])) for row in rows)
+
+
+def generate_csv(path, n_samples, samples_per_lot=100, seed=0):
+    """Write a lots_and_samples.csv with `n_samples` synthetic samples."""
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists; refusing to append to it")
+    lots, samples = synthetic_rows(n_samples, samples_per_lot, seed)
+    write_csv(path, lots + samples)
+    return len(lots), len(samples)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_startup(n_samples):
+    """Time reading every row into lots and Sample records, as an app start does, with and without the cache."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, CSV_FILE)
+        lots, samples = synthetic_rows(n_samples)
+        write_csv(path, lots + samples)
+        storage = CsvStorage(path)
+
+        def load():
+            split_rows(storage.row_values())
+
+        parse = timed(load, 1)  # No cache yet: parses the text, then writes the cache
+        cached = timed(load, 3)
+        _, extra = synthetic_rows(n_samples // 100 or 1, seed=1)
+        write_csv(path, [dict(sample, FullCode='X' + sample['FullCode']) for sample in extra], header=False)
+        tail = timed(load, 1)  # Cache plus the 1% of rows appended since
+        storage.close()
+    print(f"{n_samples} samples: start {parse * 1e3:.0f} ms parsing CSV, {cached * 1e3:.0f} ms from cache "
+          f"({parse / cached:.1f}x), {tail * 1e3:.0f} ms from cache + 1% appended rows")
+    return {'parse_s': parse, 'cached_s': cached, 'cached_plus_tail_s': tail}
+
+
+def bench_refresh(n_samples, appended=10):
+    """Time picking up a few rows and an edit written by another instance: incremental update vs full reload."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, CSV_FILE)
+        lots, samples = synthetic_rows(n_samples)
+        write_csv(path, lots + samples)
+        storage, other = CsvStorage(path), CsvStorage(path)
+        store = LotSampleStore(storage, os.path.join(directory, CODES_FILE))
+        store.load()
+        _, extra = synthetic_rows(appended, seed=1)
+        new_codes = ['X' + sample['FullCode'] for sample in extra]
+        for sample, code in zip(extra, new_codes):
+            other.add_sample(dict(sample, FullCode=code))
+        edited = samples[0]['FullCode']
+        other.update_sample(edited, {'Notes': 'edited elsewhere'})
+
+        start = time.perf_counter()
+        store.apply_updates(*storage.updates())
+        incremental = time.perf_counter() - start
+        assert all(store.index.sample_by_code(code) for code in new_codes)
+        assert store.index.sample_by_code(edited)['Notes'] == 'edited elsewhere'
+        full = timed(store.load, 1)
+        storage.close()
+        other.close()
+    print(f"{n_samples} samples: pick up {appended} appended rows and 1 edit in {incremental * 1e3:.1f} ms "
+          f"incrementally, {full * 1e3:.0f} ms reloading everything ({full / incremental:.0f}x)")
+    return {'incremental_s': incremental, 'full_reload_s': full}
+
+
+def bench_scan(n_samples, scans=1000):
+    """Time a check-in session: resolving scans in memory, then saving them in one write vs one write per scan."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, CSV_FILE)
+        lots, samples = synthetic_rows(n_samples)
+        write_csv(path, lots + samples)
+        storage = CsvStorage(path)
+        store = LotSampleStore(storage, os.path.join(directory, CODES_FILE))
+        store.load()
+        codes = [sample['FullCode'] for sample in random.Random(2).sample(samples, min(scans, n_samples))]
+        session = ScanSession(store.index)
+        resolve = timed(lambda: [session.scan(code) for code in codes], 1) / len(codes)
+        edits = session.edits()
+        batched = timed(lambda: storage.update_samples(edits), 1)
+        one_by_one = timed(lambda: [storage.update_sample(code, fields) for code, fields in edits.items()], 1)
+        if storage.journal.compactor:
+            storage.journal.compactor.join()  # Started by the journal growing past compact_after
+        storage.close()
+    print(f"{n_samples} samples: {len(codes)} scans resolved at {1 / resolve:.0f} scans/sec; saving {len(edits)} check-ins "
+          f"took {batched * 1e3:.0f} ms in one write, {one_by_one * 1e3:.0f} ms one write per scan")
+    return {'scan_s': resolve, 'save_batched_s': batched, 'save_one_by_one_s': one_by_one}
+
+
+def bench_columns(n_samples):
+    """Time the per-lot report: from the columnar copy vs scanning the rows as dicts each time."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, CSV_FILE)
+        lots, samples = synthetic_rows(n_samples)
+        write_csv(path, lots + samples)
+        storage = CsvStorage(path)
+        export = timed(lambda: export_columns(storage), 1)
+
+        def scan():
+            counts = {}
+            for row in storage.rows():
+                if row['Serial']:
+                    total, active = counts.get(row['Lot'], (0, 0))
+                    counts[row['Lot']] = total + 1, active + (row['Active'] == 'True')
+            return counts
+
+        scanned = timed(scan, 1)
+        columnar = timed(lambda: per_lot(load_columns(storage)), 3)
+        storage.close()
+    print(f"{n_samples} samples: per-lot report {columnar * 1e3:.0f} ms from columns, {scanned * 1e3:.0f} ms scanning rows "
+          f"({scanned / columnar:.0f}x); export {export * 1e3:.0f} ms")
+    return {'export_s': export, 'scan_report_s': scanned, 'columnar_report_s': columnar}
+
+
+def bench_history(n_samples, versions_per_sample=20, reads=200):
+    """Time reading the oldest and newest Notes versions as the history grows; memory holds one entry per sample."""
+    sampled = min(n_samples, 1000)  # Samples given a history; the rest of n_samples only sizes the run label
+    with tempfile.TemporaryDirectory() as directory:
+        history = NotesHistory(os.path.join(directory, 'lots_and_samples.history'))
+        keys = [f"{number:012d}" for number in range(sampled)]
+        start = time.perf_counter()
+        for version in range(versions_per_sample):
+            for key in keys:
+                history.append(key, f"Observation {version} of {key}: " + 'x' * 200)
+        append = (time.perf_counter() - start) / (sampled * versions_per_sample)
+        rng = random.Random(4)
+        probes = [rng.choice(keys) for _ in range(reads)]
+        oldest = timed(lambda: [history.notes(key, 0) for key in probes], 1) / reads
+        newest = timed(lambda: [history.notes(key) for key in probes], 1) / reads
+        fresh = NotesHistory(history.path)
+        reopen = timed(lambda: fresh.versions(keys[0]), 1)  # Reads the .keys checkpoint, then only the records after it
+        size = os.path.getsize(history.path)
+        history.close()
+        fresh.close()
+    print(f"{sampled} samples x {versions_per_sample} versions ({size / 1e6:.1f} MB of history): append {append * 1e3:.2f} ms, "
+          f"read oldest {oldest * 1e6:.0f} us, newest {newest * 1e6:.0f} us, reopen {reopen * 1e3:.0f} ms")
+    return {'append_s': append, 'read_oldest_s': oldest, 'read_newest_s': newest, 'reopen_s': reopen}
+
+
+def bench_labels(n_samples, count=10_000):
+    """Time label sheets for up to `count` samples: drawing every code, then again from the drawing cache."""
+    _, samples = synthetic_rows(min(n_samples, count))
+    labels = [(sample['FullCode'], sample['Name']) for sample in samples]
+    with tempfile.TemporaryDirectory() as directory:
+        cache = SymbolCache(os.path.join(directory, 'symbols'))
+        cold = timed(lambda: write_sheets(labels, os.path.join(directory, 'cold'), cache), 1)
+        warm = timed(lambda: write_sheets(labels, os.path.join(directory, 'warm'), cache), 1)
+        cache.close()
+    print(f"{len(labels)} labels on {os.cpu_count()} CPUs: {cold:.2f} s drawing ({len(labels) / cold:.0f} labels/sec), "
+          f"{warm:.2f} s from the cache")
+    return {'labels': len(labels), 'cpus': os.cpu_count(), 'cold_s': cold, 'cached_s': warm}
+
+
+def bench_shards(n_samples, samples_per_lot=100, lookups=20):
+    """Compare one data file with per-lot shards: lot name and sample lookups, compacting an edit, loading 10% of lots."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, CSV_FILE)
+        generate_csv(path, n_samples, samples_per_lot)
+        split_time = timed(lambda: split(path, os.path.join(directory, 'shards')).close(), 1)
+        single, sharded = CsvStorage(path), ShardedStorage(os.path.join(directory, 'shards'))
+        lots, samples = split_rows(single.row_values(streaming=True))
+        rng = random.Random(5)
+        probe_lots = [rng.choice(lots)['Lot'] for _ in range(lookups)]
+        probe_samples = [rng.choice(samples).FullCode for _ in range(lookups)]
+        results = {'split_s': split_time}
+        for name, storage in (('single', single), ('sharded', sharded)):
+            results[f'{name}_lot_name_s'] = timed(lambda: [storage.lot_name(code) for code in probe_lots], 1) / lookups
+            results[f'{name}_sample_s'] = timed(lambda: [storage.sample(code) for code in probe_samples], 1) / lookups
+        # An edit is folded into the data by compaction, which rewrites the file it is in
+        single.update_sample(probe_samples[0], {'Notes': 'edited'})
+        results['single_compact_s'] = timed(lambda: single.journal.compact(single.path, lambda row: row['FullCode'], dict.update, FIELDNAMES), 1)
+        sharded.update_sample(probe_samples[0], {'Notes': 'edited'})
+        shard = sharded.sample_shard(probe_samples[0])
+        results['sharded_compact_s'] = timed(lambda: shard.journal.compact(shard.path, lambda row: row['FullCode'], dict.update, FIELDNAMES), 1)
+        names = sharded.shard_names()
+        sharded.set_archived(names[len(names) // 10:])
+        results['single_load_s'] = timed(lambda: sum(1 for _ in single.row_values(streaming=True)), 1)
+        results['sharded_active_load_s'] = timed(lambda: sum(1 for _ in sharded.row_values(streaming=True)), 1)
+        single.close()
+        sharded.close()
+    print(f"{n_samples} samples, one file vs {len(names)} lot shards: lot name {results['single_lot_name_s'] * 1e3:.1f} vs "
+          f"{results['sharded_lot_name_s'] * 1e3:.2f} ms, sample {results['single_sample_s'] * 1e3:.1f} vs "
+          f"{results['sharded_sample_s'] * 1e3:.2f} ms, compact an edit {results['single_compact_s'] * 1e3:.0f} vs "
+          f"{results['sharded_compact_s'] * 1e3:.1f} ms, load with 90% archived {results['single_load_s'] * 1e3:.0f} vs "
+          f"{results['sharded_active_load_s'] * 1e3:.0f} ms; split {split_time:.1f} s")
+    return results
+
+
+def bench_archive(n_samples, lookups=200):
+    """Archive the inactive half of n_samples: hot load before and after, archive size, archived lookups."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, CSV_FILE)
+        generate_csv(path, n_samples)
+        storage = CsvStorage(path)
+        inactive = [values[3] for values in storage.row_values(streaming=True) if values[2] and values[6] != 'True']
+        before_bytes = os.path.getsize(path)
+        load_before = timed(lambda: sum(1 for _ in storage.row_values(streaming=True)), 1)
+        elapsed = timed(lambda: archive_samples(storage, '2025-01-01 00:00:00', os.path.join(directory, CODES_FILE)), 1)
+        load_after = timed(lambda: sum(1 for _ in storage.row_values(streaming=True)), 1)
+        archive = ArchiveStore(archive_path(storage))
+        archived_bytes = before_bytes - os.path.getsize(path)
+        ratio = archived_bytes / os.path.getsize(archive.path)
+        probes = random.Random(6).sample(inactive, min(lookups, len(inactive)))
+        find = timed(lambda: [archive.find(code) for code in probes], 1) / len(probes)
+        archive.close()
+        storage.close()
+    print(f"{n_samples} samples, {len(inactive)} archived in {elapsed:.2f} s: hot load {load_before * 1e3:.0f} -> "
+          f"{load_after * 1e3:.0f} ms, archive {ratio:.1f}x smaller than the rows it holds, lookup {find * 1e3:.2f} ms")
+    return {'archived': len(inactive), 'archive_s': elapsed, 'load_before_s': load_before, 'load_after_s': load_after,
+            'compression_ratio': ratio, 'find_s': find}
+
+
+def peak_bytes(run):
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench_upgrade(n_samples, samples_per_lot=100):
+    """Time upgrading LaS1 lots.csv / samples.csv of n_samples into a new LaS3 data file, and its peak memory."""
+    with tempfile.TemporaryDirectory() as directory:
+        lots_path, samples_path = os.path.join(directory, 'lots.csv'), os.path.join(directory, 'samples.csv')
+        n_lots = max(1, n_samples // samples_per_lot)
+        with open(lots_path, 'w', newline='') as f:
+            csv.writer(f).writerows([f'L{number}', f'Lot {number}', ''] for number in range(n_lots))
+        with open(samples_path, 'w', newline='') as f:
+            csv.writer(f).writerows([f'S{number}', f'Sample {number}', 'Notes ' * 5, f'Lot {number % n_lots}']
+                                    for number in range(n_samples))
+        cursors = os.path.join(directory, CODES_FILE)
+        elapsed = timed(lambda: upgrade(lots_path, samples_path, os.path.join(directory, 'timed.csv'), cursors), 1)
+        peak = peak_bytes(lambda: upgrade(lots_path, samples_path, os.path.join(directory, 'traced.csv'), cursors))
+    rate = (n_lots + n_samples) / elapsed
+    print(f"{n_samples} LaS1 samples in {n_lots} lots: upgraded in {elapsed:.2f} s ({rate:.0f} rows/sec), "
+          f"peak {peak / 1e6:.1f} MB traced")
+    return {'upgrade_s': elapsed, 'rows_per_s': rate, 'peak_bytes': peak}
+
+
+def writer_process(directory, number, operations, lot_code, shared_code):
+    # One of several app instances: adds samples and appends a tag to the notes of one shared sample
+    storage = CsvStorage(os.path.join(directory, CSV_FILE))
+    store = LotSampleStore(storage, os.path.join(directory, CODES_FILE))
+    store.load()
+    created = []
+    for operation in range(operations):
+        tag = f"P{number}-{operation}"
+        if operation % 2:
+            notes = f"{store.index.sample_by_code(shared_code)['Notes']} {tag}".strip()
+            sample, fields, expected = store.edit_sample(shared_code, notes=notes)
+            store.saved(sample, storage.update_sample(shared_code, fields, expected))
+        else:
+            sample = store.create_sample(lot_code, tag)
+            storage.add_sample(sample)
+            created.append(sample['FullCode'])
+    storage.close()
+    return created
+
+
+def bench_concurrent_writers(processes=4, operations=400):
+    """Run `processes` writers against one CSV at once and check that no row or note edit was lost."""
+    with tempfile.TemporaryDirectory() as directory:
+        storage = CsvStorage(os.path.join(directory, CSV_FILE))
+        store = LotSampleStore(storage, os.path.join(directory, CODES_FILE))
+        store.load()
+        lot = store.create_lot('Shared lot')
+        shared = store.create_sample(lot['Lot'], 'Shared sample')
+        storage.add_rows([lot, shared])
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(processes) as pool:
+            created = pool.starmap(writer_process, [(directory, number, operations, lot['Lot'], shared['FullCode'])
+                                                    for number in range(processes)])
+        elapsed = time.perf_counter() - start
+
+        store.load()
+        codes = [sample['FullCode'] for sample in store.samples]
+        expected_codes = {code for codes_of_process in created for code in codes_of_process}
+        tags = set(store.index.sample_by_code(shared['FullCode'])['Notes'].split())
+        lost_rows = len(expected_codes - set(codes))
+        duplicates = len(codes) - len(set(codes))
+        lost_edits = sum(f"P{number}-{operation}" not in tags
+                         for number in range(processes) for operation in range(1, operations, 2))
+        storage.close()
+    print(f"{processes} processes x {operations} writes: {processes * operations / elapsed:.0f} writes/sec, "
+          f"{lost_rows} lost rows, {duplicates} duplicate codes, {lost_edits} lost note edits")
+    return {'writes_per_s': processes * operations / elapsed, 'lost_rows': lost_rows,
+            'duplicate_codes': duplicates, 'lost_note_edits': lost_edits}
+
+
+BENCHMARKS = {
+    'operations': bench_operations,
+    'index': bench_index,
+    'memory': bench_memory,
+    'server': bench_server,
+    'startup': bench_startup,
+    'refresh': bench_refresh,
+    'scan': bench_scan,
+    'columns': bench_columns,
+    'history': bench_history,
+    'labels': bench_labels,
+    'upgrade': bench_upgrade,
+    'shards': bench_shards,
+    'archive': bench_archive,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless LaS benchmarks on synthetic data")
+    parser.add_argument('sizes', nargs='*', type=int, default=[10_000, 100_000], help="numbers of samples to run with")
+    parser.add_argument('--only', nargs='+', choices=[*BENCHMARKS, 'concurrent'], help="run just these benchmarks")
+    parser.add_argument('--json', metavar='PATH', help="also write the results as JSON ('-' for stdout, with the summaries on stderr)")
+    parser.add_argument('--generate', metavar='CSV', help="write a synthetic data file of the first size and exit")
+    parser.add_argument('--samples-per-lot', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        try:
+            n_lots, n_samples = generate_csv(args.generate, args.sizes[0], args.samples_per_lot)
+        except FileExistsError as error:
+            parser.exit(1, f"{error}\n")
+        print(f"Wrote {n_lots} lots and {n_samples} samples to {args.generate}")
+        return
+
+    selected = args.only or [*BENCHMARKS, 'concurrent']
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'sizes': {},
+    }
+    # With the JSON on stdout, the summary lines go to stderr so stdout stays parseable
+    with contextlib.redirect_stdout(sys.stderr) if args.json == '-' else contextlib.nullcontext():
+        for size in args.sizes:
+            report['sizes'][str(size)] = {name: bench(size) for name, bench in BENCHMARKS.items() if name in selected}
+        if 'concurrent' in selected:
+            report['concurrent_writers'] = bench_concurrent_writers()
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Binary cache of the parsed CSV data file, for a fast start.
+
+After a full read, ``CsvStorage`` stores every row in ``<data file>.cache``:
+one JSON header line describing the CSV it was made from, followed by the
+seven FIELDNAMES columns as lists, serialized with ``marshal``. Loading those
+lists is several times faster than parsing the CSV text again.
+
+The header records the CSV's size, mtime, inode, a hash of its first and
+last 4 KB and a hash of all of it (up to that size). On the next start the
+cache is used if the file is still the same inode and the 4 KB hashes still
+match, and either its mtime is unchanged or the hash of the whole covered
+prefix still matches: rows appended since then are parsed from the recorded
+size onward. Checking the whole prefix once the file was touched catches an
+edit in place that keeps the size, such as a text editor fixing a Name.
+Anything else (a compaction, an edit in a spreadsheet, a different Python's
+marshal format) falls back to a full parse, which writes a fresh cache.
+"""
+import hashlib
+import json
+import marshal
+import os
+
+CACHE_VERSION = 2
+HASHED_BYTES = 4096
+CHUNK = 1 << 20
+
+
+def region_hash(f, start, stop):
+    f.seek(start)
+    return hashlib.sha1(f.read(stop - start)).hexdigest()
+
+
+def prefix_hash(f, size):
+    f.seek(0)
+    digest, remaining = hashlib.sha1(), size
+    while remaining > 0:
+        chunk = f.read(min(CHUNK, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def describe(csvfile, size):
+    stat = os.fstat(csvfile.fileno())
+    return {
+        'version': CACHE_VERSION,
+        'marshal': marshal.version,
+        'size': size,
+        'mtime_ns': stat.st_mtime_ns,
+        'inode': stat.st_ino,
+        'head': region_hash(csvfile, 0, min(size, HASHED_BYTES)),
+        'tail': region_hash(csvfile, max(0, size - HASHED_BYTES), size),
+        'prefix': prefix_hash(csvfile, size),
+    }
+
+
+def is_prefix(description, csvfile, size):
+    """True if `csvfile` (now `size` bytes) still starts with the file `description` was made from."""
+    cached_size = description['size']
+    stat = os.fstat(csvfile.fileno())
+    if (cached_size > size or description.get('version') != CACHE_VERSION or description.get('marshal') != marshal.version
+            or description.get('inode') != stat.st_ino
+            or description.get('head') != region_hash(csvfile, 0, min(cached_size, HASHED_BYTES))
+            or description.get('tail') != region_hash(csvfile, max(0, cached_size - HASHED_BYTES), cached_size)):
+        return False
+    if stat.st_mtime_ns == description.get('mtime_ns') and size == cached_size:
+        return True  # Not written to since
+    return prefix_hash(csvfile, cached_size) == description.get('prefix')
+
+
+def read_cache(cache_path, csvfile, size):
+    """Return (cached_size, columns) if the cache describes a prefix of `csvfile`, else None."""
+    try:
+        with open(cache_path, 'rb') as f:
+            header = json.loads(f.readline())
+            cached_size = header['size']
+            if not is_prefix(header, csvfile, size):
+                return None
+            return cached_size, marshal.loads(f.read())
+    except (OSError, ValueError, EOFError, TypeError, KeyError):
+        return None
+
+
+def write_cache(cache_path, csvfile, size, columns):
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(describe(csvfile, size)).encode() + b'\n')
+        marshal.dump(columns, f)
+    os.replace(tmp_path, cache_path)
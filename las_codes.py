@@ -0,0 +1,183 @@
+"""Collision-free allocation of lot codes and sample serials.
+
+Lot codes are 8 digits and serials 4 digits per lot. Instead of drawing
+random digits and hoping, each code space is walked in the order of a keyed
+Feistel permutation: consecutive positions give scattered-looking codes, every
+position maps to a distinct code, and a code already in the data is simply
+skipped. Allocation is O(1) apart from those skips.
+
+The cursor (next position) per lot starts at the number of codes already used,
+which is exact when the codes came from this allocator. With ``cursors_path``
+the cursors live in CODES_FILE, an SQLite table with one row per cursor, and
+every allocation claims its positions there in one transaction that touches
+only its own row, so codes handed out by ``reserve_*`` but not yet written as
+rows survive restarts, and app instances sharing the data never hand out the
+same code. A cursor never wraps around: once it reaches the end of its code
+space, allocating raises ValueError.
+
+Reserve a batch of serials for pre-printed labels with::
+
+    python las_codes.py reserve <lot code> <count>
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+
+CODES_FILE = 'lots_and_samples.codes'  # SQLite; earlier versions kept lots_and_samples.codes.json
+LOT_DIGITS = 8
+SERIAL_DIGITS = 4
+ROUNDS = 4
+LOTS = ''  # Cursor key for the lot code space
+
+
+def permute(position, digits, key):
+    # Balanced Feistel network on the two halves of a `digits`-digit decimal number
+    half = 10 ** (digits // 2)
+    left, right = divmod(position, half)
+    for round_number in range(ROUNDS):
+        digest = hashlib.blake2b(f'{key}:{round_number}:{right}'.encode(), digest_size=4).digest()
+        left, right = right, (left + int.from_bytes(digest, 'big')) % half
+    return left * half + right
+
+
+def used_up(cursor_key, space):
+    return f"All {space} codes of lot {cursor_key} have been handed out." if cursor_key else f"All {space} lot codes have been handed out."
+
+
+def open_cursors(path):
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)  # Transactions are begun explicitly
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS cursors (key TEXT PRIMARY KEY, position INTEGER NOT NULL)')
+    if connection.execute('PRAGMA user_version').fetchone()[0] == 0:
+        # First use: take over the cursors of the JSON file earlier versions kept
+        connection.execute('BEGIN IMMEDIATE')
+        if connection.execute('PRAGMA user_version').fetchone()[0] == 0:
+            try:
+                with open(path + '.json') as f:
+                    connection.executemany('INSERT OR REPLACE INTO cursors VALUES (?, ?)', json.load(f).items())
+            except FileNotFoundError:
+                pass
+            connection.execute('PRAGMA user_version = 1')
+        connection.execute('COMMIT')
+    return connection
+
+
+def load_cursors(path=CODES_FILE):
+    connection = open_cursors(path)
+    try:
+        return dict(connection.execute('SELECT key, position FROM cursors'))
+    finally:
+        connection.close()
+
+
+def claim_positions(path, cursor_key, start, count, space=None):
+    """Reserve `count` positions at or after `start` in the shared cursor table; return the first.
+
+    Only the one cursor's row is read and written, in a single transaction.
+    Raises ValueError if that would run past `space`.
+    """
+    connection = open_cursors(path)
+    try:
+        connection.execute('BEGIN IMMEDIATE')  # Other processes wait here until we commit
+        row = connection.execute('SELECT position FROM cursors WHERE key = ?', (cursor_key,)).fetchone()
+        position = max(row[0] if row else 0, start)
+        if space is not None and position + count > space:
+            connection.execute('ROLLBACK')
+            raise ValueError(used_up(cursor_key, space))
+        connection.execute('INSERT INTO cursors VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET position = excluded.position',
+                           (cursor_key, position + count))
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+    return position
+
+
+class CodeAllocator:
+    def __init__(self, lots=(), samples=(), cursors_path=None, archive=None):
+        self.lot_codes = {lot['Lot'] for lot in lots}
+        self.serials = {}
+        self.archive = archive  # las_archive.ArchiveStore: its serials count as used, read per lot when first needed
+        self.archive_read = set()  # Lots whose archived serials are in self.serials
+        for sample in samples:
+            self.serials.setdefault(sample['Lot'], set()).add(sample['Serial'])
+        self.cursors_path = cursors_path
+        self.cursors = {}  # Next position per cursor key, as far as this allocator knows
+
+    def add_lot(self, lot_code):
+        self.lot_codes.add(lot_code)
+
+    def add_sample(self, lot_code, serial):
+        self.serials.setdefault(lot_code, set()).add(serial)
+
+    def allocate(self, used, cursor_key, digits, count):
+        space = 10 ** digits
+        if len(used) + count > space:
+            raise ValueError(f"Only {space - len(used)} free codes left, {count} requested.")
+        position = max(self.cursors.get(cursor_key, 0), len(used))
+        codes = []
+        while len(codes) < count:
+            claimed = count - len(codes)
+            if self.cursors_path:  # Take the positions in the shared file first, so no other instance gets them
+                position = claim_positions(self.cursors_path, cursor_key, position, claimed, space)
+            elif position + claimed > space:
+                raise ValueError(used_up(cursor_key, space))
+            for position in range(position, position + claimed):
+                code = f'{permute(position, digits, cursor_key):0{digits}d}'
+                if code not in used:
+                    used.add(code)
+                    codes.append(code)
+            position += 1
+        self.cursors[cursor_key] = position
+        return codes
+
+    def lot_serials(self, lot_code):
+        serials = self.serials.setdefault(lot_code, set())
+        if self.archive is not None and lot_code not in self.archive_read:
+            serials.update(self.archive.serials(lot_code))
+            self.archive_read.add(lot_code)
+        return serials
+
+    def lot_code(self):
+        return self.allocate(self.lot_codes, LOTS, LOT_DIGITS, 1)[0]
+
+    def serial(self, lot_code):
+        return self.allocate(self.lot_serials(lot_code), lot_code, SERIAL_DIGITS, 1)[0]
+
+    def reserve_lot_codes(self, count):
+        return self.allocate(self.lot_codes, LOTS, LOT_DIGITS, count)
+
+    def reserve_serials(self, lot_code, count):
+        """Full 12-digit codes for `count` new samples of one lot."""
+        serials = self.allocate(self.lot_serials(lot_code), lot_code, SERIAL_DIGITS, count)
+        return [lot_code + serial for serial in serials]
+
+
+def main(argv=None):
+    from las_archive import ArchiveStore, archive_path  # las_archive builds on this module
+    from las_storage import open_storage
+
+    parser = argparse.ArgumentParser(description="Reserve sample codes for pre-printed labels")
+    commands = parser.add_subparsers(dest='command', required=True)
+    reserve_parser = commands.add_parser('reserve', help="reserve N FullCodes in a lot")
+    reserve_parser.add_argument('lot_code')
+    reserve_parser.add_argument('count', type=int)
+    args = parser.parse_args(argv)
+
+    lots, samples = [], []
+    storage = open_storage()
+    for row in storage.rows():
+        (samples if row['Serial'] else lots).append(row)
+    if args.lot_code not in {lot['Lot'] for lot in lots}:
+        parser.exit(1, f"No lot with code {args.lot_code}\n")
+    allocator = CodeAllocator(lots, samples, CODES_FILE, ArchiveStore(archive_path(storage)))
+    try:
+        codes = allocator.reserve_serials(args.lot_code, args.count)
+    except ValueError as error:
+        parser.exit(1, f"{error}\n")
+    print('\n'.join(codes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""Columnar copy of the sample data, and per-lot / per-day reports on it.
+
+``export_columns`` streams the data file once and keeps just what the reports
+need, one typed array per column:
+
+* ``lot`` - index into the header's list of lot codes (uint32)
+* ``day`` - creation day, days since 1970-01-01 (uint32; 0 when unknown or before 1970)
+* ``active`` - 1 or 0 (uint8)
+
+The file ``<data file>.columns`` holds a JSON header line (lot codes and
+names, row count, array layout, and the signature of the data file it was
+made from) followed by the raw array bytes, so loading it is a few reads, and
+the arrays need no parsing. ``load_columns`` rebuilds the file whenever the
+data changed since.
+
+The reports count with ``numpy.bincount`` when NumPy is installed and with
+``collections.Counter`` over the arrays otherwise; either way no per-row
+Python code runs.
+
+Run ``python las_columns.py per-lot`` or ``python las_columns.py per-day``
+(``--format json`` for JSON, ``--data FILE`` for another data file).
+"""
+import argparse
+import array
+import csv
+import itertools
+import json
+import os
+import sys
+from collections import Counter
+from datetime import date, datetime
+
+from las_query import open_data
+from las_shards import ShardedStorage
+from las_storage import CsvStorage, file_signature
+
+try:
+    import numpy as np
+except ImportError:  # Counting falls back to collections.Counter
+    np = None
+
+COLUMNS_VERSION = 1
+TYPECODES = {'lot': 'I', 'day': 'I', 'active': 'B'}
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def columns_path(storage):
+    return storage.path + '.columns'
+
+
+def source_signature(storage):
+    # The data file plus the file its recent edits go to (the journal, or SQLite's write-ahead log)
+    if isinstance(storage, ShardedStorage):
+        return storage.signatures()
+    extra = storage.journal.path if isinstance(storage, CsvStorage) else storage.path + '-wal'
+    return [list(file_signature(path)) if os.path.exists(path) else None for path in (storage.path, extra)]
+
+
+def day_number(text, days):
+    # Days since 1970 of a 'YYYY-MM-DD ...' timestamp; `days` caches the parse per distinct date
+    key = text[:10]
+    day = days.get(key)
+    if day is None:
+        try:
+            day = max(0, datetime.strptime(key, '%Y-%m-%d').toordinal() - EPOCH)  # Earlier days count as unknown
+        except ValueError:
+            day = 0
+        days[key] = day
+    return day
+
+
+class Columns:
+    def __init__(self, lots, names, lot, day, active):
+        self.lots, self.names = lots, names  # Lot codes and names, by lot index
+        self.lot, self.day, self.active = lot, day, active
+
+    def __len__(self):
+        return len(self.lot)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from row_values() rows, keeping only samples (and the names of their lots)."""
+        lots, names, lot_index, days = [], [], {}, {}
+        lot, day, active = (array.array(TYPECODES[name]) for name in ('lot', 'day', 'active'))
+        for values in rows:
+            code = values[1]
+            if not code:
+                continue
+            position = lot_index.get(code)
+            if position is None:
+                position = lot_index[code] = len(lots)
+                lots.append(code)
+                names.append('')
+            if not values[2]:
+                names[position] = values[4]  # A lot row
+                continue
+            lot.append(position)
+            day.append(day_number(values[0] or '', days))
+            active.append(values[6] == 'True')
+        return cls(lots, names, lot, day, active)
+
+    def arrays(self):
+        return {'lot': self.lot, 'day': self.day, 'active': self.active}
+
+    def write(self, path, source=None):
+        header = {'version': COLUMNS_VERSION, 'source': source, 'rows': len(self), 'lots': self.lots, 'names': self.names,
+                  'typecodes': {name: values.typecode for name, values in self.arrays().items()},
+                  'itemsizes': {name: values.itemsize for name, values in self.arrays().items()}}
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            for values in self.arrays().values():
+                values.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def read(cls, path):
+        """Return (columns, source signature), or None if the file is missing or from another version."""
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != COLUMNS_VERSION:
+                    return None
+                arrays = {}
+                for name in ('lot', 'day', 'active'):
+                    values = arrays[name] = array.array(header['typecodes'][name])
+                    if values.itemsize != header['itemsizes'][name]:
+                        return None  # Written on a platform with other C type sizes
+                    values.fromfile(f, header['rows'])
+        except (OSError, ValueError, EOFError, KeyError):
+            return None
+        return cls(header['lots'], header['names'], **arrays), header['source']
+
+
+def export_columns(storage, path=None):
+    """Write the columnar copy of `storage`'s samples; return it."""
+    source = source_signature(storage)  # Taken before reading, so a write during the export makes it stale
+    columns = Columns.from_rows(storage.row_values(streaming=True))
+    columns.write(path or columns_path(storage), source)
+    return columns
+
+
+def load_columns(storage, path=None):
+    """The columnar copy of `storage`'s samples, rebuilt first if the data changed since it was made."""
+    found = Columns.read(path or columns_path(storage))
+    if found and found[1] == source_signature(storage):
+        return found[0]
+    return export_columns(storage, path)
+
+
+def count_by(keys, size, weights=None):
+    """Per key in range(size): how many rows have it (or the sum of `weights`, 0/1 per row, over them)."""
+    if np is not None:
+        keys = np.frombuffer(keys, dtype=np.dtype(keys.typecode))
+        if weights is not None:
+            weights = np.frombuffer(weights, dtype=np.uint8)
+        return np.bincount(keys, weights, minlength=size).astype(np.int64).tolist()
+    counts = Counter(keys if weights is None else itertools.compress(keys, weights))
+    return [counts.get(key, 0) for key in range(size)]
+
+
+def per_lot(columns):
+    """Samples and active samples per lot: [{'Lot', 'Name', 'samples', 'active', 'active_ratio'}]."""
+    totals = count_by(columns.lot, len(columns.lots))
+    active = count_by(columns.lot, len(columns.lots), columns.active)
+    return [{'Lot': code, 'Name': name, 'samples': total, 'active': on, 'active_ratio': on / total}
+            for code, name, total, on in zip(columns.lots, columns.names, totals, active) if total]
+
+
+def per_day(columns):
+    """Samples created per day: [{'day', 'created', 'active'}], in date order, days without samples left out."""
+    if not len(columns):
+        return []
+    size = max(columns.day) + 1
+    created = count_by(columns.day, size)
+    active = count_by(columns.day, size, columns.active)
+    return [{'day': date.fromordinal(EPOCH + day).isoformat() if day else None, 'created': count, 'active': on}
+            for day, (count, on) in enumerate(zip(created, active)) if count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-lot and per-day sample counts from a columnar copy of the data")
+    parser.add_argument('report', choices=['per-lot', 'per-day', 'export'])
+    parser.add_argument('--data', metavar='FILE', help="data file (default: the one the apps use)")
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    args = parser.parse_args(argv)
+
+    try:
+        storage = open_data(args.data)
+    except FileNotFoundError as error:
+        parser.exit(1, f"{error}\n")
+    try:
+        if args.report == 'export':
+            columns = export_columns(storage)
+            print(f"Wrote {len(columns)} samples in {len(columns.lots)} lots to {columns_path(storage)}")
+            return
+        columns = load_columns(storage)
+    finally:
+        storage.close()
+    report = per_lot(columns) if args.report == 'per-lot' else per_day(columns)
+    try:
+        if args.format == 'json':
+            json.dump(report, sys.stdout, indent=1)
+            print()
+        elif report:
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(report[0]))
+            writer.writeheader()
+            writer.writerows(report)
+    except BrokenPipeError:  # Output piped into e.g. head
+        pass
+
+
+if __name__ == '__main__':
+    main()
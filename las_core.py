@@ -0,0 +1,162 @@
+"""Lot and sample operations without any user interface.
+
+``new_lot`` and ``new_sample`` validate input and allocate codes; they raise
+ValueError with a message fit to show the user. ``LotSampleStore`` keeps the
+rows, the lookup index and the code allocator for one Storage backend, and is
+what the headless tools (las_server, las_import) work on.
+
+The ``create_*`` / ``edit_sample`` methods only change memory and return what
+has to be persisted, so callers decide where the storage write runs (the Tk
+worker thread, an executor in the HTTP server, or inline in a CLI).
+"""
+import contextlib
+import gc
+from datetime import datetime
+
+from las_codes import CODES_FILE, CodeAllocator
+from las_index import LotSampleIndex
+from las_records import Sample
+from las_storage import FIELDNAMES
+
+
+def timestamp():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def new_lot(name, codes):
+    name = name.strip()
+    if not name:
+        raise ValueError("Lot name cannot be empty.")
+    return {'Lot': codes.lot_code(), 'Name': name}  # Other fields remain empty for a lot entry
+
+
+def new_sample(lot_code, name, codes):
+    name = name.strip()
+    if not name:
+        raise ValueError("Sample name cannot be empty.")
+    try:
+        serial = codes.serial(lot_code)  # A 4-digit serial not yet used in this lot
+    except ValueError as error:
+        raise ValueError(f"Cannot add a sample to this lot: {error}") from None
+    # The full 12-digit code consists of the lot and sample codes; a new sample is not active
+    return Sample(datetime=timestamp(), Lot=lot_code, Serial=serial, FullCode=lot_code + serial, Name=name, Notes='', Active='False')
+
+
+def is_active(sample):
+    # Loaded samples hold a bool, edited ones the 'True'/'False' string written to storage
+    return sample['Active'] in (True, 'True')
+
+
+@contextlib.contextmanager
+def bulk_load():
+    """Pause the cyclic garbage collector while building objects that all stay alive.
+
+    Otherwise every few thousand new records trigger a collection that walks
+    everything loaded so far, which makes loading a million samples several
+    times slower. Nothing is frozen afterwards: reloads replace what was
+    loaded, and cycles left by the old records must stay collectable.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def split_rows(rows):
+    """Sort Storage.row_values() rows into (lots, samples), samples as Sample records with a boolean Active."""
+    lots, samples = [], []
+    with bulk_load():
+        for values in rows:
+            if values[2]:  # It's a sample
+                samples.append(Sample.from_values(values))
+            elif values[1]:  # It's a lot
+                lots.append(dict(zip(FIELDNAMES, values)))
+    return lots, samples
+
+
+def merge_updates(index, new_rows, edits):
+    """Fold Storage.updates() into `index`; return the (lots, samples, edited samples) it changed.
+
+    Rows already in the index, such as the ones this instance wrote itself,
+    are skipped, and an edit only counts if it differs from what memory holds.
+    """
+    lots, samples, edited = [], [], []
+    for values in new_rows:
+        if values[2]:
+            if index.sample_by_code(values[3]) is None:
+                sample = Sample.from_values(values)
+                index.add_sample(sample)
+                samples.append(sample)
+        elif values[1] and index.lot_by_code(values[1]) is None:
+            lot = dict(zip(FIELDNAMES, values))
+            index.add_lot(lot)
+            lots.append(lot)
+    for full_code, fields in edits.items():
+        sample = index.sample_by_code(full_code)
+        if sample is None:
+            continue
+        current = {'Notes': sample['Notes'], 'Active': 'True' if is_active(sample) else 'False'}
+        changed = {field: value for field, value in fields.items() if current.get(field, sample[field]) != value}
+        for field, value in changed.items():
+            sample[field] = value
+        if changed:
+            edited.append(sample)
+    return lots, samples, edited
+
+
+class LotSampleStore:
+    def __init__(self, storage, cursors_path=CODES_FILE):
+        self.storage = storage
+        self.cursors_path = cursors_path
+        self.lots, self.samples = [], []
+        self.index, self.codes = LotSampleIndex(), CodeAllocator()
+
+    def load(self):
+        self.lots, self.samples = split_rows(self.storage.row_values())
+        self.index = LotSampleIndex(self.lots, self.samples)
+        from las_archive import ArchiveStore, archive_path  # las_archive builds on this module
+        self.codes = CodeAllocator(self.lots, self.samples, self.cursors_path, ArchiveStore(archive_path(self.storage)))
+
+    def apply_updates(self, new_rows, edits):
+        # Take over what Storage.updates() found other writers appended or edited
+        lots, samples, _ = merge_updates(self.index, new_rows, edits)
+        self.lots += lots
+        self.samples += samples
+        for lot in lots:
+            self.codes.add_lot(lot['Lot'])
+        for sample in samples:
+            self.codes.add_sample(sample['Lot'], sample['Serial'])
+
+    def create_lot(self, name):
+        lot = new_lot(name, self.codes)
+        self.lots.append(lot)
+        self.index.add_lot(lot)
+        return lot
+
+    def create_sample(self, lot_code, name):
+        if self.index.lot_by_code(lot_code) is None:
+            raise ValueError("Selected lot does not exist.")
+        sample = new_sample(lot_code, name, self.codes)
+        self.samples.append(sample)
+        self.index.add_sample(sample)
+        return sample
+
+    def edit_sample(self, full_code, notes=None, active=None):
+        """Change Notes and/or Active; return (sample, fields, expected) for Storage.update_sample."""
+        sample = self.index.sample_by_code(full_code)
+        if sample is None:
+            raise KeyError(full_code)
+        expected = {'Notes': sample['Notes'], 'Active': 'True' if is_active(sample) else 'False'}
+        if notes is not None:
+            sample['Notes'] = notes
+        if active is not None:
+            sample['Active'] = 'True' if active else 'False'
+        return sample, {'Notes': sample['Notes'], 'Active': 'True' if is_active(sample) else 'False'}, expected
+
+    def saved(self, sample, stored):
+        # Take over the fields as merged with a concurrent edit from another instance
+        for field, value in stored.items():
+            sample[field] = value
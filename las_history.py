@@ -0,0 +1,176 @@
+"""Version history of sample Notes.
+
+Every save of a sample's Notes appends the new text to the history file
+(``lots_and_samples.history`` next to the data file) as one JSON line
+(FullCode, time, notes, and where the sample's version table is), so earlier
+observations are never overwritten.
+
+``<history>.idx`` holds one table per sample of fixed-size
+(offset into the history, time) entries, one per version. A table starts
+with room for INITIAL_CAPACITY versions and, once full, is copied to the end
+of the file with twice the room. Reading version n of a sample is therefore
+one seek into the index and one into the history, however long the history
+grows. Memory holds only a [table, capacity, versions] entry per sample that
+has a history, never the text.
+
+The history itself is the source of truth: the index is repaired from it
+while reading records, and ``<history>.keys`` checkpoints the per-sample
+entries so a start only reads the records appended since. Writers in several
+processes take ``<history>.lock`` and first read what the others appended.
+"""
+import json
+import os
+import struct
+import time
+
+from las_lock import FileLock
+
+ENTRY = struct.Struct('<qq')  # Offset of the version's record in the history, save time (seconds since the epoch)
+INITIAL_CAPACITY = 4
+CHECKPOINT_BYTES = 1 << 20  # Rewrite the .keys checkpoint once this much history (plus 64 bytes a sample) is not covered
+
+
+class NotesHistory:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.keys_path = path + '.keys'
+        self.lock = FileLock(path + '.lock')
+        self.tables = None  # FullCode -> [table position in entries, capacity, versions]; None until first used
+        self.size = 0  # Bytes of the history reflected in `tables`
+        self.index_end = 0  # Entries allocated in the index
+        self.checkpointed = 0  # History size covered by the .keys checkpoint
+
+    def load(self):
+        # Under the lock: bring `tables` up to date with the history
+        if self.tables is None:
+            self.tables, self.size, self.index_end, self.checkpointed = {}, 0, 0, 0
+            try:
+                with open(self.keys_path) as f:
+                    checkpoint = json.load(f)
+                if checkpoint['size'] <= os.path.getsize(self.path) and os.path.exists(self.index_path):
+                    self.tables, self.size, self.index_end = checkpoint['tables'], checkpoint['size'], checkpoint['index_end']
+                    self.checkpointed = self.size
+            except (OSError, ValueError, KeyError):
+                pass
+        try:
+            history = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with history, self.open_index() as index:
+            history.seek(self.size)
+            for line in history:
+                offset = self.size
+                self.size += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Record torn by a crash mid-append
+                self.apply(record, offset, index)
+            self.checkpoint_if_due(index)
+
+    def open_index(self):
+        if not os.path.exists(self.index_path):
+            open(self.index_path, 'ab').close()
+        return open(self.index_path, 'r+b')
+
+    def apply(self, record, offset, index):
+        # Take a record into `tables` and make sure the index has its entry (and, after a move, the earlier ones)
+        key, table, capacity, version = record['key'], record['table'], record['capacity'], record['version']
+        known = self.tables.get(key)
+        if known and known[0] != table:
+            index.seek(known[0] * ENTRY.size)
+            earlier = index.read(version * ENTRY.size)
+            index.seek(table * ENTRY.size)
+            index.write(earlier)
+        index.seek((table + version) * ENTRY.size)
+        index.write(ENTRY.pack(offset, record['time']))
+        self.tables[key] = [table, capacity, version + 1]
+        self.index_end = max(self.index_end, table + capacity)
+
+    def checkpoint_if_due(self, index):
+        # Rewriting the checkpoint costs about 64 bytes a sample, so it is done less often the more samples there are
+        if self.size - self.checkpointed > CHECKPOINT_BYTES + 64 * len(self.tables):
+            index.flush()
+            os.fsync(index.fileno())  # The checkpoint must not cover index entries a crash could still lose
+            self.write_checkpoint()
+
+    def write_checkpoint(self):
+        tmp_path = f'{self.keys_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'size': self.size, 'index_end': self.index_end, 'tables': self.tables}, f)
+        os.replace(tmp_path, self.keys_path)
+        self.checkpointed = self.size
+
+    def append(self, key, notes, saved_at=None):
+        """Record `notes` as the newest version of `key`'s Notes."""
+        with self.lock:
+            self.load()
+            table, capacity, versions = self.tables.get(key) or (None, 0, 0)
+            if versions == capacity:
+                table, capacity = self.index_end, max(INITIAL_CAPACITY, capacity * 2)
+            record = {'key': key, 'time': int(time.time() if saved_at is None else saved_at), 'notes': notes,
+                      'version': versions, 'table': table, 'capacity': capacity}
+            # The leading newline terminates any record torn by a crash during the previous append
+            line = ('\n' + json.dumps(record) + '\n').encode('utf-8')
+            with open(self.path, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            offset = self.size + 1
+            self.size += len(line)
+            with self.open_index() as index:
+                self.apply(record, offset, index)
+                self.checkpoint_if_due(index)
+
+    def record(self, key, notes, previous=None):
+        """Append `notes` unless it is already the latest version.
+
+        `previous` is the text the edit started from; if the sample has no
+        history yet it is kept first (with time 0), so the note from before
+        the first tracked edit is not lost.
+        """
+        with self.lock:
+            self.load()
+            if key in self.tables:
+                if self.notes(key) == notes:
+                    return
+            elif previous and previous != notes:
+                self.append(key, previous, saved_at=0)
+            self.append(key, notes)
+
+    def versions(self, key):
+        """[(version, saved time)] of `key`'s Notes, oldest first; time 0 means from before the history began."""
+        with self.lock:
+            self.load()
+            entry = self.tables.get(key)
+            if not entry:
+                return []
+            table, _, count = entry
+            with open(self.index_path, 'rb') as index:
+                index.seek(table * ENTRY.size)
+                data = index.read(count * ENTRY.size)
+        return [(version, saved_at) for version, (_, saved_at) in enumerate(ENTRY.iter_unpack(data))]
+
+    def notes(self, key, version=-1):
+        """The Notes text of one version of `key` (negative counts from the newest). IndexError if there is none."""
+        with self.lock:
+            self.load()
+            table, _, count = self.tables.get(key) or (0, 0, 0)
+            if not count:
+                raise IndexError(f"{key} has no notes history")
+            if version < 0:
+                version += count
+            if not 0 <= version < count:
+                raise IndexError(f"{key} has no notes version {version}")
+            with open(self.index_path, 'rb') as index:
+                index.seek((table + version) * ENTRY.size)
+                offset, _ = ENTRY.unpack(index.read(ENTRY.size))
+            with open(self.path, 'rb') as history:
+                history.seek(offset)
+                return json.loads(history.readline())['notes']
+
+    def close(self):
+        self.lock.close()
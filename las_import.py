@@ -0,0 +1,123 @@
+"""Bulk import of samples (and the lots they belong to) from a CSV or JSON file.
+
+Every input row is a sample. Columns must be drawn from FIELDNAMES:
+
+* ``Name`` (required) - the sample name
+* ``Lot`` (required) - an existing lot code, an existing lot name, or the name
+  of a new lot, which is created with a freshly allocated code
+* ``Notes``, ``Active`` (``True``/``False``) and ``datetime`` (``YYYY-MM-DD
+  HH:MM:SS``) are optional
+* ``Serial`` and ``FullCode`` must be left empty; they are allocated here
+
+CSV files need a header row; JSON files hold a list of objects (or one object
+per line for ``.jsonl``). The whole file is validated before anything is
+written, and all new rows are then written with a single ``add_rows`` call.
+
+Run from the shell with ``python las_import.py <file>``.
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+from las_archive import ArchiveStore, archive_path
+from las_codes import CODES_FILE, CodeAllocator
+from las_core import split_rows
+from las_storage import FIELDNAMES, open_storage
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # As written by the apps; reports and filters compare it as text
+
+
+def read_import_file(path):
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as f:
+        if extension == '.json':
+            return json.load(f)
+        if extension == '.jsonl':
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def plan_import(rows, lots, codes):
+    """Validate `rows` and allocate codes; return (new_lots, new_samples) ready to write.
+
+    Raises ValueError listing every invalid row before any code is allocated.
+    """
+    lots_by_code = {lot['Lot']: lot for lot in lots}
+    lots_by_name = {}
+    for lot in lots:
+        lots_by_name.setdefault(lot['Name'], lot)
+    if not isinstance(rows, list):
+        raise ValueError("expected a list of rows")
+    errors = []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append(f"row {number}: expected an object with {', '.join(FIELDNAMES)}")
+            continue
+        unknown = set(row) - set(FIELDNAMES)
+        if unknown:
+            errors.append(f"row {number}: unknown columns {', '.join(sorted(map(str, unknown)))}")
+        if not str(row.get('Name') or '').strip():
+            errors.append(f"row {number}: Name is required")
+        if not str(row.get('Lot') or '').strip():
+            errors.append(f"row {number}: Lot is required")
+        if row.get('Serial') or row.get('FullCode'):
+            errors.append(f"row {number}: Serial and FullCode are assigned by the import")
+        if str(row.get('Active') or 'False') not in ('True', 'False'):
+            errors.append(f"row {number}: Active must be True or False")
+        if row.get('datetime'):
+            try:
+                datetime.strptime(str(row['datetime']), DATETIME_FORMAT)
+            except ValueError:
+                errors.append(f"row {number}: datetime must look like 2024-01-31 13:45:00")
+    if errors:
+        raise ValueError('\n'.join(errors))
+
+    now = datetime.now().strftime(DATETIME_FORMAT)
+    lot_keys = [str(row['Lot']).strip() for row in rows]
+    new_names = list(dict.fromkeys(key for key in lot_keys if key not in lots_by_code and key not in lots_by_name))
+    new_lots = [{'Lot': code, 'Name': name} for code, name in zip(codes.reserve_lot_codes(len(new_names)), new_names)]
+    for lot in new_lots:
+        lots_by_code[lot['Lot']] = lots_by_name[lot['Name']] = lot
+    row_lots = [lots_by_code.get(key) or lots_by_name[key] for key in lot_keys]
+    # One reservation per lot rather than per row, as each one is a transaction on the shared cursor table
+    full_codes = {code: iter(codes.reserve_serials(code, count)) for code, count in Counter(lot['Lot'] for lot in row_lots).items()}
+    new_samples = []
+    for row, lot in zip(rows, row_lots):
+        full_code = next(full_codes[lot['Lot']])
+        new_samples.append({
+            'datetime': row.get('datetime') or now,
+            'Lot': lot['Lot'],
+            'Serial': full_code[len(lot['Lot']):],
+            'FullCode': full_code,
+            'Name': str(row['Name']).strip(),
+            'Notes': str(row.get('Notes') or ''),
+            'Active': str(row.get('Active') or 'False'),
+        })
+    return new_lots, new_samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import samples from a CSV or JSON file")
+    parser.add_argument('file')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    storage = open_storage()
+    lots, samples = split_rows(storage.row_values())
+    try:
+        new_lots, new_samples = plan_import(read_import_file(args.file), lots, CodeAllocator(lots, samples, CODES_FILE, ArchiveStore(archive_path(storage))))
+    except (OSError, ValueError) as error:
+        parser.exit(1, f"Import failed, nothing was written:\n{error}\n")
+    storage.add_rows(new_lots + new_samples)
+    storage.close()
+    elapsed = time.perf_counter() - start
+    rows = len(new_lots) + len(new_samples)
+    print(f"Imported {len(new_lots)} lots and {len(new_samples)} samples in {elapsed:.2f} s ({rows / elapsed:.0f} rows/sec)")
+
+
+if __name__ == '__main__':
+    main()
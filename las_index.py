@@ -0,0 +1,59 @@
+"""In-memory hash indexes over the lots and samples held by LotSampleApp.
+
+The app keeps its rows in plain lists (``self.lots`` / ``self.samples``); this
+module keeps dictionaries next to those lists so lookups by FullCode, lot code,
+lot Name and (lot code, sample Name) are O(1) instead of a scan per click.
+
+The indexes hold references to the same row dicts as the lists, so in-place
+edits of non-key fields (Notes, Active) are visible without any re-indexing.
+When a key appears more than once the first row wins, matching the
+``next(...)`` scans this replaces.
+"""
+
+
+class LotSampleIndex:
+    def __init__(self, lots=(), samples=()):
+        self.rebuild(lots, samples)
+
+    def rebuild(self, lots, samples):
+        self.lots_by_code = {}
+        self.lots_by_name = {}
+        self.samples_by_code = {}
+        self.samples_by_lot_and_name = {}
+        self.samples_by_lot = {}
+        for lot in lots:
+            self.add_lot(lot)
+        for sample in samples:
+            self.add_sample(sample)
+
+    def add_lot(self, lot):
+        self.lots_by_code.setdefault(lot['Lot'], lot)
+        self.lots_by_name.setdefault(lot['Name'], lot)
+
+    def add_sample(self, sample):
+        self.samples_by_code.setdefault(sample['FullCode'], sample)
+        self.samples_by_lot_and_name.setdefault((sample['Lot'], sample['Name']), sample)
+        self.samples_by_lot.setdefault(sample['Lot'], []).append(sample)
+
+    def lot_by_code(self, lot_code):
+        return self.lots_by_code.get(lot_code)
+
+    def lot_by_name(self, lot_name):
+        return self.lots_by_name.get(lot_name)
+
+    def lot_name(self, lot_code):
+        lot = self.lots_by_code.get(lot_code)
+        return lot['Name'] if lot else None
+
+    def lot_code(self, lot_name):
+        lot = self.lots_by_name.get(lot_name)
+        return lot['Lot'] if lot else None
+
+    def sample_by_code(self, full_code):
+        return self.samples_by_code.get(full_code)
+
+    def sample_in_lot(self, lot_code, sample_name):
+        return self.samples_by_lot_and_name.get((lot_code, sample_name))
+
+    def samples_in_lot(self, lot_code):
+        return self.samples_by_lot.get(lot_code, [])
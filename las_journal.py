@@ -0,0 +1,163 @@
+"""Append-only journal of per-row edits, replayed over a CSV snapshot on load.
+
+Saving a note used to rewrite the whole CSV. With a journal, an edit is one
+JSON line appended (and fsynced) to ``<snapshot>.journal``; loading replays the
+journal over the snapshot. Once enough edits pile up, compaction folds them
+into a fresh snapshot in a background thread and swaps it in with an atomic
+``os.replace``, so a crash at any point leaves either the old snapshot plus
+journal or the new snapshot - never a truncated file.
+
+Replaying an edit is idempotent (it just sets fields), which is what makes the
+rotate -> rewrite -> replace -> delete sequence in ``compact`` safe to
+interrupt anywhere.
+
+Pass a las_lock.FileLock as ``lock`` when other processes write the same files.
+Only one process compacts at a time: the others skip compaction while
+``<journal>.compact.lock`` is held.
+"""
+import csv
+import json
+import os
+import threading
+
+from las_lock import FileLock
+
+
+def lines_upto(f, limit):
+    # Yield decoded lines from a binary file until `limit` bytes have been consumed
+    consumed = 0
+    while consumed < limit:
+        line = f.readline(limit - consumed)
+        if not line:
+            break
+        consumed += len(line)
+        yield line.decode('utf-8')
+
+
+class EditJournal:
+    def __init__(self, path, compact_after=500, fsync=True, lock=None):
+        self.path = path
+        self.compacting_path = path + '.compacting'
+        self.compact_after = compact_after
+        self.fsync = fsync
+        self.records = 0  # Edits in the journal since the last compaction
+        # Held for every append (to the journal or to the snapshot) and for the final swap in compact()
+        self.lock = lock or threading.Lock()
+        self.compactor = None
+        self.compaction_lock = FileLock(path + '.compact.lock')
+
+    def append(self, key, fields):
+        self.append_many([(key, fields)])
+
+    def append_many(self, edits):
+        # One write and one fsync for a batch of (key, fields) edits.
+        # The leading newline terminates any record torn by a crash during the previous append
+        lines = ''.join('\n' + json.dumps({'key': key, 'fields': fields}) + '\n' for key, fields in edits)
+        if not lines:
+            return
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self.records += len(edits)
+
+    def edits(self):
+        """Yield (key, fields) pairs oldest first, including a journal left mid-compaction."""
+        for path in (self.compacting_path, self.path):
+            try:
+                f = open(path, encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Record torn by a crash mid-append
+                    key = record['key']
+                    yield (tuple(key) if isinstance(key, list) else key), record['fields']
+
+    def latest_edits(self):
+        """Fold the journal into {key: fields}, later edits overriding earlier ones."""
+        latest = {}
+        count = 0
+        for key, fields in self.edits():
+            latest.setdefault(key, {}).update(fields)
+            count += 1
+        self.records = count
+        return latest
+
+    def should_compact(self):
+        return self.records >= self.compact_after and not self.compacting()
+
+    def compacting(self):
+        return self.compactor is not None and self.compactor.is_alive()
+
+    def compact(self, snapshot_path, key_of, apply_edit, fieldnames=None, on_replace=None):
+        """Rewrite `snapshot_path` with the journal folded in, then drop the folded journal.
+
+        Rows are dicts when `fieldnames` is given (the snapshot has a header),
+        lists otherwise. Rows appended to the snapshot while the rewrite runs
+        are copied over verbatim before the swap. `on_replace(old_stat)` is
+        called with the lock still held right after the swap.
+        """
+        if not self.compaction_lock.acquire(blocking=False):
+            return  # Another process is compacting
+        try:
+            self.fold(snapshot_path, key_of, apply_edit, fieldnames, on_replace)
+        finally:
+            self.compaction_lock.release()
+
+    def fold(self, snapshot_path, key_of, apply_edit, fieldnames, on_replace):
+        with self.lock:
+            if os.path.exists(self.path) and not os.path.exists(self.compacting_path):
+                os.replace(self.path, self.compacting_path)
+            self.records = 0
+            size = os.path.getsize(snapshot_path)
+        edits = {}
+        for key, fields in self.edits():
+            edits.setdefault(key, {}).update(fields)
+
+        tmp_path = snapshot_path + '.tmp'
+        with open(snapshot_path, 'rb') as src, open(tmp_path, 'w', newline='', encoding='utf-8') as dst:
+            rows = lines_upto(src, size)
+            if fieldnames:
+                reader, writer = csv.DictReader(rows), csv.DictWriter(dst, fieldnames=fieldnames)
+                writer.writeheader()
+            else:
+                reader, writer = csv.reader(rows), csv.writer(dst)
+            for row in reader:
+                fields = edits.get(key_of(row))
+                if fields:
+                    apply_edit(row, fields)
+                writer.writerow(row)
+        with self.lock:
+            with open(snapshot_path, 'rb') as src, open(tmp_path, 'a', newline='', encoding='utf-8') as dst:
+                src.seek(size)
+                dst.write(src.read().decode('utf-8'))  # Rows appended since the rewrite started
+                dst.flush()
+                os.fsync(dst.fileno())
+            old_stat = os.stat(snapshot_path)
+            os.replace(tmp_path, snapshot_path)
+            if on_replace:
+                on_replace(old_stat)
+        try:
+            os.remove(self.compacting_path)
+        except FileNotFoundError:
+            pass
+
+    def compact_in_background(self, snapshot_path, key_of, apply_edit, fieldnames=None, on_done=None, on_replace=None):
+        if self.compacting():
+            return
+
+        def run():
+            self.compact(snapshot_path, key_of, apply_edit, fieldnames, on_replace)
+            if on_done:
+                on_done()
+
+        self.compactor = threading.Thread(target=run, daemon=True)
+        self.compactor.start()
@@ -0,0 +1,222 @@
+"""Printable label sheets (QR code + Code 128 + code and name) for samples.
+
+Examples::
+
+    python las_labels.py --lot 12345678 --output labels/       # every sample of a lot
+    python las_labels.py --lot "Batch 7"
+    python las_labels.py --codes codes.txt                      # one FullCode per line
+
+Labels are drawn as vector graphics and written as A4 SVG sheets of
+COLUMNS x ROWS labels (``labels-001.svg``, ...), which any browser prints at
+scale; no imaging library or network access is needed. Barcodes come from
+las_barcodes.
+
+Drawing the barcodes is the slow part, so the drawing of each code (it never
+changes) is kept in a SQLite cache next to the data file
+(``<data file>.labels``): printing a lot again only reads it back. Codes not
+yet in the cache are drawn in a pool of worker processes when there are
+enough of them and more than one CPU.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from html import escape
+
+from las_barcodes import code128, qr_matrix
+from las_query import RowFilter, open_data
+
+# A4 sheet of 3 x 8 labels of 70 x 37 mm; lengths in mm
+PAGE_WIDTH, PAGE_HEIGHT = 210, 297
+COLUMNS, ROWS = 3, 8
+LABEL_WIDTH, LABEL_HEIGHT = 70, 37
+QR_X, QR_Y, QR_SIZE = 4, 4, 22  # The label edge and gaps give the QR code its quiet zone
+BAR_X, BAR_Y, BAR_WIDTH, BAR_HEIGHT = 30, 4, 36, 13
+BAR_MODULE = 0.35  # Narrowest bar; narrower when the code is long
+NAME_LENGTH = 40  # Longer names are cut short to fit the label
+CACHE_VERSION = 1  # Bump when the drawing changes, so cached drawings are not reused
+PARALLEL_MIN = 256  # Fewer codes than this to draw are drawn in this process
+CHUNK = 64
+
+
+def cache_path(storage):
+    return storage.path + '.labels'
+
+
+def qr_path(text):
+    matrix = qr_matrix(text)
+    module = QR_SIZE / len(matrix)
+    parts = []
+    for row, darks in enumerate(matrix):
+        # Each run of dark modules along a row is drawn as one line, a module thick
+        y = QR_Y + (row + 0.5) * module
+        start = None
+        for col, dark in enumerate(darks + [False]):
+            if dark and start is None:
+                start = col
+            elif not dark and start is not None:
+                parts.append(f'M{QR_X + start * module:.3f} {y:.3f}h{(col - start) * module:.3f}')
+                start = None
+    return f'<path d="{"".join(parts)}" stroke="#000" stroke-width="{module:.3f}"/>'
+
+
+def bar_path(text):
+    widths = code128(text)
+    module = min(BAR_MODULE, BAR_WIDTH / sum(widths))
+    bars, position = [], 0
+    for index, width in enumerate(widths):
+        if index % 2 == 0:
+            bars.append(f'M{BAR_X + position * module:.3f} {BAR_Y}h{width * module:.3f}v{BAR_HEIGHT}h-{width * module:.3f}z')
+        position += width
+    return f'<path d="{"".join(bars)}"/>'
+
+
+def symbol_svg(code):
+    """The SVG drawing of `code`'s barcodes and text, in mm from the label's top left corner."""
+    return (qr_path(code) + bar_path(code)
+            + f'<text x="{BAR_X + BAR_WIDTH / 2}" y="{BAR_Y + BAR_HEIGHT + 4.5}" font-size="4" font-family="monospace" '
+              f'text-anchor="middle">{escape(code)}</text>')
+
+
+def symbol_batch(codes):
+    return [(code, symbol_svg(code)) for code in codes]
+
+
+class SymbolCache:
+    """Drawings of codes, kept in a SQLite file."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS symbols (code TEXT PRIMARY KEY, svg TEXT NOT NULL)')
+
+    def get(self, codes):
+        found = {}
+        codes = [f'{CACHE_VERSION}:{code}' for code in codes]
+        for start in range(0, len(codes), 500):  # Stay under SQLite's limit on query parameters
+            chunk = codes[start:start + 500]
+            query = f"SELECT code, svg FROM symbols WHERE code IN ({','.join('?' * len(chunk))})"
+            found.update((key.split(':', 1)[1], svg) for key, svg in self.connection.execute(query, chunk))
+        return found
+
+    def put(self, drawings):
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO symbols VALUES (?, ?)',
+                                        ((f'{CACHE_VERSION}:{code}', svg) for code, svg in drawings))
+
+    def close(self):
+        self.connection.close()
+
+
+def draw_symbols(codes, cache=None, processes=None):
+    """{code: drawing} for `codes`, from `cache` (a SymbolCache) where possible; new drawings are added to it."""
+    codes = list(dict.fromkeys(codes))
+    found = cache.get(codes) if cache is not None else {}
+    missing = [code for code in codes if code not in found]
+    processes = processes or os.cpu_count() or 1
+    if processes > 1 and len(missing) >= PARALLEL_MIN:
+        chunks = [missing[start:start + CHUNK] for start in range(0, len(missing), CHUNK)]
+        # Spawned, not forked: the caller may be the Tk app, with threads running
+        with multiprocessing.get_context('spawn').Pool(min(processes, len(chunks))) as pool:
+            drawn = [pair for batch in pool.imap_unordered(symbol_batch, chunks) for pair in batch]
+    else:
+        drawn = symbol_batch(missing)
+    if cache is not None and drawn:
+        cache.put(drawn)
+    found.update(drawn)
+    return found
+
+
+def sheet_svg(labels, drawings):
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{PAGE_WIDTH}mm" height="{PAGE_HEIGHT}mm" '
+             f'viewBox="0 0 {PAGE_WIDTH} {PAGE_HEIGHT}">']
+    top = (PAGE_HEIGHT - ROWS * LABEL_HEIGHT) / 2
+    for position, (code, name) in enumerate(labels):
+        x = (position % COLUMNS) * LABEL_WIDTH
+        y = top + (position // COLUMNS) * LABEL_HEIGHT
+        if len(name) > NAME_LENGTH:
+            name = name[:NAME_LENGTH - 1] + '…'
+        parts.append(f'<g transform="translate({x} {y:.1f})">{drawings[code]}'
+                     f'<text x="{LABEL_WIDTH / 2}" y="{LABEL_HEIGHT - 4}" font-size="3.5" font-family="sans-serif" '
+                     f'text-anchor="middle">{escape(name)}</text></g>')
+    parts.append('</svg>\n')
+    return ''.join(parts)
+
+
+def write_sheets(labels, directory, cache=None, processes=None):
+    """Write `labels`, (FullCode, name) pairs, as SVG sheets in `directory`; return the sheet paths."""
+    labels = list(labels)
+    drawings = draw_symbols([code for code, _ in labels], cache, processes)
+    os.makedirs(directory, exist_ok=True)
+    per_sheet = COLUMNS * ROWS
+    paths = []
+    for start in range(0, len(labels), per_sheet):
+        path = os.path.join(directory, f'labels-{start // per_sheet + 1:03d}.svg')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(sheet_svg(labels[start:start + per_sheet], drawings))
+        paths.append(path)
+    return paths
+
+
+def lot_labels(storage, lot):
+    """(FullCode, name) of the samples of the lot with code or name `lot`, and whether that lot exists."""
+    matches = RowFilter('samples', lot)
+    labels = [(values[3], values[4]) for values in storage.row_values(streaming=True) if matches(values)]
+    return labels, matches.lot_seen
+
+
+def code_labels(storage, codes):
+    """(FullCode, name) for each of `codes`, in order; the name is empty for codes not in the data."""
+    wanted = set(codes)
+    names = {values[3]: values[4] for values in storage.row_values(streaming=True) if values[3] in wanted}
+    return [(code, names.get(code, '')) for code in codes]
+
+
+def print_labels(storage, labels, directory, processes=None):
+    """Write sheets for `labels` using `storage`'s drawing cache; return (sheet paths, seconds taken)."""
+    start = time.perf_counter()
+    cache = SymbolCache(cache_path(storage))
+    try:
+        paths = write_sheets(labels, directory, cache, processes)
+    finally:
+        cache.close()
+    return paths, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write printable barcode label sheets (SVG) for samples")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--lot', help="lot code or name: label all its samples")
+    source.add_argument('--codes', metavar='FILE', help="file with one FullCode per line ('-' for stdin)")
+    parser.add_argument('--data', metavar='FILE', help="data file (default: the one the apps use)")
+    parser.add_argument('--output', metavar='DIR', default='labels', help="directory for the sheets (default: labels)")
+    parser.add_argument('--processes', type=int, help="worker processes for drawing (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    try:
+        storage = open_data(args.data)
+    except FileNotFoundError as error:
+        parser.exit(1, f"{error}\n")
+    try:
+        if args.lot:
+            labels, found = lot_labels(storage, args.lot)
+            if not found:
+                parser.exit(1, f"No lot with code or name {args.lot!r}.\n")
+        else:
+            with (sys.stdin if args.codes == '-' else open(args.codes, encoding='utf-8')) as f:
+                codes = [line.strip() for line in f if line.strip()]
+            labels = code_labels(storage, codes)
+        if not labels:
+            parser.exit(1, "Nothing to label.\n")
+        try:
+            paths, elapsed = print_labels(storage, labels, args.output, args.processes)
+        except ValueError as error:  # A code the encoders cannot take
+            parser.exit(1, f"{error}\n")
+    finally:
+        storage.close()
+    print(f"Wrote {len(labels)} labels on {len(paths)} sheets to {args.output} in {elapsed:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
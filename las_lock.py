@@ -0,0 +1,98 @@
+"""Exclusive lock shared by every thread and process that opens the same data file.
+
+Several LaS instances may run against one data file on a shared disk. Each
+append, journal record and snapshot swap is done while holding a
+``FileLock`` on ``<data file>.lock``: an OS-level lock (``fcntl.flock``, or
+``msvcrt.locking`` on Windows) keeps other processes out, and a re-entrant
+thread lock keeps the other threads of this process out, so code that already
+holds the lock may take it again.
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def lock_file(f, blocking=True):
+    """Lock `f` against other processes; without `blocking`, return False if another holds it."""
+    if fcntl:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)  # LK_LOCK gives up after about 10 seconds
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.01)
+
+
+def unlock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0  # How many times the owning thread has entered
+        self.file = None
+
+    def acquire(self, blocking=True):
+        if not self.thread_lock.acquire(blocking):
+            return False
+        if self.depth == 0:
+            try:
+                if self.file is None:
+                    self.file = open(self.path, 'a+b')
+                locked = lock_file(self.file, blocking)
+            except BaseException:
+                self.thread_lock.release()
+                raise
+            if not locked:
+                self.thread_lock.release()
+                return False
+        self.depth += 1
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            unlock_file(self.file)
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def close(self):
+        with self.thread_lock:
+            if self.file is not None and self.depth == 0:
+                self.file.close()
+                self.file = None
+
+
+def same_file(stat, path):
+    # False once `path` has been replaced (e.g. by a compaction in another process) since `stat` was taken
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return (current.st_dev, current.st_ino) == (stat.st_dev, stat.st_ino)
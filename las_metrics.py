@@ -0,0 +1,179 @@
+"""Opt-in timing of storage, lookup and UI operations.
+
+Set the environment variable ``LAS_METRICS`` to turn it on: ``1`` to collect,
+or a file name (``metrics.json`` / ``metrics.csv``) to also write the numbers
+there every DUMP_SECONDS. LaS3 then shows a Performance button that opens a
+live table, and las_server dumps to the file.
+
+When it is off nothing is wrapped, so the operations run exactly as without
+this module. When it is on, ``wrap`` replaces methods of one object (or
+class) with timed versions that record, per operation, the call count and
+power-of-two histograms of latency and of rows touched (by default the
+length of the list of rows passed in or returned, or the rows a generator
+yielded).
+"""
+import csv
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+DUMP_SECONDS = 60
+SETTING = os.environ.get('LAS_METRICS', '')
+ENABLED = SETTING not in ('', '0')
+DUMP_PATH = SETTING if ENABLED and SETTING != '1' else None
+
+
+def bucket(value):
+    # Histogram bucket: 0 for value < 1, else n for 2**(n-1) <= value < 2**n
+    return int(value).bit_length()
+
+
+def bucket_bound(index):
+    return float(2 ** index)
+
+
+def percentile(histogram, count, fraction):
+    # Upper bound of the bucket holding the given fraction of the samples
+    threshold, seen = fraction * count, 0
+    for index in sorted(histogram):
+        seen += histogram[index]
+        if seen >= threshold:
+            return bucket_bound(index)
+    return 0.0
+
+
+class Stat:
+    __slots__ = ('count', 'total', 'max', 'rows', 'latency', 'row_counts')
+
+    def __init__(self):
+        self.count, self.total, self.max, self.rows = 0, 0.0, 0.0, 0
+        self.latency = {}  # bucket of microseconds -> calls
+        self.row_counts = {}  # bucket of rows touched -> calls
+
+    def add(self, elapsed, rows):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        micros = bucket(elapsed * 1e6)
+        self.latency[micros] = self.latency.get(micros, 0) + 1
+        if rows is not None:
+            self.rows += rows
+            key = bucket(rows)
+            self.row_counts[key] = self.row_counts.get(key, 0) + 1
+
+    def summary(self):
+        return {
+            'calls': self.count,
+            'rows': self.rows,
+            'total_ms': self.total * 1e3,
+            'mean_ms': self.total / self.count * 1e3 if self.count else 0.0,
+            'p50_ms': percentile(self.latency, self.count, 0.5) / 1e3,
+            'p95_ms': percentile(self.latency, self.count, 0.95) / 1e3,
+            'max_ms': self.max * 1e3,
+            'latency_us_histogram': {f"<{bucket_bound(index):.0f}": calls for index, calls in sorted(self.latency.items())},
+            'rows_histogram': {f"<{bucket_bound(index):.0f}": calls for index, calls in sorted(self.row_counts.items())},
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()  # Operations are recorded from the Tk thread and the storage worker
+
+    def record(self, name, elapsed, rows=None):
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = Stat()
+            stat.add(elapsed, rows)
+
+    def snapshot(self):
+        with self.lock:
+            return {name: stat.summary() for name, stat in sorted(self.stats.items())}
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def dump(self, path):
+        """Write the current numbers to `path`, as CSV if it ends in .csv and JSON otherwise."""
+        snapshot = self.snapshot()
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', newline='') as f:
+            if path.endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(['time', 'operation', 'calls', 'rows', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'])
+                now = time.strftime('%Y-%m-%dT%H:%M:%S')
+                for name, summary in snapshot.items():
+                    writer.writerow([now, name] + [summary[key] for key in ('calls', 'rows', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms')])
+            else:
+                json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'operations': snapshot}, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+def list_rows(args, result):
+    # Default count of rows touched: the first list passed in, else a list returned
+    return next((len(arg) for arg in args if isinstance(arg, list)), len(result) if isinstance(result, list) else None)
+
+
+def timed_generator(name, generator):
+    start, rows = time.perf_counter(), 0
+    try:
+        for rows, item in enumerate(generator, 1):
+            yield item
+    finally:
+        metrics.record(name, time.perf_counter() - start, rows)  # Time until the caller stopped reading
+
+
+def timed(name, func, count_rows=list_rows):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start, result = time.perf_counter(), None
+            try:
+                result = await func(*args, **kwargs)
+                return result
+            finally:
+                metrics.record(name, time.perf_counter() - start, count_rows(args, result))
+        return wrapper
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return timed_generator(name, func(*args, **kwargs))
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start, result = time.perf_counter(), None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            metrics.record(name, time.perf_counter() - start, count_rows(args, result))
+    return wrapper
+
+
+def wrap(target, names, rows=None):
+    """Time the given methods of `target`, an instance or a class, if metrics are enabled.
+
+    `rows` maps a method name to a function (args, result) -> rows touched,
+    for methods where that is not simply the length of a list argument.
+    """
+    if not ENABLED:
+        return
+    prefix = target.__name__ if isinstance(target, type) else type(target).__name__
+    rows = rows or {}
+    for name in names:
+        setattr(target, name, timed(f'{prefix}.{name}', getattr(target, name), rows.get(name, list_rows)))
+
+
+def wrap_storage(storage):
+    wrap(storage, ['row_values', 'lots', 'add_rows', 'update_sample', 'update_samples', 'changed', 'updates'],
+         rows={'update_sample': lambda args, result: 1, 'update_samples': lambda args, result: len(args[0])})
@@ -0,0 +1,122 @@
+"""Type-ahead picker for large lists of lot and sample names.
+
+``PrefixIndex`` keeps the names sorted case-insensitively, so the names
+starting with a typed prefix are one contiguous range found with two
+bisections. ``SearchablePicker`` is an Entry above a Treeview that owns only
+``height`` rows: scrolling and typing relabel those rows from the current
+range, so the cost of a keystroke or a scroll step does not depend on how many
+names there are.
+"""
+import bisect
+import tkinter as tk
+from tkinter import ttk
+
+
+class PrefixIndex:
+    def __init__(self, names=()):
+        self.entries = sorted({(name.casefold(), name) for name in names})
+
+    def add(self, name):
+        entry = (name.casefold(), name)
+        position = bisect.bisect_left(self.entries, entry)
+        if position == len(self.entries) or self.entries[position] != entry:
+            self.entries.insert(position, entry)
+
+    def range(self, prefix):
+        """(start, stop) positions of the names starting with `prefix`, ignoring case."""
+        key = prefix.casefold()
+        start = bisect.bisect_left(self.entries, (key,))
+        stop = bisect.bisect_left(self.entries, (key + '\U0010ffff',), start)
+        return start, stop
+
+    def __getitem__(self, position):
+        return self.entries[position][1]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SearchablePicker(ttk.Frame):
+    def __init__(self, master, variable, on_select=None, height=6, width=60):
+        super().__init__(master)
+        self.variable, self.on_select, self.height = variable, on_select, height
+        self.index, self.start, self.stop, self.offset = PrefixIndex(), 0, 0, 0
+        self.typed_choice = None  # Entry text last passed to on_select by typing it out
+
+        self.entry = ttk.Entry(self, textvariable=variable, width=width)
+        self.entry.grid(row=0, column=0, columnspan=2, sticky="ew")
+        self.tree = ttk.Treeview(self, show='tree', height=height, selectmode='browse')
+        self.tree.grid(row=1, column=0, sticky="ew")
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.scroll)
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+        self.grid_columnconfigure(0, weight=1)
+        for row in range(height):
+            self.tree.insert('', 'end', iid=str(row))  # The only rows that ever exist
+
+        self.entry.bind('<KeyRelease>', lambda e: self.typed())
+        self.entry.bind('<Down>', lambda e: self.tree.focus_set())
+        self.tree.bind('<<TreeviewSelect>>', lambda e: self.choose())
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll('scroll', -1 if e.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda e: self.scroll('scroll', -1, 'units'))
+        self.tree.bind('<Button-5>', lambda e: self.scroll('scroll', 1, 'units'))
+
+    def set_index(self, index):
+        self.index = index
+        self.filter()
+
+    def set(self, value):
+        self.variable.set(value)
+        self.filter()
+
+    def get(self):
+        return self.variable.get()
+
+    def typed(self):
+        self.filter()
+        # Typing a name out in full counts as choosing it; only once per change, not on every key release
+        text = self.variable.get()
+        if text == self.typed_choice:
+            return
+        self.typed_choice = None
+        start, stop = self.index.range(text)
+        for position in range(start, stop):  # Names equal but for case come first
+            name = self.index[position]
+            if name.casefold() != text.casefold():
+                break
+            if name == text and self.on_select:
+                self.typed_choice = text
+                self.on_select(text)
+                break
+
+    def filter(self):
+        self.start, self.stop = self.index.range(self.variable.get())
+        if self.stop - self.start == 1 and self.index[self.start] == self.variable.get():
+            self.start, self.stop = self.index.range('')  # An exact choice shows the full list again
+        self.offset = 0
+        self.render()
+
+    def render(self):
+        for row in range(self.height):
+            position = self.start + self.offset + row
+            self.tree.item(str(row), text=self.index[position] if position < self.stop else '')
+        total = max(self.stop - self.start, 1)
+        self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.height) / total))
+
+    def scroll(self, action, amount, unit=None):
+        last = max(self.stop - self.start - self.height, 0)
+        if action == 'moveto':
+            self.offset = round(float(amount) * (self.stop - self.start))
+        else:
+            self.offset += int(amount) * (self.height if unit == 'pages' else 1)
+        self.offset = min(max(self.offset, 0), last)
+        self.render()
+
+    def choose(self):
+        selection = self.tree.selection()
+        name = self.tree.item(selection[0], 'text') if selection else ''
+        if not name:
+            return
+        self.variable.set(name)
+        self.tree.selection_remove(selection)
+        if self.on_select:
+            self.on_select(name)
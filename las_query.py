@@ -0,0 +1,164 @@
+"""Query and export lots and samples from the shell, without starting Tk.
+
+Examples::
+
+    python las_query.py --lot 12345678 --active            # active samples in a lot, as CSV
+    python las_query.py --lot "Batch 7" --fields FullCode Name --format jsonl
+    python las_query.py --since 7d --count                  # samples created in the last week
+    python las_query.py --kind lots --output lots.csv
+
+Rows are read straight from the data file (CSV or SQLite, as the apps pick
+it) with ``row_values(streaming=True)``, filtered and written one at a time,
+so memory use does not grow with the size of the file. Filters combine with
+AND. ``--lot`` takes a lot code or a lot name.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+from las_shards import ShardedStorage
+from las_storage import CSV_FILE, DB_FILE, FIELDNAMES, CsvStorage, SqliteStorage, open_storage
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # As written by las_core.timestamp(); compares correctly as text
+RELATIVE = re.compile(r'(\d+)([dhw])')
+
+
+def parse_time(text):
+    """A datetime string comparable with the datetime column: '7d' / '12h' / '2w' ago, or a date (and time)."""
+    match = RELATIVE.fullmatch(text.strip())
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        delta = {'d': timedelta(days=amount), 'h': timedelta(hours=amount), 'w': timedelta(weeks=amount)}[unit]
+        return (datetime.now() - delta).strftime(DATETIME_FORMAT)
+    for pattern in (DATETIME_FORMAT, '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text.strip(), pattern).strftime(DATETIME_FORMAT)
+        except ValueError:
+            pass
+    raise ValueError(f"Cannot read {text!r} as a time; use YYYY-MM-DD[ HH:MM[:SS]] or e.g. 7d, 12h, 2w.")
+
+
+class RowFilter:
+    """Predicate over row_values() rows; conditions given as None are not checked.
+
+    `lot` is a lot code or name. Names are resolved while streaming: a lot's
+    row always comes before its samples, so its code is known by the time
+    they are checked.
+    """
+
+    def __init__(self, kind='samples', lot=None, active=None, since=None, until=None, contains=None):
+        self.kind, self.lot, self.active, self.since, self.until = kind, lot, active, since, until
+        self.needle = contains.casefold() if contains else None
+        self.lot_codes = {lot}  # Grows by the codes of lots named `lot`
+        self.lot_seen = False
+
+    def __call__(self, values):
+        datetime_, lot, serial, _, name, notes, active = values  # FIELDNAMES order
+        if self.lot is not None:
+            if not serial and lot and (lot == self.lot or name == self.lot):
+                self.lot_codes.add(lot)
+                self.lot_seen = True
+            if lot not in self.lot_codes:
+                return False
+        if (self.kind == 'samples' and not serial) or (self.kind == 'lots' and (serial or not lot)):
+            return False
+        if self.active is not None and (active == 'True') != self.active:
+            return False
+        if self.since is not None and (datetime_ or '') < self.since:
+            return False
+        if self.until is not None and (datetime_ or '') >= self.until:
+            return False
+        if self.needle is not None and self.needle not in (name or '').casefold() and self.needle not in (notes or '').casefold():
+            return False
+        return True
+
+
+def export(rows, fields, out, fmt='csv'):
+    """Write the `fields` of each row_values() row to `out` as CSV or JSON Lines; return how many were written."""
+    positions = [FIELDNAMES.index(field) for field in fields]
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(fields)
+        for count, values in enumerate(rows, 1):
+            writer.writerow([values[position] for position in positions])
+    else:
+        for count, values in enumerate(rows, 1):
+            record = {field: values[position] for field, position in zip(fields, positions)}
+            if 'Active' in record and values[FIELDNAMES.index('Serial')]:
+                record['Active'] = record['Active'] == 'True'  # As the HTTP server reports it
+            out.write(json.dumps(record) + '\n')
+    return count
+
+
+def open_data(path, create=False):
+    """Storage for `path`, or the one the apps use when it is None.
+
+    A `path` that does not exist is only created when `create` is set, so a
+    mistyped --data is reported instead of read as an empty data file.
+    """
+    if path is None:
+        return open_storage()
+    if not create and not os.path.exists(path):
+        raise FileNotFoundError(f"No data file or shard directory at {path}.")
+    if os.path.isdir(path):
+        return ShardedStorage(path)
+    return SqliteStorage(path) if path.endswith('.db') else CsvStorage(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Filter lots and samples and export them as CSV or JSON Lines")
+    parser.add_argument('--data', metavar='FILE', help=f"data file or shard directory (default: {DB_FILE} if it exists, else {CSV_FILE})")
+    parser.add_argument('--kind', choices=['samples', 'lots', 'all'], default='samples')
+    parser.add_argument('--lot', help="lot code or name")
+    state = parser.add_mutually_exclusive_group()
+    state.add_argument('--active', dest='active', action='store_const', const=True)
+    state.add_argument('--inactive', dest='active', action='store_const', const=False)
+    parser.add_argument('--since', help="created at or after: a date/time, or e.g. 7d, 12h, 2w ago")
+    parser.add_argument('--until', help="created before: a date/time, or e.g. 7d ago")
+    parser.add_argument('--contains', metavar='TEXT', help="Name or Notes contains TEXT (ignoring case)")
+    parser.add_argument('--fields', nargs='+', choices=FIELDNAMES, default=FIELDNAMES, metavar='FIELD',
+                        help=f"columns to output, from {', '.join(FIELDNAMES)}")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--output', metavar='FILE', help="write here instead of stdout")
+    parser.add_argument('--limit', type=int, help="stop after this many rows")
+    parser.add_argument('--count', action='store_true', help="only print how many rows match")
+    args = parser.parse_args(argv)
+
+    try:
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until) if args.until else None
+    except ValueError as error:
+        parser.exit(1, f"{error}\n")
+    try:
+        storage = open_data(args.data)
+    except FileNotFoundError as error:
+        parser.exit(1, f"{error}\n")
+    matches = RowFilter(args.kind, args.lot, args.active, since, until, args.contains)
+    rows = (values for values in storage.row_values(streaming=True) if matches(values))
+    if args.limit is not None:
+        rows = (values for _, values in zip(range(args.limit), rows))
+    try:
+        if args.count:
+            print(sum(1 for _ in rows))
+        elif args.output:
+            with open(args.output, 'w', newline='', encoding='utf-8') as out:
+                count = export(rows, args.fields, out, args.format)
+            print(f"Wrote {count} rows to {args.output}", file=sys.stderr)
+        else:
+            export(rows, args.fields, sys.stdout, args.format)
+    except BrokenPipeError:  # Output piped into e.g. head
+        pass
+    finally:
+        rows.close()
+        storage.close()
+    if args.lot and not matches.lot_seen:
+        print(f"No lot with code or name {args.lot!r}.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Compact in-memory representation of a sample row.
+
+A ``csv.DictReader`` row is a full dict per sample. ``Sample`` keeps the same
+seven FIELDNAMES in ``__slots__`` instead, and interns the lot code and
+timestamp, which repeat across many samples. It still supports
+``sample['Notes']``-style access, ``get`` and ``keys``, so the index, the
+storage backends and ``csv.DictWriter`` accept it wherever a row dict was used.
+"""
+import sys
+
+from las_storage import FIELDNAMES
+
+FIELD_KEYS = dict.fromkeys(FIELDNAMES).keys()  # Ordered and set-like, as csv.DictWriter expects from keys()
+
+
+class Sample:
+    __slots__ = tuple(FIELDNAMES)
+
+    def __init__(self, datetime='', Lot='', Serial='', FullCode='', Name='', Notes='', Active=False):
+        self.datetime = sys.intern(datetime)
+        self.Lot = sys.intern(Lot)
+        self.Serial = Serial
+        self.FullCode = FullCode
+        self.Name = Name
+        self.Notes = Notes
+        self.Active = Active
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['datetime'], row['Lot'], row['Serial'], row['FullCode'], row['Name'], row['Notes'], row['Active'])
+
+    @classmethod
+    def from_values(cls, values):
+        # A Storage.row_values() row; Active becomes a bool, as the apps keep it once loaded
+        return cls(*values[:6], values[6] == 'True')
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except (AttributeError, TypeError):
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        if field not in self.__slots__:
+            raise KeyError(field)
+        setattr(self, field, value)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in self.__slots__ else default
+
+    def keys(self):
+        return FIELD_KEYS
+
+    def __repr__(self):
+        return f"Sample({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)})"
@@ -0,0 +1,90 @@
+"""Check-in by barcode scan: mark many samples Active in one session.
+
+A ``ScanSession`` resolves each scanned FullCode against the in-memory
+``LotSampleIndex`` and keeps a running tally instead of stopping on a miss.
+Nothing is written while scanning; ``edits()`` gives every check-in of the
+session for a single ``Storage.update_samples`` call at the end, so a scanner
+is never held up by the disk.
+
+Run from the shell with ``python las_scan.py`` and scan (or pipe) one code per
+line; the session is saved at end of input (Ctrl-D, or Ctrl-Z Enter on
+Windows).
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+
+from las_core import LotSampleStore, is_active
+from las_storage import open_storage
+
+CHECKED_IN = 'checked in'
+ALREADY_ACTIVE = 'already active'
+REPEATED = 'scanned twice'
+UNKNOWN = 'unknown'
+
+
+class ScanSession:
+    def __init__(self, index):
+        self.index = index
+        self.pending = {}  # FullCode -> sample to mark Active when the session is saved
+        self.seen = set()
+        self.unknown = []  # Codes that matched no sample, in scan order
+        self.tally = Counter()
+
+    def scan(self, code):
+        """Resolve one scanned code and return what happened to it, or None for a blank scan."""
+        code = code.strip()
+        if not code:
+            return None
+        sample = self.index.sample_by_code(code)
+        if code in self.seen:
+            result = REPEATED
+        elif sample is None:
+            result = UNKNOWN
+            self.unknown.append(code)
+        else:
+            result = ALREADY_ACTIVE if is_active(sample) else CHECKED_IN
+            if result == CHECKED_IN:
+                self.pending[code] = sample
+        self.seen.add(code)
+        self.tally[result] += 1
+        return result
+
+    def summary(self):
+        return ', '.join(f"{self.tally[result]} {result}" for result in (CHECKED_IN, ALREADY_ACTIVE, REPEATED, UNKNOWN))
+
+    def edits(self):
+        # For Storage.update_samples
+        return {code: {'Active': 'True'} for code in self.pending}
+
+    def saved(self):
+        # Once the edits are on disk, memory follows
+        for sample in self.pending.values():
+            sample['Active'] = 'True'
+        self.pending = {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check in samples by scanning their codes, one per line on stdin")
+    parser.parse_args(argv)
+
+    storage = open_storage()
+    store = LotSampleStore(storage)
+    store.load()
+    session = ScanSession(store.index)
+    start = time.perf_counter()
+    for line in sys.stdin:
+        result = session.scan(line)
+        if result:
+            print(f"{line.strip()}: {result}  [{session.summary()}]", flush=True)
+    storage.update_samples(session.edits())
+    session.saved()
+    storage.close()
+    elapsed = time.perf_counter() - start
+    scans = sum(session.tally.values())
+    print(f"Saved: {session.summary()} ({scans} scans in {elapsed:.1f} s)")
+
+
+if __name__ == '__main__':
+    main()
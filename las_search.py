@@ -0,0 +1,93 @@
+"""Inverted index for finding samples by the words in their Name and Notes.
+
+Documents are keyed by FullCode. Every query term must match (AND); the last
+term typed also matches as a prefix, so results appear while a word is still
+being typed. Results are ranked by tf-idf, with Name hits weighted above Notes
+hits and exact word matches above prefix matches.
+
+The index is updated one sample at a time (``add`` / ``update`` / ``remove``),
+so saving a note never triggers a rebuild. The sorted vocabulary used for
+prefix matches is only rebuilt on the first query after words came or went,
+so loading many samples costs one sort rather than one insertion each.
+"""
+import bisect
+import heapq
+import math
+import re
+from collections import Counter
+
+TOKEN = re.compile(r'\w+')
+NAME_WEIGHT = 3  # A word in the Name counts as much as three occurrences in the Notes
+PREFIX_WEIGHT = 0.5  # A prefix match counts half an exact match
+MAX_EXPANSIONS = 50  # Vocabulary words a prefix may expand to, to bound query time
+
+
+def tokenize(text):
+    return [token.casefold() for token in TOKEN.findall(text or '')]
+
+
+class TextIndex:
+    def __init__(self):
+        self.postings = {}  # token -> {FullCode: weighted term frequency}
+        self.documents = {}  # FullCode -> Counter of its weighted tokens, for removal
+        self.vocabulary = None  # Sorted tokens, for prefix expansion; None until the next query needs them
+
+    def add(self, key, name, notes):
+        if key in self.documents:
+            self.remove(key)
+        weights = Counter()
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(notes):
+            weights[token] += 1
+        self.documents[key] = weights
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                self.vocabulary = None
+            posting[key] = weight
+
+    def remove(self, key):
+        for token in self.documents.pop(key, ()):
+            posting = self.postings[token]
+            del posting[key]
+            if not posting:
+                del self.postings[token]
+                self.vocabulary = None
+
+    def update(self, key, name, notes):
+        self.remove(key)
+        self.add(key, name, notes)
+
+    def expand(self, prefix):
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.postings)
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        stop = bisect.bisect_left(self.vocabulary, prefix + '\U0010ffff', start)
+        return self.vocabulary[start:min(stop, start + MAX_EXPANSIONS)]
+
+    def search(self, query, limit=50):
+        """Return up to `limit` FullCodes matching every word of `query`, best first."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        total = len(self.documents)
+        scores = None
+        for position, term in enumerate(terms):
+            matches = [term] if term in self.postings else []
+            if position == len(terms) - 1:
+                matches += [token for token in self.expand(term) if token != term]
+            term_scores = {}
+            for token in matches:
+                posting = self.postings[token]
+                weight = math.log(1 + total / len(posting)) * (1 if token == term else PREFIX_WEIGHT)
+                for key, frequency in posting.items():
+                    term_scores[key] = term_scores.get(key, 0) + frequency * weight
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+            if not scores:
+                return []
+        return heapq.nlargest(limit, scores, key=scores.get)
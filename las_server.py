@@ -0,0 +1,283 @@
+"""Local HTTP/JSON service for instruments and scanners, without a desktop session.
+
+Run with ``python las_server.py [--host 127.0.0.1] [--port 8750]``. Endpoints:
+
+* ``POST /lots`` ``{"name": ...}`` - create a lot, returns it (201)
+* ``GET /lots/<code>`` - the lot and the FullCodes of its samples
+* ``POST /samples`` ``{"lot": <code>, "name": ...}`` - create a sample (201)
+* ``GET /samples/<FullCode>`` - look up a sample, including ones in archived
+  shards (see las_shards) and archived samples (see las_archive), which are
+  marked as such and cannot be edited here
+* ``PATCH /samples/<FullCode>`` ``{"notes": ..., "active": true/false}`` - edit a sample
+
+All lookups and code allocation happen on the event loop thread against one
+``LotSampleStore``, so requests never interleave inside an operation and two
+clients can never be handed the same code. Storage writes run on a single
+worker thread in the order the requests were made; a response is sent once
+its write is on disk. Every RELOAD_SECONDS the storage is asked whether
+another instance (a LaS3 window, another server) wrote to it, and if so only
+the rows appended and the notes edited since are taken over; the store is
+reloaded in full only when the data file was rewritten or a write failed.
+
+Connections are HTTP/1.1 keep-alive, so a scanner can send request after
+request without reconnecting.
+
+With ``LAS_METRICS`` set (see las_metrics), request handling and storage
+calls are timed, and ``LAS_METRICS=<file>`` dumps the numbers there.
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from las_archive import ArchiveStore, archive_path, find_unloaded
+from las_codes import CODES_FILE
+from las_core import LotSampleStore, is_active
+from las_metrics import DUMP_PATH, DUMP_SECONDS, metrics, wrap, wrap_storage
+from las_storage import open_storage
+
+HOST = '127.0.0.1'
+PORT = 8750
+RELOAD_SECONDS = 2.0  # How often to check for writes by other instances
+MAX_BODY = 1 << 20
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def sample_json(sample):
+    return {field: sample[field] for field in sample.keys()} | {'Active': is_active(sample)}
+
+
+def lot_json(lot):
+    return {'Lot': lot['Lot'], 'Name': lot['Name']}
+
+
+def parse_json(body):
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        raise HTTPError(400, "Request body must be JSON.") from None
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Request body must be a JSON object.")
+    return data
+
+
+def text_field(data, key):
+    value = data.get(key, '')
+    if not isinstance(value, str):
+        raise HTTPError(400, f"'{key}' must be a string.")
+    return value
+
+
+async def read_request(reader):
+    """Return (method, path, headers, body), or None once the client closed the connection."""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, "Malformed request line.") from None
+    headers = {'version': version}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400, "Malformed Content-Length.") from None
+    if length > MAX_BODY:
+        raise HTTPError(413, "Request body is too large.")
+    body = await reader.readexactly(length) if length else b''
+    return method, target.split('?', 1)[0], headers, body
+
+
+def keep_alive(headers):
+    connection = headers.get('connection', '').lower()
+    if headers['version'] == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+class LotSampleServer:
+    def __init__(self, storage, cursors_path=CODES_FILE):
+        self.storage = storage
+        self.cursors_path = cursors_path
+        self.store = LotSampleStore(storage, cursors_path)
+        self.archive = ArchiveStore(archive_path(storage))
+        self.executor = ThreadPoolExecutor(max_workers=1)  # One thread: writes stay in request order
+        self.writes_submitted = 0  # Bumped per write, so a reload that overlaps a write is discarded
+        self.stale = False  # Set when a write failed, so memory no longer matches storage
+        wrap_storage(storage)
+        wrap(self, ['handle'])
+
+    async def storage_call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def write(self, func, *args):
+        self.writes_submitted += 1
+        return await self.storage_call(func, *args)
+
+    async def reload_periodically(self):
+        while True:
+            await asyncio.sleep(RELOAD_SECONDS)
+            if not (self.stale or await self.storage_call(self.storage.changed)):
+                continue
+            if not self.stale and await self.apply_updates():
+                continue
+            writes_submitted = self.writes_submitted
+            store = LotSampleStore(self.storage, self.cursors_path)
+            await self.storage_call(store.load)
+            if writes_submitted == self.writes_submitted:
+                self.store, self.stale = store, False  # Otherwise our own write raced the reload; try again next time
+
+    async def apply_updates(self):
+        # False if the storage can't tell what changed, so a full reload is needed
+        while True:
+            writes_submitted = self.writes_submitted
+            updates = await self.storage_call(self.storage.updates)
+            if updates is None:
+                return False
+            new_rows, edits = updates
+            if writes_submitted == self.writes_submitted:
+                self.store.apply_updates(new_rows, edits)
+                return True
+            # The edits may predate a write of ours queued meanwhile; keep the rows and read the edits again
+            self.store.apply_updates(new_rows, {})
+
+    async def dump_metrics_periodically(self):
+        while True:
+            await asyncio.sleep(DUMP_SECONDS)
+            await asyncio.get_running_loop().run_in_executor(None, metrics.dump, DUMP_PATH)
+
+    async def handle(self, method, path, body):
+        parts = path.strip('/').split('/')
+        if parts == ['lots'] and method == 'POST':
+            try:
+                lot = self.store.create_lot(text_field(parse_json(body), 'name'))
+            except ValueError as error:
+                raise HTTPError(400, str(error)) from None
+            await self.write(self.storage.add_lot, dict(lot))
+            return 201, lot_json(lot)
+        if len(parts) == 2 and parts[0] == 'lots' and method == 'GET':
+            lot = self.store.index.lot_by_code(parts[1])
+            if lot is None:
+                raise HTTPError(404, f"No lot with code {parts[1]}.")
+            return 200, lot_json(lot) | {'samples': [sample['FullCode'] for sample in self.store.index.samples_in_lot(parts[1])]}
+        if parts == ['samples'] and method == 'POST':
+            data = parse_json(body)
+            try:
+                sample = self.store.create_sample(text_field(data, 'lot'), text_field(data, 'name'))
+            except ValueError as error:
+                raise HTTPError(400, str(error)) from None
+            await self.write(self.storage.add_sample, sample)
+            return 201, sample_json(sample)
+        if len(parts) == 2 and parts[0] == 'samples' and method in ('GET', 'PATCH'):
+            if method == 'GET':
+                sample = self.store.index.sample_by_code(parts[1])
+                if sample is None:
+                    found = await self.storage_call(find_unloaded, self.storage, self.archive, parts[1])
+                    if found is None:
+                        raise HTTPError(404, f"No sample with code {parts[1]}.")
+                    row, where = found
+                    return 200, sample_json(row) | {'archived_shard' if where == 'shard' else 'archived': True}
+                return 200, sample_json(sample)
+            data = parse_json(body)
+            notes = data.get('notes')
+            active = data.get('active')
+            if notes is not None and not isinstance(notes, str):
+                raise HTTPError(400, "'notes' must be a string.")
+            if active is not None and not isinstance(active, bool):
+                raise HTTPError(400, "'active' must be true or false.")
+            try:
+                sample, fields, expected = self.store.edit_sample(parts[1], notes, active)
+            except KeyError:
+                found = await self.storage_call(find_unloaded, self.storage, self.archive, parts[1])
+                if found and found[1] == 'shard':
+                    raise HTTPError(404, f"Sample {parts[1]} is in an archived shard; unarchive it to edit the sample.") from None
+                if found:
+                    raise HTTPError(404, f"Sample {parts[1]} is archived and can no longer be edited.") from None
+                raise HTTPError(404, f"No sample with code {parts[1]}.") from None
+            self.store.saved(sample, await self.write(self.storage.update_sample, parts[1], fields, expected))
+            return 200, sample_json(sample)
+        if parts[0] in ('lots', 'samples') and len(parts) <= 2:
+            raise HTTPError(405, f"{method} is not supported on {path}.")
+        raise HTTPError(404, f"Nothing at {path}.")
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                headers = {'version': 'HTTP/1.1', 'connection': 'close'}
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    status, payload = await self.handle(method, path, body)
+                except HTTPError as error:
+                    status, payload = error.status, {'error': str(error)}
+                except (asyncio.LimitOverrunError, ValueError):
+                    status, payload = 400, {'error': "Malformed request."}
+                except Exception as error:  # A failed write: report it and reload from storage on the next check
+                    self.stale = True
+                    status, payload = 500, {'error': f"Failed to save: {error}"}
+                data = json.dumps(payload).encode()
+                open_ = keep_alive(headers)
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if open_ else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not open_:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        await self.storage_call(self.store.load)
+        server = await asyncio.start_server(self.serve_connection, host, port)
+        tasks = [asyncio.create_task(self.reload_periodically())]
+        if DUMP_PATH:
+            tasks.append(asyncio.create_task(self.dump_metrics_periodically()))
+        if ready:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.executor.shutdown()  # Waits for queued writes
+            if DUMP_PATH:
+                metrics.dump(DUMP_PATH)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve lots and samples over a local HTTP/JSON API")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args(argv)
+
+    storage = open_storage()
+    server = LotSampleServer(storage)
+    ready = lambda s: print(f"Serving on http://{args.host}:{s.sockets[0].getsockname()[1]}", flush=True)
+    try:
+        asyncio.run(server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
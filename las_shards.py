@@ -0,0 +1,388 @@
+"""Sharded data layout: one CSV file per lot or per month, plus a manifest.
+
+With one ``lots_and_samples.csv`` every full-file operation (loading,
+compacting note edits, finding a lot's name) grows with the whole history.
+``ShardedStorage`` instead keeps a directory (SHARD_DIR) of smaller CSV files,
+each an ordinary CsvStorage with its own journal, cache and lock:
+
+* ``--by lot``: one shard per lot, named after its 8-digit code
+* ``--by month``: one shard per month (``2024-05.csv``) holding the lots
+  created that month and all their samples; a lot without a creation time
+  is given the time it is added
+
+``manifest.json`` maps every lot code to its shard and keeps the lot rows
+themselves, so listing lots and finding a lot's name read only the manifest,
+and a FullCode goes straight to its shard through its lot code prefix. A
+note edit is journaled and later compacted in that one shard. A lot's
+samples always go to the lot's shard, after its row, so every shard reads
+like a small data file of its own; rows come shard by shard, not in overall
+insertion order.
+
+Archived shards stay on disk but are left out of reading (rows(), lots()),
+so old months need not be loaded at all. Their samples can still be looked
+up by FullCode (``sample()``; LaS3 and las_server fall back to it for codes
+they did not load) but are only editable in the apps once the shard is
+unarchived. Notes history stays in one file,
+``lots_and_samples.history``, as for the unsharded data.
+
+The apps use the shards once SHARD_DIR has a manifest (a SQLite database
+still takes precedence). Split an existing CSV data file with::
+
+    python las_shards.py split [--by lot|month] [lots_and_samples.csv] [lots_and_samples.shards]
+    python las_shards.py archive 2023-01 2023-02
+    python las_shards.py list
+"""
+import argparse
+import json
+import os
+import shutil
+
+from las_codes import LOT_DIGITS
+from las_core import timestamp
+from las_history import NotesHistory
+from las_lock import FileLock
+from las_storage import CSV_FILE, FIELDNAMES, SHARD_DIR, CsvStorage, Storage, file_signature, history_path
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+LAYOUTS = ('lot', 'month')
+ADD_BATCH = 10_000  # add_rows() routes rows to their shards this many at a time
+
+
+def is_sharded(path):
+    return os.path.exists(os.path.join(path, MANIFEST))
+
+
+class ShardedStorage(Storage):
+    def __init__(self, path=SHARD_DIR, by='lot'):
+        if by not in LAYOUTS:
+            raise ValueError(f"Shard by one of {', '.join(LAYOUTS)}, not {by!r}.")
+        self.path = path
+        self.manifest_path = os.path.join(path, MANIFEST)
+        os.makedirs(path, exist_ok=True)
+        self.lock = FileLock(os.path.join(path, 'manifest.lock'))  # Held while changing the manifest
+        self.history = NotesHistory(history_path(path))  # One history for all shards
+        self.shards = {}  # Shard name -> CsvStorage, opened as needed
+        self.manifest = None
+        self.manifest_signature = None
+        self.read_shards = None  # Shards our last full read covered, with the archive list at the time
+        with self.lock:
+            if not os.path.exists(self.manifest_path):
+                self.save_manifest({'version': MANIFEST_VERSION, 'by': by, 'lots': {}, 'archived': []})
+            self.load_manifest()
+
+    def load_manifest(self):
+        # Re-read the manifest if another instance changed it; return whether it did
+        signature = file_signature(self.manifest_path)
+        if signature == self.manifest_signature:
+            return False
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"{self.manifest_path} is from another version of LaS.")
+        self.manifest, self.manifest_signature = manifest, signature
+        return True
+
+    def save_manifest(self, manifest):
+        tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(manifest))
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest, self.manifest_signature = manifest, file_signature(self.manifest_path)
+
+    @property
+    def layout(self):
+        return self.manifest['by']
+
+    def shard_names(self, archived=False):
+        """Shards in the order their first lot was added; archived ones only if asked for."""
+        names = dict.fromkeys(entry['shard'] for entry in self.manifest['lots'].values())
+        hidden = set() if archived else set(self.manifest['archived'])
+        return [name for name in names if name not in hidden]
+
+    def shard(self, name):
+        shard = self.shards.get(name)
+        if shard is None:
+            shard = self.shards[name] = CsvStorage(os.path.join(self.path, name + '.csv'))
+            shard.history.close()
+            shard.history = self.history
+        return shard
+
+    def release(self, shard):
+        # Close the shard's lock files until it is next used, so thousands of shards do not use up file handles
+        shard.lock.close()
+        shard.journal.compaction_lock.close()
+
+    def shard_of(self, lot_code):
+        entry = self.manifest['lots'].get(lot_code)
+        if entry is None:
+            self.load_manifest()  # Perhaps another instance added the lot
+            entry = self.manifest['lots'].get(lot_code)
+        return entry and entry['shard']
+
+    def new_shard_name(self, lot):
+        if self.layout == 'lot':
+            return lot['Lot']
+        return lot['datetime'][:7]
+
+    def rows(self):
+        return (dict(zip(FIELDNAMES, values)) for values in self.row_values())
+
+    def row_values(self, streaming=False):
+        self.load_manifest()
+        self.read_shards = set(), tuple(self.manifest['archived'])
+        for name in self.shard_names():
+            shard = self.shard(name)
+            yield from shard.row_values(streaming)
+            self.read_shards[0].add(name)
+            self.release(shard)
+
+    def lots(self):
+        self.load_manifest()
+        hidden = set(self.manifest['archived'])
+        return [dict(dict.fromkeys(FIELDNAMES, ''), **entry['row']) for entry in self.manifest['lots'].values()
+                if entry['shard'] not in hidden]
+
+    def add_rows(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == ADD_BATCH:
+                self.add_batch(batch)
+                batch = []
+        if batch:
+            self.add_batch(batch)
+
+    def add_batch(self, rows):
+        lots = [dict(row) for row in rows if row.get('Lot') and not row.get('Serial')]
+        if lots:
+            with self.lock:
+                self.load_manifest()
+                manifest = dict(self.manifest, lots=dict(self.manifest['lots']))
+                for lot in lots:
+                    if self.layout == 'month' and not lot.get('datetime'):
+                        lot['datetime'] = timestamp()  # The month decides the shard, so the lot row must carry it
+                    row = {field: lot[field] for field in FIELDNAMES if lot.get(field)}
+                    manifest['lots'][lot['Lot']] = {'shard': self.new_shard_name(lot), 'row': row}
+                self.save_manifest(manifest)
+            lots = iter(lots)
+            rows = [next(lots) if row.get('Lot') and not row.get('Serial') else row for row in rows]
+        by_shard = {}
+        for row in rows:
+            name = self.shard_of(row.get('Lot') or '')
+            if name is None:
+                raise ValueError(f"Row {row.get('FullCode') or row.get('Name')!r} belongs to lot {row.get('Lot')!r}, "
+                                 f"which is not in {self.manifest_path}.")
+            by_shard.setdefault(name, []).append(row)
+        for name, shard_rows in by_shard.items():
+            shard = self.shard(name)
+            shard.add_rows(shard_rows)
+            self.release(shard)
+
+    def add_lot(self, lot):
+        self.add_rows([lot])
+
+    def add_sample(self, sample):
+        self.add_rows([sample])
+
+    def sample_shard(self, full_code):
+        name = self.shard_of(full_code[:LOT_DIGITS])
+        if name is None:
+            raise ValueError(f"No lot for sample {full_code}.")
+        return self.shard(name)
+
+    def update_sample(self, full_code, fields, expected=None):
+        shard = self.sample_shard(full_code)
+        stored = shard.update_sample(full_code, fields, expected)
+        self.release(shard)
+        return stored
+
+    def update_samples(self, edits):
+        by_shard = {}
+        for full_code, fields in edits.items():
+            by_shard.setdefault(self.sample_shard(full_code), {})[full_code] = fields
+        for shard, shard_edits in by_shard.items():
+            shard.update_samples(shard_edits)
+            self.release(shard)
+
+    def changed(self):
+        if self.read_shards is None:
+            return True
+        if file_signature(self.manifest_path) != self.manifest_signature:
+            return True
+        return any(self.shards[name].changed() for name in self.read_shards[0])
+
+    def updates(self):
+        if self.read_shards is None:
+            return None
+        read, archived = self.read_shards
+        self.load_manifest()
+        if tuple(self.manifest['archived']) != archived:
+            return None  # Shards were archived or brought back: start over
+        new_rows, edits = [], {}
+        for name in self.shard_names():
+            shard = self.shard(name)
+            if name not in read:  # A lot added since in a shard of its own: all of it is new
+                new_rows.extend(shard.row_values(streaming=True))
+                read.add(name)
+            elif shard.changed():
+                found = shard.updates()
+                if found is None:
+                    return None
+                new_rows.extend(found[0])
+                edits.update(found[1])
+            self.release(shard)
+        return new_rows, edits
+
+    def lot_name(self, lot_code):
+        self.load_manifest()
+        entry = self.manifest['lots'].get(lot_code)
+        return entry['row'].get('Name', '') if entry else None
+
+    def sample(self, full_code):
+        name = self.shard_of(full_code[:LOT_DIGITS])
+        if name is None:
+            return None
+        shard = self.shard(name)
+        found = shard.sample(full_code)
+        self.release(shard)
+        return found
+
+    def samples(self, lot_code=None, active=None):
+        if lot_code is None:
+            yield from super().samples(None, active)
+            return
+        name = self.shard_of(lot_code)
+        if name is not None:
+            yield from self.shard(name).samples(lot_code, active)
+
+    def set_archived(self, names, archived=True):
+        """Archive (or bring back) shards by name."""
+        with self.lock:
+            self.load_manifest()
+            unknown = set(names) - set(self.shard_names(archived=True))
+            if unknown:
+                raise ValueError(f"No shard named {', '.join(sorted(unknown))}.")
+            kept = [name for name in self.manifest['archived'] if name not in names]
+            self.save_manifest(dict(self.manifest, archived=kept + (list(names) if archived else [])))
+
+    def signatures(self):
+        """File signatures of the manifest and every readable shard and journal, to tell whether anything changed."""
+        self.load_manifest()
+        paths = [self.manifest_path]
+        for name in self.shard_names():
+            shard = self.shard(name)
+            paths += [shard.path, shard.journal.path]
+        return [list(file_signature(path)) if os.path.exists(path) else None for path in paths]
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.lock.close()
+            shard.journal.compaction_lock.close()
+        self.lock.close()
+        self.history.close()
+
+
+def split(csv_path=CSV_FILE, shard_path=SHARD_DIR, by='lot'):
+    """Copy every row of a CSV data file (with its journaled edits) into a new sharded layout; return the storage.
+
+    The shards are built in a temporary directory that only takes the place
+    of `shard_path` once every row was copied, so a failed split never
+    leaves a manifest behind that open_storage would prefer over the CSV.
+    """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(csv_path)
+    if is_sharded(shard_path):
+        raise FileExistsError(f"{shard_path} already holds sharded data; refusing to split twice")
+    if os.path.isdir(shard_path) and os.listdir(shard_path):
+        raise FileExistsError(f"{shard_path} is not empty; refusing to split into it")
+    tmp_path = f'{shard_path}.{os.getpid()}.tmp'
+    source = CsvStorage(csv_path)
+    try:
+        with source.lock:  # No rows are appended or edits journaled while we copy
+            lots, first_sample, orphans = set(), {}, []
+            for values in source.row_values(streaming=True):
+                if values[1] and not values[2]:
+                    lots.add(values[1])
+                elif values[2]:
+                    if values[1] not in lots:  # A lot's row comes before its samples; without one there is no shard
+                        orphans.append(values[3])
+                    elif values[0]:
+                        # Lots carry no creation time of their own; by month, each goes under its first sample's
+                        first_sample.setdefault(values[1], values[0])
+            if orphans:
+                raise ValueError(f"{len(orphans)} samples have no lot row before them, e.g. {', '.join(orphans[:5])}; "
+                                 f"nothing was split.")
+
+            def rows():
+                for values in source.row_values(streaming=True):
+                    row = dict(zip(FIELDNAMES, values))
+                    if row['Lot'] and not row['Serial'] and not row['datetime'] and by == 'month':
+                        row['datetime'] = first_sample.get(row['Lot'], '')
+                    if row['Lot']:  # Rows without a lot (the placeholder a new file starts with) have no shard
+                        yield row
+
+            target = ShardedStorage(tmp_path, by)
+            try:
+                target.add_rows(rows())
+            finally:
+                target.close()
+            if os.path.isdir(shard_path):
+                os.rmdir(shard_path)  # Empty, checked above
+            os.replace(tmp_path, shard_path)
+    finally:
+        source.close()
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+    return ShardedStorage(shard_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded data files: one per lot or per month")
+    commands = parser.add_subparsers(dest='command', required=True)
+    split_parser = commands.add_parser('split', help="copy a lots_and_samples.csv into shards")
+    split_parser.add_argument('--by', choices=LAYOUTS, default='lot')
+    split_parser.add_argument('csv_file', nargs='?', default=CSV_FILE)
+    split_parser.add_argument('shard_dir', nargs='?', default=SHARD_DIR)
+    for command, help_text in (('archive', "leave shards out of loading"), ('unarchive', "load archived shards again")):
+        archive_parser = commands.add_parser(command, help=help_text)
+        archive_parser.add_argument('shards', nargs='+')
+        archive_parser.add_argument('--dir', default=SHARD_DIR)
+    list_parser = commands.add_parser('list', help="show the shards")
+    list_parser.add_argument('--dir', default=SHARD_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == 'split':
+        try:
+            storage = split(args.csv_file, args.shard_dir, args.by)
+        except (OSError, ValueError) as error:
+            parser.exit(1, f"{error}\n")
+        print(f"Split {args.csv_file} into {len(storage.shard_names())} shards in {args.shard_dir}")
+        storage.close()
+        return
+    if not is_sharded(args.dir):
+        parser.exit(1, f"{args.dir} holds no sharded data\n")
+    storage = ShardedStorage(args.dir)
+    try:
+        if args.command == 'list':
+            archived = set(storage.manifest['archived'])
+            lots = {}
+            for entry in storage.manifest['lots'].values():
+                lots[entry['shard']] = lots.get(entry['shard'], 0) + 1
+            try:
+                for name in storage.shard_names(archived=True):
+                    size = os.path.getsize(os.path.join(args.dir, name + '.csv'))
+                    state = '\tarchived' if name in archived else ''
+                    print(f"{name}\t{lots[name]} lots\t{size / 1e6:.1f} MB{state}")
+            except BrokenPipeError:  # Output piped into e.g. head
+                pass
+        else:
+            storage.set_archived(args.shards, args.command == 'archive')
+    except ValueError as error:
+        parser.exit(1, f"{error}\n")
+    finally:
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,553 @@
+"""Storage backends for the lot/sample data used by LaS2 and LaS3.
+
+The apps talk to a ``Storage`` object instead of opening files themselves.
+``CsvStorage`` keeps the original ``lots_and_samples.csv`` layout (with note
+edits journaled, see las_journal); ``SqliteStorage`` holds the same rows in an
+SQLite database in WAL mode with indexes on FullCode, Lot and Name.
+
+Rows are plain dicts keyed by FIELDNAMES with string values in both backends,
+exactly as ``csv.DictReader`` returns them.
+
+Import an existing CSV into SQLite with::
+
+    python las_storage.py migrate [lots_and_samples.csv] [lots_and_samples.db]
+
+The apps pick SQLite automatically once the database file exists, and the
+sharded layout of las_shards (one CSV file per lot or month) once its
+directory does.
+
+Several app instances may share one data file. CSV appends, journal records
+and compaction swaps happen under a lock on ``<data file>.lock`` (see
+las_lock); SQLite does its own locking. A notes edit passes the values the
+user started from as ``expected``; if another instance changed the sample in
+the meantime the two edits are merged (``merge_fields``) instead of the later
+one silently overwriting the earlier.
+
+To see what other instances wrote, ``CsvStorage.updates()`` parses only the
+rows appended since the last read (found by checking the file still starts
+with the bytes that read saw) plus the journaled edits; a rewritten file
+needs a full read again. SQLite has no cheap way to find edited rows, so it
+always asks for a full read.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from las_cache import describe, is_prefix, read_cache, write_cache
+from las_history import NotesHistory
+from las_journal import EditJournal, lines_upto
+from las_lock import FileLock, same_file
+
+CSV_FILE = 'lots_and_samples.csv'
+DB_FILE = 'lots_and_samples.db'
+SHARD_DIR = 'lots_and_samples.shards'  # See las_shards
+FIELDNAMES = ['datetime', 'Lot', 'Serial', 'FullCode', 'Name', 'Notes', 'Active']  # Added 'Active'
+CACHE_REFRESH = 8  # Rewrite the binary cache once more than 1/8 of the file is past what it covers
+
+
+def file_signature(path):
+    # (mtime, size) is enough to tell whether another instance touched the file
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_csv_rows(filename):
+    # Headerless CSV as lists of strings (LaS1's lots.csv / samples.csv)
+    if not os.path.exists(filename):
+        return []
+    with open(filename, mode='r') as file:
+        return [row for row in csv.reader(file)]
+
+
+def append_csv_row(filename, data):
+    with open(filename, mode='a', newline='') as file:
+        csv.writer(file).writerow(data)
+
+
+def merge_text(base, ours, theirs):
+    # Three-way merge of a Notes field that two users edited from the same `base`
+    if ours == base or ours == theirs:
+        return theirs
+    if theirs == base:
+        return ours
+    if ours.startswith(base) and theirs.startswith(base):  # Both added to the end: keep both additions
+        addition = ours[len(base):]
+        return theirs + ('' if addition[:1].isspace() else '\n') + addition
+    return f"{theirs}\n{ours}"  # Keep both versions rather than lose either
+
+
+def merge_fields(expected, fields, current):
+    """Combine our edit (`fields`, made from `expected`) with the `current` stored values.
+
+    Fields nobody else touched take our value; fields only the other writer
+    touched keep theirs. When both changed a field, Notes are merged and any
+    other field (Active) takes ours, the later edit.
+    """
+    merged = {}
+    for field, ours in fields.items():
+        base = expected.get(field, ours)
+        theirs = current.get(field, base)
+        if field == 'Notes':
+            merged[field] = merge_text(base, ours, theirs)
+        else:
+            merged[field] = theirs if ours == base else ours
+    return merged
+
+
+class Storage:
+    """Operations the apps need from a backend. Rows are dicts keyed by FIELDNAMES."""
+
+    def rows(self):
+        """Yield every lot and sample row in insertion order."""
+        raise NotImplementedError
+
+    def row_values(self, streaming=False):
+        """Like rows(), but each row is a sequence of values in FIELDNAMES order (no dict per row).
+
+        With `streaming`, memory use stays the same however large the data is:
+        no cache of all rows is read or built along the way.
+        """
+        for row in self.rows():
+            yield [row[field] for field in FIELDNAMES]
+
+    def lots(self):
+        """Return just the lot rows, ideally without reading every sample."""
+        return [row for row in self.rows() if row['Lot'] and not row['Serial']]
+
+    def add_lot(self, lot):
+        raise NotImplementedError
+
+    def add_sample(self, sample):
+        raise NotImplementedError
+
+    def add_rows(self, rows):
+        """Append many lot/sample rows in one write."""
+        raise NotImplementedError
+
+    def update_sample(self, full_code, fields, expected=None):
+        """Persist changed fields (Notes, Active) of the sample with this FullCode.
+
+        With `expected` (the stored values the edit started from), a concurrent
+        edit by another instance is merged in. Returns the fields as stored.
+        """
+        raise NotImplementedError
+
+    def update_samples(self, edits):
+        """Persist {FullCode: fields} for many samples at once, as one write. Last writer wins."""
+        for full_code, fields in edits.items():
+            self.update_sample(full_code, fields)
+
+    def changed(self):
+        """True if another writer changed the data since our last read or write."""
+        raise NotImplementedError
+
+    def updates(self):
+        """Return (new_rows, edits) since our last read, or None if only a full re-read will do.
+
+        new_rows are row_values() of the rows appended since (which may include
+        rows this instance wrote itself); edits maps FullCode to the stored
+        fields of every sample edited in a way the last read may not reflect.
+        """
+        return None
+
+    def lot_name(self, lot_code):
+        return next((row['Name'] for row in self.rows() if row['Lot'] == lot_code and not row['Serial']), None)
+
+    def sample(self, full_code):
+        return next((row for row in self.rows() if row['Serial'] and row['FullCode'] == full_code), None)
+
+    def samples(self, lot_code=None, active=None):
+        """Yield samples, optionally only those in one lot and/or with the given Active flag."""
+        for row in self.rows():
+            if not row['Serial'] or (lot_code is not None and row['Lot'] != lot_code):
+                continue
+            if active is not None and (row['Active'] == 'True') != active:
+                continue
+            yield row
+
+    def record_notes(self, full_code, stored, expected):
+        # Keep every saved version of the Notes (see las_history)
+        if 'Notes' in stored:
+            self.history.record(full_code, stored['Notes'], (expected or {}).get('Notes'))
+
+    def close(self):
+        pass
+
+
+def history_path(path):
+    # Shared by the CSV file and the database migrated from it
+    return os.path.splitext(path)[0] + '.history'
+
+
+def csv_values(reader, header, columns=None):
+    # Rows from a csv.reader as lists in FIELDNAMES order, missing fields None as csv.DictReader does;
+    # each row is also appended to `columns` (one list per field) when given
+    width = len(FIELDNAMES)
+    pending = []  # Rows not yet added to `columns`
+    order = None if header == FIELDNAMES else [header.index(field) if field in header else None for field in FIELDNAMES]
+    for values in reader:
+        if not values:
+            continue  # Blank line
+        if order:
+            values = [values[position] if position is not None and position < len(values) else None for position in order]
+        elif len(values) != width:
+            values = (values + [None] * width)[:width]
+        if columns:
+            pending.append(values)
+            if len(pending) == 10_000:
+                add_to_columns(columns, pending)
+                pending = []
+        yield values
+    if columns and pending:
+        add_to_columns(columns, pending)
+
+
+def add_to_columns(columns, rows):
+    # Transposing a batch at C speed beats seven appends per row
+    for column, values in zip(columns, zip(*rows)):
+        column.extend(values)
+
+
+def with_edits(values, edits):
+    # A row's values with the journaled edits of its sample, if any, replayed over them
+    fields = edits.get(values[3]) if values[2] else None
+    return tuple(fields.get(field, value) for field, value in zip(FIELDNAMES, values)) if fields else values
+
+
+class CsvStorage(Storage):
+    def __init__(self, path=CSV_FILE):
+        self.path = path
+        self.lot_summary_path = path + '.lots.json'  # Lot rows as of a byte offset, for a fast start
+        self.cache_path = path + '.cache'  # All rows in binary form, see las_cache
+        self.lock = FileLock(path + '.lock')  # Shared with other processes using the same file
+        self.journal = EditJournal(path + '.journal', lock=self.lock)  # Note edits are appended here and folded in by compaction
+        self.history = NotesHistory(history_path(path))
+        try:
+            with open(path, 'x', newline='') as f:
+                csv.DictWriter(f, fieldnames=FIELDNAMES).writeheader()
+                csv.DictWriter(f, fieldnames=FIELDNAMES).writerow({'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+        except FileExistsError:
+            pass
+        self.signature = None  # file_signature() of path as of our last read or write
+        self.journal_signature = None  # Same for the journal
+        self.stale = False  # Set when another process wrote before one of our writes, hiding it from the signatures
+        self.snapshot = None  # os.stat() of the snapshot file our last read came from
+        self.read_state = None  # las_cache.describe() of the file up to where our last read got
+        self.header = FIELDNAMES  # Column order of the file, from its header row
+
+    def rows(self):
+        return (dict(zip(FIELDNAMES, values)) for values in self.row_values())
+
+    def row_values(self, streaming=False):
+        lots = []
+        with self.lock:  # So no compaction swaps files between reading the journal and opening the snapshot
+            edits = self.journal.latest_edits()
+            csvfile = self.open_for_read()
+        with csvfile:
+            size = self.signature[1]  # Read no further than the size we recorded, even if someone appends meanwhile
+            header_line = next(lines_upto(csvfile, size), '')
+            header = self.header = next(csv.reader([header_line]), FIELDNAMES)
+            self.read_state = describe(csvfile, size)
+            cache = None if streaming else read_cache(self.cache_path, csvfile, size)
+            if cache:
+                parsed_size, columns = cache  # Only the rows appended after parsed_size still need parsing
+            else:
+                parsed_size, columns = len(header_line.encode('utf-8')), [[] for _ in FIELDNAMES]
+            csvfile.seek(parsed_size)
+            reader = csv.reader(lines_upto(csvfile, size - parsed_size))
+            # Rewrite the cache only once the unparsed tail is a sizeable part of the file
+            refresh = not streaming and (size - parsed_size) * CACHE_REFRESH > size
+            parsed = csv_values(reader, header, columns if refresh else None)
+            for values in itertools.chain(zip(*columns) if cache else (), parsed):
+                values = with_edits(values, edits)  # Replay edits journaled since the last compaction
+                if values[1] and not values[2] and not streaming:
+                    lots.append(dict(zip(FIELDNAMES, values)))
+                yield values
+            # Only reached when the caller read everything, so `lots` and `columns` are complete up to `size`
+            if refresh or not (streaming or os.path.exists(self.lot_summary_path)):
+                tmp_path = f'{self.lot_summary_path}.{os.getpid()}.tmp'  # Other instances may be writing their own
+                with open(tmp_path, 'w') as f:
+                    f.write(json.dumps(describe(csvfile, size) | {'lots': lots}))
+                os.replace(tmp_path, self.lot_summary_path)
+            if refresh:
+                write_cache(self.cache_path, csvfile, size, columns)
+
+    def open_for_read(self):
+        # Under the lock: open the snapshot and record what our read will reflect
+        csvfile = open(self.path, 'rb')
+        self.signature, self.journal_signature, self.stale = file_signature(self.path), self.current_journal_signature(), False
+        self.snapshot = os.fstat(csvfile.fileno())
+        return csvfile
+
+    def updates(self):
+        with self.lock:
+            if self.read_state is None:
+                return None
+            edits = self.journal.latest_edits()
+            start = self.read_state['size']
+            csvfile = self.open_for_read()
+        with csvfile:
+            size = self.signature[1]
+            if not is_prefix(self.read_state, csvfile, size):
+                self.read_state = None  # Rewritten (compacted, or edited elsewhere) rather than appended to
+                return None
+            csvfile.seek(start)
+            new_rows = [with_edits(values, edits) for values in csv_values(csv.reader(lines_upto(csvfile, size - start)), self.header)]
+            self.read_state = describe(csvfile, size)
+        return new_rows, edits
+
+    def current_journal_signature(self):
+        try:
+            return file_signature(self.journal.path)
+        except FileNotFoundError:
+            return None
+
+    def lots(self):
+        try:
+            with open(self.lot_summary_path) as f:
+                summary = json.load(f)
+        except (FileNotFoundError, ValueError):
+            summary = None
+        if not isinstance(summary, dict) or 'size' not in summary:
+            summary = None  # Written by an earlier version
+        with open(self.path, 'rb') as csvfile:
+            size = os.fstat(csvfile.fileno()).st_size
+            if summary and is_prefix(summary, csvfile, size):  # Checked like the cache in las_cache
+                # Summary still describes a prefix of the file: add lots from the appended tail only
+                csvfile.seek(summary['size'])
+                tail = csv.DictReader(lines_upto(csvfile, size - summary['size']), fieldnames=FIELDNAMES)
+                return summary['lots'] + [row for row in tail if row['Lot'] and not row['Serial']]
+        return super().lots()
+
+    def add_rows(self, rows):
+        with self.lock:
+            self.stale = self.changed()
+            with open(self.path, 'a', newline='', buffering=1 << 20) as csvfile:
+                csv.DictWriter(csvfile, fieldnames=FIELDNAMES).writerows(rows)
+            self.signature = file_signature(self.path)
+
+    def add_lot(self, lot):
+        self.add_rows([lot])
+
+    def add_sample(self, sample):
+        self.add_rows([sample])
+
+    def update_sample(self, full_code, fields, expected=None):
+        if expected is not None:
+            fields = self.merge_edit(full_code, fields, expected)
+        else:
+            self.append_edits({full_code: fields})
+        self.compact_if_due()
+        self.record_notes(full_code, fields, expected)
+        return fields
+
+    def update_samples(self, edits):
+        self.append_edits(edits)
+        self.compact_if_due()
+
+    def compact_if_due(self):
+        if self.journal.should_compact():
+            self.journal.compact_in_background(self.path, lambda row: row['FullCode'], dict.update, FIELDNAMES,
+                                               on_replace=self.compacted)
+
+    def merge_edit(self, full_code, fields, expected):
+        # Stored values are the journal's edits over the snapshot row. Until a compaction replaces the
+        # snapshot, its row is what the caller loaded; after one, the row is read again without the lock
+        # and only trusted if no further compaction happened meanwhile
+        snapshot, row = self.snapshot, expected
+        while True:
+            with self.lock:
+                current = self.journal.latest_edits().get(full_code, {})
+                if set(fields) <= set(current) or (snapshot and same_file(snapshot, self.path)):
+                    merged = merge_fields(expected, fields, {**row, **current})
+                    self.append_edits({full_code: merged})
+                    return merged
+            snapshot = os.stat(self.path)
+            row = self.snapshot_row(full_code) or {}
+
+    def append_edits(self, edits):
+        with self.lock:
+            self.stale = self.changed()
+            self.journal.append_many(edits.items())
+            self.journal_signature = self.current_journal_signature()
+
+    def snapshot_row(self, full_code):
+        with open(self.path, newline='', encoding='utf-8') as csvfile:
+            return next((row for row in csv.DictReader(csvfile) if row['Serial'] and row['FullCode'] == full_code), None)
+
+    def compacted(self, old_stat):
+        # Runs on the compaction thread, under the lock, right after the new snapshot is in place
+        if (old_stat.st_mtime_ns, old_stat.st_size) != self.signature:
+            self.stale = True
+        self.signature = file_signature(self.path)
+
+    def changed(self):
+        return (self.stale or file_signature(self.path) != self.signature
+                or self.current_journal_signature() != self.journal_signature)
+
+    def close(self):
+        self.lock.close()
+        self.history.close()
+
+
+class SqliteStorage(Storage):
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.history = NotesHistory(history_path(path))
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')  # Durable across app crashes in WAL mode; fsyncs on checkpoint
+        columns = ', '.join(f'"{field}" TEXT NOT NULL DEFAULT \'\'' for field in FIELDNAMES)
+        with self.connection:
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS lots_and_samples (id INTEGER PRIMARY KEY, {columns})')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS idx_fullcode ON lots_and_samples (FullCode)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS idx_lot ON lots_and_samples (Lot, Name)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS idx_name ON lots_and_samples (Name)')
+            self.connection.execute("CREATE INDEX IF NOT EXISTS idx_lot_rows ON lots_and_samples (id) WHERE Serial = ''")
+        self.data_version = None
+
+    def query(self, where='', params=(), limit=''):
+        cursor = self.connection.execute(f'SELECT {", ".join(FIELDNAMES)} FROM lots_and_samples {where} ORDER BY id {limit}', params)
+        return (dict(row) for row in cursor)
+
+    def rows(self):
+        self.data_version = self.current_data_version()
+        return self.query()
+
+    def row_values(self, streaming=False):
+        self.data_version = self.current_data_version()
+        cursor = self.connection.cursor()
+        cursor.row_factory = None  # Plain tuples
+        return cursor.execute(f'SELECT {", ".join(FIELDNAMES)} FROM lots_and_samples ORDER BY id')
+
+    def lots(self):
+        return list(self.query("WHERE Serial = '' AND Lot != ''"))
+
+    def add_rows(self, rows):
+        placeholders = ', '.join('?' for _ in FIELDNAMES)
+        with self.connection:
+            self.connection.executemany(
+                f'INSERT INTO lots_and_samples ({", ".join(FIELDNAMES)}) VALUES ({placeholders})',
+                (['' if row.get(field) is None else str(row[field]) for field in FIELDNAMES] for row in rows))
+
+    def add_lot(self, lot):
+        self.add_rows([lot])
+
+    def add_sample(self, sample):
+        self.add_rows([sample])
+
+    def update_sample(self, full_code, fields, expected=None):
+        if not set(fields) <= set(FIELDNAMES):
+            raise ValueError(f"Unknown fields: {sorted(set(fields) - set(FIELDNAMES))}")
+        assignments = ', '.join(f'{field} = ?' for field in fields)
+        with self.connection:
+            if expected is not None:
+                self.connection.execute('BEGIN IMMEDIATE')  # Hold the write lock from the read to the update
+                current = next(self.query("WHERE FullCode = ? AND Serial != ''", (full_code,), 'LIMIT 1'), {})
+                fields = merge_fields(expected, fields, current)
+            self.connection.execute(f"UPDATE lots_and_samples SET {assignments} WHERE FullCode = ? AND Serial != ''",
+                                    [str(value) for value in fields.values()] + [full_code])
+        self.record_notes(full_code, fields, expected)
+        return fields
+
+    def update_samples(self, edits):
+        fields = {field for changes in edits.values() for field in changes}
+        if not fields <= set(FIELDNAMES):
+            raise ValueError(f"Unknown fields: {sorted(fields - set(FIELDNAMES))}")
+        with self.connection:  # One transaction for the whole batch
+            for full_code, changes in edits.items():
+                assignments = ', '.join(f'{field} = ?' for field in changes)
+                self.connection.execute(f"UPDATE lots_and_samples SET {assignments} WHERE FullCode = ? AND Serial != ''",
+                                        [str(value) for value in changes.values()] + [full_code])
+
+    def current_data_version(self):
+        # Changes whenever another connection commits to the database
+        return self.connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def changed(self):
+        return self.current_data_version() != self.data_version
+
+    def lot_name(self, lot_code):
+        row = self.connection.execute(
+            "SELECT Name FROM lots_and_samples WHERE Lot = ? AND Serial = '' ORDER BY id LIMIT 1", (lot_code,)).fetchone()
+        return row['Name'] if row else None
+
+    def sample(self, full_code):
+        return next(self.query("WHERE FullCode = ? AND Serial != ''", (full_code,), 'LIMIT 1'), None)
+
+    def samples(self, lot_code=None, active=None):
+        conditions, params = ["Serial != ''"], []
+        if lot_code is not None:
+            conditions.append('Lot = ?')
+            params.append(lot_code)
+        if active is not None:
+            conditions.append('Active = ?')
+            params.append('True' if active else 'False')
+        return self.query('WHERE ' + ' AND '.join(conditions), params)
+
+    def close(self):
+        self.connection.close()
+        self.history.close()
+
+
+def open_storage(csv_path=CSV_FILE, db_path=DB_FILE, shard_path=SHARD_DIR):
+    # Once a CSV has been migrated or split, the database or the shards are the source of truth
+    if os.path.exists(db_path):
+        return SqliteStorage(db_path)
+    from las_shards import ShardedStorage, is_sharded  # las_shards builds on this module
+    if is_sharded(shard_path):
+        return ShardedStorage(shard_path)
+    return CsvStorage(csv_path)
+
+
+def migrate(csv_path=CSV_FILE, db_path=DB_FILE):
+    """Import every row of a CSV data file (with its journaled edits) into an SQLite database.
+
+    The database is built under a temporary name and only put in place once
+    every row made it, so a failed import never leaves a database behind
+    that open_storage would prefer over the CSV.
+    """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(csv_path)
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} already exists; refusing to import twice")
+    tmp_path = f'{db_path}.{os.getpid()}.tmp'
+    source = CsvStorage(csv_path)
+    try:
+        with source.lock:  # No rows are appended or edits journaled while we copy
+            target = SqliteStorage(tmp_path)
+            try:
+                target.add_rows(source.rows())
+                count = target.connection.execute('SELECT COUNT(*) FROM lots_and_samples').fetchone()[0]
+            finally:
+                target.close()
+            os.replace(tmp_path, db_path)
+    finally:
+        source.close()
+        for path in (tmp_path, tmp_path + '-wal', tmp_path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lot/sample storage tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = commands.add_parser('migrate', help="import a lots_and_samples.csv into SQLite")
+    migrate_parser.add_argument('csv_file', nargs='?', default=CSV_FILE)
+    migrate_parser.add_argument('db_file', nargs='?', default=DB_FILE)
+    args = parser.parse_args(argv)
+    try:
+        count = migrate(args.csv_file, args.db_file)
+    except (OSError, ValueError, csv.Error) as error:  # ValueError covers bytes that are not UTF-8
+        parser.exit(1, f"Migration failed, no database was written:\n{error}\n")
+    print(f"Imported {count} rows from {args.csv_file} into {args.db_file}")
+
+
+if __name__ == '__main__':
+    main()
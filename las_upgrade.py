@@ -0,0 +1,206 @@
+"""Upgrade LaS1 data to the LaS2/LaS3 layout.
+
+LaS1 keeps two headerless files: ``lots.csv`` rows are [lot ID, name,
+notes] and ``samples.csv`` rows are [sample ID, name, description, lot
+name], with note edits journaled in ``samples.csv.journal`` under
+(sample name, lot name). LaS2 and LaS3 keep one ``lots_and_samples.csv``
+(or SQLite database) of FIELDNAMES rows keyed by generated codes. The
+upgrade maps:
+
+* a LaS1 lot to a lot row with a new 8-digit code, its notes in Notes
+* a LaS1 sample to a sample row in the lot of that name, with a new serial;
+  its description (with any journaled edit applied) becomes Notes and it
+  starts inactive
+* a lot name that samples refer to but lots.csv lacks to a new lot
+
+LaS1 IDs were typed in by hand and have no column of their own; a non-empty
+one is kept as a first ``LaS1 ID: ...`` line of Notes so it stays
+searchable. LaS1 rows have no creation time, so datetime is left empty.
+
+Both files are streamed once: lots.csv first, keeping only a lot name ->
+code table, then samples.csv, looking each sample's lot up in that table.
+Memory grows with the number of lots, not samples. Lot codes are reserved
+through CODES_FILE like every other allocation, so they cannot collide with
+lots already in the target or with running app instances. A new lot has no
+serials yet, so its samples simply take the first positions of its serial
+permutation, as CodeAllocator would hand them out.
+
+The rows are written to a temporary file first and appended to the target
+only once everything converted, so a failed upgrade leaves it untouched.
+A completed upgrade is recorded in ``<target>.upgraded``, and upgrading the
+same LaS1 files into that target again is refused unless ``--force`` is
+given. Run with::
+
+    python las_upgrade.py [--lots lots.csv] [--samples samples.csv] [--data lots_and_samples.csv] [--force]
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+
+from las_codes import CODES_FILE, SERIAL_DIGITS, CodeAllocator, permute
+from las_core import timestamp
+from las_journal import EditJournal
+from las_query import open_data
+from las_storage import FIELDNAMES
+
+LAS1_LOTS = 'lots.csv'
+LAS1_SAMPLES = 'samples.csv'
+LOT_BATCH = 1000  # Lot codes are reserved this many at a time, as each reservation takes the code file lock
+
+
+def read_las1(path):
+    """Stream a headerless LaS1 file as lists of strings, skipping blank lines."""
+    with open(path, newline='', encoding='utf-8') as f:
+        for values in csv.reader(f):
+            if any(values):
+                yield values
+
+
+def with_id(las1_id, notes):
+    las1_id = las1_id.strip()
+    return f"LaS1 ID: {las1_id}\n{notes}" if las1_id else notes
+
+
+class Las1Upgrade:
+    """Turns LaS1 lot and sample rows into FIELDNAMES rows, counting what it did."""
+
+    def __init__(self, codes, edits=None):
+        self.codes = codes  # CodeAllocator aware of the lot codes already in the target
+        self.edits = edits or {}  # LaS1 journal: (sample name, lot name) -> {'notes': ...}
+        self.lot_codes = {}  # LaS1 lot name -> new lot code; the build side of the join
+        self.serials = {}  # Lot code -> samples given a serial so far
+        self.lots = self.samples = self.added_lots = self.duplicate_names = self.edited = 0
+
+    def rows(self, lot_rows, sample_rows):
+        """Yield the lots, then the samples; a lot missing from lot_rows is yielded before its first sample."""
+        batch = []
+        for values in lot_rows:
+            batch.append(values)
+            if len(batch) == LOT_BATCH:
+                yield from self.lot_batch(batch)
+                batch = []
+        yield from self.lot_batch(batch)
+        for values in sample_rows:
+            yield from self.sample(values)
+
+    def lot_batch(self, batch):
+        for values, code in zip(batch, self.codes.reserve_lot_codes(len(batch)) if batch else ()):
+            las1_id, name, notes = (values + ['', '', ''])[:3]
+            name = name.strip()
+            if name in self.lot_codes:
+                self.duplicate_names += 1  # LaS1 files its samples under the first lot of that name
+            else:
+                self.lot_codes[name] = code
+            self.lots += 1
+            yield {'Lot': code, 'Name': name, 'Notes': with_id(las1_id, notes)}
+
+    def sample(self, values):
+        las1_id, name, description, lot_name = (values + ['', '', '', ''])[:4]
+        lot_code = self.lot_codes.get(lot_name.strip())
+        if lot_code is None:
+            lot_code = self.lot_codes[lot_name.strip()] = self.codes.lot_code()
+            self.added_lots += 1
+            yield {'Lot': lot_code, 'Name': lot_name.strip()}
+        position = self.serials.get(lot_code, 0)
+        if position >= 10 ** SERIAL_DIGITS:
+            raise ValueError(f"Lot {lot_name!r} has more than {10 ** SERIAL_DIGITS} samples; LaS3 serials have {SERIAL_DIGITS} digits.")
+        self.serials[lot_code] = position + 1
+        serial = f'{permute(position, SERIAL_DIGITS, lot_code):0{SERIAL_DIGITS}d}'
+        edit = self.edits.get((name, lot_name))
+        if edit and 'notes' in edit:
+            description = edit['notes']
+            self.edited += 1
+        self.samples += 1
+        yield {'Lot': lot_code, 'Serial': serial, 'FullCode': lot_code + serial, 'Name': name.strip(),
+               'Notes': with_id(las1_id, description), 'Active': 'False'}
+
+
+def source_hash(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def upgrade_marker(storage):
+    return storage.path + '.upgraded'
+
+
+def upgraded_sources(marker_path):
+    try:
+        with open(marker_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def upgrade(lots_path=LAS1_LOTS, samples_path=LAS1_SAMPLES, target=None, cursors_path=CODES_FILE, force=False):
+    """Append LaS1 `lots_path` / `samples_path` to the LaS3 data `target` (default: the apps'); return the Las1Upgrade.
+
+    Completed upgrades are recorded by a hash of the LaS1 files next to the
+    target, and the same files are not upgraded into it again unless `force`
+    is set, as that would add every lot and sample a second time.
+    """
+    for path in (lots_path, samples_path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+    storage = open_data(target, create=True)
+    marker_path = upgrade_marker(storage)
+    sources = source_hash([lots_path, samples_path])
+    done = upgraded_sources(marker_path)
+    tmp_path = f'{storage.path}.{os.getpid()}.tmp'
+    try:
+        if not force and any(entry['sources'] == sources for entry in done):
+            raise FileExistsError(f"{lots_path} and {samples_path} were already upgraded into {storage.path}; "
+                                  f"use --force to add them again.")
+        # Only lots matter for collisions: serials are allocated in lots that are all new
+        codes = CodeAllocator(storage.lots(), (), cursors_path)
+        converted = Las1Upgrade(codes, EditJournal(samples_path + '.journal').latest_edits())
+        with open(tmp_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
+            csv.DictWriter(f, fieldnames=FIELDNAMES).writerows(converted.rows(read_las1(lots_path), read_las1(samples_path)))
+        with open(tmp_path, newline='', encoding='utf-8') as f:
+            storage.add_rows(csv.DictReader(f, fieldnames=FIELDNAMES))
+        done.append({'sources': sources, 'lots': lots_path, 'samples': samples_path, 'at': timestamp()})
+        marker_tmp = f'{marker_path}.{os.getpid()}.tmp'
+        with open(marker_tmp, 'w') as f:
+            f.write(json.dumps(done))
+        os.replace(marker_tmp, marker_path)
+    finally:
+        storage.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return converted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upgrade LaS1 lots.csv / samples.csv into the LaS3 data file")
+    parser.add_argument('--lots', default=LAS1_LOTS, metavar='FILE', help=f"LaS1 lots file (default: {LAS1_LOTS})")
+    parser.add_argument('--samples', default=LAS1_SAMPLES, metavar='FILE', help=f"LaS1 samples file (default: {LAS1_SAMPLES})")
+    parser.add_argument('--data', metavar='FILE', help="LaS3 data file or shard directory to add them to (default: the one the apps use)")
+    parser.add_argument('--force', action='store_true', help="upgrade files that were already upgraded into the target")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        converted = upgrade(args.lots, args.samples, args.data, force=args.force)
+    except (OSError, ValueError) as error:
+        parser.exit(1, f"Upgrade failed, nothing was written:\n{error}\n")
+    elapsed = time.perf_counter() - start
+    print(f"Upgraded {converted.lots} lots and {converted.samples} samples in {elapsed:.1f} s "
+          f"({(converted.lots + converted.samples) / elapsed:.0f} rows/sec)")
+    if converted.added_lots:
+        print(f"Created {converted.added_lots} lots that samples referred to but {args.lots} lacked.")
+    if converted.duplicate_names:
+        print(f"{converted.duplicate_names} lots repeat an earlier lot's name; samples of that name went to the first.")
+    if converted.edited:
+        print(f"Applied {converted.edited} journaled note edits.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Background worker that keeps storage I/O off the Tk event loop.
+
+Jobs run one at a time, in submission order, on a single daemon thread, so
+writes reach the storage in the same order the user made them. Results are
+handed back through a queue that the Tk thread drains with ``root.after``;
+callbacks therefore always run on the Tk thread and may touch widgets.
+"""
+import queue
+import threading
+
+POLL_MS = 15  # How often the Tk thread checks for finished jobs (about one frame)
+
+
+class StorageWorker:
+    def __init__(self, root, on_error=None):
+        self.root = root
+        self.on_error = on_error
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.root.after(POLL_MS, self.poll)
+
+    def submit(self, func, *args, callback=None, on_error=None):
+        """Run func(*args) on the worker thread, then callback(result) on the Tk thread.
+
+        If func raises, on_error(error) runs instead (the worker's on_error if not given).
+        """
+        self.jobs.put((func, args, callback, on_error or self.on_error))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            func, args, callback, on_error = job
+            try:
+                result = func(*args)
+            except Exception as error:
+                self.results.put((on_error, error, None))
+            else:
+                self.results.put((callback, result, on_error))
+
+    def poll(self):
+        # Only hand back what is already finished so a burst of results cannot stall a frame
+        try:
+            for _ in range(self.results.qsize()):
+                callback, result, on_error = self.results.get_nowait()
+                try:
+                    if callback:
+                        callback(result)
+                except Exception as error:  # One failing callback must not stop the results after it
+                    if on_error:
+                        on_error(error)
+        finally:
+            self.root.after(POLL_MS, self.poll)  # Keep polling whatever happened, or no result would arrive again
+
+    def close(self):
+        """Let queued jobs (pending writes) finish, then stop the thread."""
+        self.jobs.put(None)
+        self.thread.join()